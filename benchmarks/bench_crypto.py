@@ -0,0 +1,150 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from chirotonia import altbn128
+from chirotonia.backend import backend
+from chirotonia.altbn128 import hashtopoint, sbmul, randsn
+from chirotonia.linkable_ring_signature import LinkableRingSignature
+from chirotonia.uaosring import uaosring_randkeys, uaosring_sign, uaosring_check, pkeys_hash_calculator
+
+"""
+Benchmark del nucleo crittografico al variare della dimensione dell'anello.
+
+Per ogni operazione riporta operazioni al secondo, costo per membro dell'anello e picco di memoria
+(misurato con tracemalloc in un'esecuzione separata, per non falsare i tempi). I risultati si possono
+salvare in JSON e confrontare con un file di riferimento salvato in precedenza:
+
+    python -m benchmarks.bench_crypto -o baseline.json
+    python -m benchmarks.bench_crypto -b baseline.json --threshold 0.1
+
+Con --baseline il processo termina con codice 1 se un'operazione e' piu' lenta del riferimento
+oltre la soglia indicata.
+"""
+
+DEFAULT_SIZES = [2, 10, 100, 1000, 10000]
+
+
+def measure(fn, min_time, max_runs):
+    """
+    Miglior tempo di una singola esecuzione, ripetendo finche' non si supera min_time
+    """
+    best = None
+    total = 0
+    runs = 0
+    while runs < max_runs and (runs == 0 or total < min_time):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        total += elapsed
+        runs += 1
+    return best, runs
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def cases(sizes):
+    """
+    Coppie (operazione, dimensione dell'anello, funzione); None per le operazioni sul singolo punto
+    """
+    message = randsn()
+    yield "hashtopoint", None, lambda: hashtopoint(message)
+    scalar = randsn()
+    sbmul(1)
+    yield "sbmul", None, lambda: sbmul(scalar)
+
+    pkeys, skeys = uaosring_randkeys(max(sizes))
+    for n in sizes:
+        ring = pkeys[:n]
+        signer = (ring[n // 2], skeys[n // 2])
+        _, tag, tees, seed = uaosring_sign(ring, signer, message)
+        signature = LinkableRingSignature(ring, tag, tees, seed, message.to_bytes(32, 'big'))
+        yield "pkeys_hash_calculator", n, lambda: pkeys_hash_calculator(ring)
+        yield "uaosring_sign", n, lambda: uaosring_sign(ring, signer, message)
+        yield "uaosring_check", n, lambda: uaosring_check(ring, tag, tees, seed, message)
+        yield "isValid", n, lambda: signature.isValid()
+
+
+def run(sizes, min_time, max_runs, memory):
+    results = []
+    for operation, n, fn in cases(sizes):
+        seconds, runs = measure(fn, min_time, max_runs)
+        result = {
+            "operation": operation,
+            "ring_size": n,
+            "seconds": seconds,
+            "ops_per_sec": 1 / seconds,
+            "per_member_us": seconds / n * 1e6 if n else None,
+            "peak_kib": peak_memory(fn) / 1024 if memory else None,
+            "runs": runs
+        }
+        print("%-22s %6s %12.6f %12.1f %12s %10s" % (operation, n or '-', seconds, result["ops_per_sec"],
+            "%.1f" % result["per_member_us"] if n else '-', "%.1f" % result["peak_kib"] if memory else '-'), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Rapporto tra i tempi attuali e quelli del riferimento; restituisce le operazioni rallentate oltre la soglia
+    """
+    reference = {(r["operation"], r["ring_size"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    print("\n%-22s %6s %12s %12s %8s" % ("operation", "n", "baseline (s)", "current (s)", "ratio"), file=sys.stderr)
+    for result in results:
+        key = (result["operation"], result["ring_size"])
+        if key not in reference:
+            continue
+        ratio = result["seconds"] / reference[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' REGRESSION'
+            regressions.append(key)
+        print("%-22s %6s %12.6f %12.6f %7.2fx%s" % (key[0], key[1] or '-', reference[key], result["seconds"], ratio, flag), file=sys.stderr)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the ring-signature cryptographic core')
+    parser.add_argument("-s", "--sizes", type=int, nargs='+', help="Ring sizes (default: %s)" % DEFAULT_SIZES, default=DEFAULT_SIZES)
+    parser.add_argument("-t", "--min-time", type=float, help="Minimum seconds spent on each measure", default=1.0)
+    parser.add_argument("-r", "--max-runs", type=int, help="Maximum runs of each measure", default=1000)
+    parser.add_argument("-o", "--output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", type=str, help="Compare with the results stored in this JSON file")
+    parser.add_argument("--threshold", type=float, help="Tolerated slowdown against the baseline (default: 0.1 = 10%%)", default=0.1)
+    parser.add_argument("--no-memory", action="store_true", help="Skip peak memory measures")
+    args = parser.parse_args()
+
+    print("%-22s %6s %12s %12s %12s %10s" % ("operation", "n", "seconds", "ops/s", "us/member", "peak KiB"), file=sys.stderr)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "backend": backend.name,
+        "sbmul_window": altbn128.SBMUL_WINDOW,
+        "timestamp": int(time.time()),
+        "results": run(sorted(set(args.sizes)), args.min_time, args.max_runs, not args.no_memory)
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("backend") != report["backend"]:
+            print("Warning: baseline measured with backend %s" % baseline.get("backend"), file=sys.stderr)
+        if compare(report["results"], baseline, args.threshold):
+            exit(1)
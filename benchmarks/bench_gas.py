@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+"""
+Gas usato dal contratto Chirotonia al variare della dimensione dell'anello, su una EVM in-process
+(eth-tester con backend py-evm), senza nodo e senza rete.
+
+Il contratto viene usato tramite chirotonia/ethereum/contract.py, come fanno gli script eth_*:
+per ogni dimensione si crea una votazione, si accreditano i votanti, la si avvia, si votano alcune
+schede e la si chiude, annotando il gas di ogni transazione. Contract usa gli artefatti prodotti
+dal compilatore di docker-compose (Chirotonia.bin, Chirotonia.abi); con --compile vengono
+rigenerati da contracts/Chirotonia.sol con py-solc-x e il solc 0.5.13 installato in locale.
+Con --shard-size il primo voto di ogni shard, che calcola e salva il punto L dello shard,
+e' riportato a parte come "votaShard first".
+
+    python -m benchmarks.bench_gas -o gas.json
+    python -m benchmarks.bench_gas -b gas.json
+
+Come bench_crypto, con --baseline il processo termina con codice 1 se un'operazione consuma
+piu' gas del riferimento oltre la soglia indicata.
+
+Richiede: pip install "web3[tester]" py-solc-x
+"""
+
+DEFAULT_SIZES = [2, 4, 8, 16, 32]
+# EIP-170, come chirotonia.ethereum.contract.MAX_CODE_SIZE (contract va importato dopo la compilazione)
+MAX_CODE_SIZE = 24576
+SOLC_VERSION = '0.5.13'
+ROOT = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+
+
+def compile_contract():
+    """
+    Compila il contratto come il servizio contract_compiler di docker-compose (--optimize)
+    """
+    import solcx
+    source = os.path.join(ROOT, 'contracts', 'Chirotonia.sol')
+    output = solcx.compile_files([source], output_values=['abi', 'bin', 'bin-runtime'], solc_version=SOLC_VERSION,
+        optimize=True, allow_paths=[os.path.join(ROOT, 'contracts')])
+    compiled = next(v for k, v in output.items() if k.endswith(':Chirotonia'))
+    print("Creation bytecode %d bytes, runtime bytecode %d bytes (EIP-170 limit %d)" % (len(compiled['bin']) // 2,
+        len(compiled['bin-runtime']) // 2, MAX_CODE_SIZE), file=sys.stderr)
+    if len(compiled['bin-runtime']) // 2 > MAX_CODE_SIZE:
+        print("Warning: the runtime bytecode exceeds the EIP-170 limit, the contract cannot be deployed on mainnet-like chains", file=sys.stderr)
+    with open(os.path.join(ROOT, 'Chirotonia.bin'), 'w') as bin_file:
+        bin_file.write(compiled['bin'])
+    with open(os.path.join(ROOT, 'Chirotonia.abi'), 'w') as abi_file:
+        json.dump(compiled['abi'], abi_file)
+
+
+def local_chain(gas_limit):
+    from eth_tester import EthereumTester, PyEVMBackend
+    from eth_tester.backends.pyevm.main import get_default_genesis_params
+    from web3 import Web3, EthereumTesterProvider
+    backend = PyEVMBackend(genesis_parameters=get_default_genesis_params({'gas_limit': gas_limit}))
+    w3 = Web3(EthereumTesterProvider(EthereumTester(backend)))
+    w3.eth.defaultAccount = w3.eth.accounts[0]
+    return w3
+
+
+def summary(operation, n, gas_values):
+    return {
+        "operation": operation,
+        "ring_size": n,
+        "gas": sum(gas_values) // len(gas_values),
+        "min": min(gas_values),
+        "max": max(gas_values),
+        "per_member": sum(gas_values) / len(gas_values) / n if n else None,
+        "samples": len(gas_values)
+    }
+
+
+def run(w3, chirotonia, sizes, ballots, shard_size):
+    from chirotonia.uaosring import RingContext
+    from chirotonia.voter import Voter
+
+    manager, identity_manager = w3.eth.accounts[0], w3.eth.accounts[1]
+    used = lambda receipt: receipt.gasUsed if receipt.status else None
+    results = []
+    for n in sizes:
+        vote_id = 'gas-%d' % n
+        w3.eth.defaultAccount = manager
+        gas = {
+            "nuovaVotazione": [used(chirotonia.create_vote(vote_id, 'Benchmark', sync=True))],
+            "impostaScelta": [used(chirotonia.set_choice(vote_id, c, 'Scelta %d' % c, sync=True)) for c in range(2)]
+        }
+        w3.eth.defaultAccount = identity_manager
+        if shard_size:
+            chirotonia.set_shard_size(vote_id, shard_size, sync=True)
+        voters = [Voter() for _ in range(n)]
+        gas["accreditaVotante"] = [used(chirotonia.register_voter('voter %d' % i, v.public_key[0].n, v.public_key[1].n, vote_id, sync=True))
+            for i, v in enumerate(voters)]
+        w3.eth.defaultAccount = manager
+        gas["avviaVotazione"] = [used(chirotonia.start_vote(vote_id, sync=True))]
+
+        w3.eth.defaultAccount = w3.eth.accounts[2]
+        pkeys = [v.public_key for v in voters]
+        ring = pkeys if shard_size else RingContext(pkeys)
+        gas["votaShard" if shard_size else "vota"] = []
+        voted_shards = set()
+        for i in range(min(ballots, n)):
+            signature = voters[i].ring_sign(ring, Voter.pack_vote_in_random32(bytes([i % 2])), shard_size=shard_size)
+            receipt = chirotonia.vote(vote_id, signature, sync=True)
+            if shard_size and signature.shard not in voted_shards:
+                # Il primo voto di uno shard ne calcola e salva il punto L: misurato a parte
+                voted_shards.add(signature.shard)
+                gas.setdefault("votaShard first", []).append(used(receipt))
+            else:
+                gas["votaShard" if shard_size else "vota"].append(used(receipt))
+        w3.eth.defaultAccount = manager
+        gas["chiudiVotazione"] = [used(chirotonia.stop_vote(vote_id, sync=True))]
+
+        for operation, gas_values in gas.items():
+            if not gas_values:
+                continue
+            if None in gas_values:
+                raise RuntimeError("%s failed with ring size %d" % (operation, n))
+            result = summary(operation, n, gas_values)
+            print("%-18s %6d %12d %12d %12d %12s" % (operation, n, result["gas"], result["min"], result["max"],
+                "%.0f" % result["per_member"]), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Rapporto tra il gas attuale e quello del riferimento; restituisce le operazioni peggiorate oltre la soglia
+    """
+    reference = {(r["operation"], r["ring_size"]): r["gas"] for r in baseline["results"]}
+    regressions = []
+    print("\n%-18s %6s %12s %12s %8s" % ("operation", "n", "baseline", "current", "ratio"), file=sys.stderr)
+    for result in results:
+        key = (result["operation"], result["ring_size"])
+        if key not in reference:
+            continue
+        ratio = result["gas"] / reference[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' REGRESSION'
+            regressions.append(key)
+        print("%-18s %6d %12d %12d %7.3fx%s" % (key[0], key[1], reference[key], result["gas"], ratio, flag), file=sys.stderr)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Gas used by the Chirotonia contract on an in-process EVM')
+    parser.add_argument("-s", "--sizes", type=int, nargs='+', help="Ring sizes (default: %s)" % DEFAULT_SIZES, default=DEFAULT_SIZES)
+    parser.add_argument("-n", "--ballots", type=int, help="Ballots cast for each ring size", default=3)
+    parser.add_argument("--shard-size", type=int, help="Split each vote in shards of this size")
+    parser.add_argument("--compile", action="store_true", help="Compile contracts/Chirotonia.sol with the local solc %s first" % SOLC_VERSION)
+    parser.add_argument("--gas-limit", type=int, help="Block gas limit of the local chain", default=100000000)
+    parser.add_argument("-o", "--output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", type=str, help="Compare with the results stored in this JSON file")
+    parser.add_argument("--threshold", type=float, help="Tolerated gas increase against the baseline (default: 0.01 = 1%%)", default=0.01)
+    args = parser.parse_args()
+
+    if args.compile:
+        compile_contract()
+    bytecode_path = os.path.join(ROOT, 'Chirotonia.bin')
+    if not os.path.exists(bytecode_path):
+        print("Chirotonia.bin not found: compile the contract with docker-compose or run with --compile", file=sys.stderr)
+        exit(2)
+    sources = [os.path.join(ROOT, 'contracts', f) for f in ('Chirotonia.sol', os.path.join('lib', 'altbn128.sol'))]
+    if any(os.path.getmtime(source) > os.path.getmtime(bytecode_path) for source in sources):
+        print("Warning: Chirotonia.bin is older than the contract sources, the figures may not match them", file=sys.stderr)
+    # contract_data legge gli artefatti all'import: va importato dopo la compilazione
+    from chirotonia.ethereum.contract import Contract
+
+    w3 = local_chain(args.gas_limit)
+    chirotonia = Contract(w3)
+    deployment = chirotonia.deploy(w3.eth.accounts[1], gas=args.gas_limit)
+    print("%-18s %6s %12s %12s %12s %12s" % ("operation", "n", "gas", "min", "max", "per member"), file=sys.stderr)
+    print("%-18s %6s %12d %12s %12s %12s" % ("deploy", '-', deployment.gasUsed, '', '', "%d bytes" % chirotonia.code_size()), file=sys.stderr)
+    report = {
+        # Identifica la versione del contratto misurata
+        "bytecode_sha256": hashlib.sha256(open(bytecode_path, 'rb').read()).hexdigest(),
+        "shard_size": args.shard_size,
+        "timestamp": int(time.time()),
+        "deploy": deployment.gasUsed,
+        "code_size": chirotonia.code_size(),
+        "results": run(w3, chirotonia, sorted(set(args.sizes)), args.ballots, args.shard_size)
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("shard_size") != report["shard_size"]:
+            print("Warning: baseline measured with shard size %s" % baseline.get("shard_size"), file=sys.stderr)
+        if compare(report["results"], baseline, args.threshold):
+            exit(1)
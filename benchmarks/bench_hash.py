@@ -0,0 +1,62 @@
+import argparse
+import timeit
+from functools import reduce
+
+from sha3 import keccak_256
+
+from chirotonia.altbn128 import evalcurve, randsp
+from chirotonia.utils import hashs, hash_link, hash_chain, bytes_to_int, powmod, packl, zpad
+
+"""
+Microbenchmark del kernel di hashing usato nel ciclo dell'anello.
+
+Confronta le implementazioni precedenti di hashs/bytes_to_int (hex -> unhexlify -> zpad, reduce
+sui byte del digest) e di evalcurve (powmod scritto a mano) con quelle attuali.
+
+    python -m benchmarks.bench_hash -n 100000
+"""
+
+legacy_bytes_to_int = lambda x: reduce(lambda o, b: (o << 8) + b, [0] + list(x))
+legacy_tobe256 = lambda v: zpad(packl(v), 32)
+
+def legacy_hashs(*x):
+    data = b''.join(map(legacy_tobe256, x))
+    return legacy_bytes_to_int(keccak_256(data).digest())
+
+def legacy_evalcurve(x):
+    from py_ecc.bn128 import field_modulus
+    a = 5472060717959818805561601436314318772174077789324455915672259473661306552146
+    beta = (x * x * x + 3) % field_modulus
+    return beta, powmod(beta, a, field_modulus)
+
+
+def measure(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-hash cost of the ring-signature hashing kernel')
+    parser.add_argument("-n", "--number", type=int, help="Iterations per measure", default=100000)
+    args = parser.parse_args()
+
+    link = [randsp() for _ in range(6)]
+    chain = link[:2]
+    digest = keccak_256(b'chirotonia').digest()
+    x = randsp()
+
+    assert legacy_hashs(*link) == hashs(*link) == hash_link(*link)
+    assert legacy_hashs(*chain) == hashs(*chain) == hash_chain(*chain)
+    assert legacy_evalcurve(x) == evalcurve(x)
+
+    cases = [
+        ("hashp(T, a, b)", lambda: legacy_hashs(*link), lambda: hash_link(*link)),
+        ("hashs(h, link)", lambda: legacy_hashs(*chain), lambda: hash_chain(*chain)),
+        ("hashs(6 ints)", lambda: legacy_hashs(*link), lambda: hashs(*link)),
+        ("bytes_to_int(32 bytes)", lambda: legacy_bytes_to_int(digest), lambda: bytes_to_int(digest)),
+        ("evalcurve", lambda: legacy_evalcurve(x), lambda: evalcurve(x)),
+    ]
+    print("%-24s %12s %12s %8s" % ("operation", "before (us)", "after (us)", "speedup"))
+    for name, before, after in cases:
+        number = args.number if name != "evalcurve" else max(1, args.number // 100)
+        b, a = measure(before, number), measure(after, number)
+        print("%-24s %12.2f %12.2f %7.1fx" % (name, b, a, b / a))
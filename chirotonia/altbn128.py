@@ -1,16 +1,17 @@
+import os
 from random import randint
 
 from py_ecc import bn128
 from py_ecc.bn128 import add, multiply, curve_order, G1
 from py_ecc.bn128.bn128_field_elements import inv, field_modulus, FQ
 
-from .utils import hashs, bytes_to_int, powmod
+from .backend import backend
+from .utils import hashs, bytes_to_int
 
 asint = lambda x: x.n if isinstance(x, FQ) else x
 
 randsn = lambda: randint(1, curve_order - 1)
 randsp = lambda: randint(1, field_modulus - 1)
-sbmul = lambda s: multiply(G1, asint(s))
 hashsn = lambda *x: hashs(*x) % curve_order
 hashpn = lambda *x: hashsn(*[item.n for sublist in x for item in sublist])
 hashp = lambda *x: hashs(*[item.n for sublist in x for item in sublist])
@@ -20,15 +21,15 @@ mulmodn = lambda x, y: (x * y) % curve_order
 mulmodp = lambda x, y: (x * y) % field_modulus
 submodn = lambda x, y: (x - y) % curve_order
 submodp = lambda x, y: (x - y) % field_modulus
-invmodn = lambda x: inv(x, curve_order)
-invmodp = lambda x: inv(x, field_modulus)
+invmodn = lambda x: backend.invert(x, curve_order)
+invmodp = lambda x: backend.invert(x, field_modulus)
 negp = lambda x: (x[0], -x[1])
 
 
 def evalcurve(x):
 	a = 5472060717959818805561601436314318772174077789324455915672259473661306552146
 	beta = addmodp(mulmodp(mulmodp(x, x), x), 3)
-	y = powmod(beta, a, field_modulus)
+	y = int(backend.powmod(beta, a, field_modulus))
 	return (beta, y)
 
 
@@ -47,6 +48,330 @@ def hashtopoint(x: int):
 		x = addmodn(x, 1)
 
 
+# Compressione dei punti: x piu' la parita' di y. In forma di byte (33) il prefisso e' 0x02/0x03
+# come in SEC1; in forma di parola (per il contratto) la parita' occupa il bit 255 di x,
+# libero perche' x < p < 2^254.
+def decompress_x(x: int, odd: bool):
+	if x >= field_modulus:
+		raise ValueError("Invalid compressed point")
+	beta, y = evalcurve(x)
+	if beta != mulmodp(y, y):
+		raise ValueError("Invalid compressed point")
+	if (y & 1) != odd:
+		y = field_modulus - y
+	return FQ(x), FQ(y)
+
+
+compress_point = lambda P: bytes([2 + (asint(P[1]) & 1)]) + asint(P[0]).to_bytes(32, 'big')
+compress_word = lambda P: asint(P[0]) | (asint(P[1]) & 1) << 255
+
+
+def decompress_point(data: bytes):
+	if len(data) != 33 or data[0] not in (2, 3):
+		raise ValueError("Invalid compressed point")
+	return decompress_x(int.from_bytes(data[1:], 'big'), data[0] == 3)
+
+
+decompress_word = lambda k: decompress_x(k & ((1 << 255) - 1), k >> 255 == 1)
+
+
+# Aritmetica in coordinate Jacobiane (X, Y, Z) -> (X/Z^2, Y/Z^3) su interi Python.
+# Evita l'inversione modulare ad ogni somma/raddoppio: si normalizza in affine
+# solo quando servono le coordinate reali (ad es. per l'hash), in blocco.
+# Con il backend gmpy2 le coordinate interne sono mpz; in uscita (affine) sono sempre int.
+JINF = (1, 1, 0)
+FIELD_P = backend.mpz(field_modulus)
+mpz = backend.mpz
+
+def to_jacobian(P):
+	if P is None:
+		return JINF
+	return (mpz(asint(P[0])), mpz(asint(P[1])), mpz(1))
+
+
+def jacobian_double(P):
+	X, Y, Z = P
+	if not Z or not Y:
+		return JINF
+	p = FIELD_P
+	A = X * X % p
+	B = Y * Y % p
+	C = B * B % p
+	D = 2 * ((X + B) * (X + B) - A - C) % p
+	E = 3 * A % p
+	X3 = (E * E - 2 * D) % p
+	Y3 = (E * (D - X3) - 8 * C) % p
+	Z3 = 2 * Y * Z % p
+	return (X3, Y3, Z3)
+
+
+def jacobian_add(P, Q):
+	X1, Y1, Z1 = P
+	X2, Y2, Z2 = Q
+	if not Z1:
+		return Q
+	if not Z2:
+		return P
+	p = FIELD_P
+	Z1Z1 = Z1 * Z1 % p
+	Z2Z2 = Z2 * Z2 % p
+	U1 = X1 * Z2Z2 % p
+	U2 = X2 * Z1Z1 % p
+	S1 = Y1 * Z2 * Z2Z2 % p
+	S2 = Y2 * Z1 * Z1Z1 % p
+	H = (U2 - U1) % p
+	R = (S2 - S1) % p
+	if not H:
+		return jacobian_double(P) if not R else JINF
+	HH = H * H % p
+	HHH = H * HH % p
+	V = U1 * HH % p
+	X3 = (R * R - HHH - 2 * V) % p
+	Y3 = (R * (V - X3) - S1 * HHH) % p
+	Z3 = Z1 * Z2 * H % p
+	return (X3, Y3, Z3)
+
+
+jacobian_neg = lambda P: (P[0], -P[1] % FIELD_P, P[2])
+
+
+def batch_invmodp(values):
+	"""
+	Inverte una lista di elementi di Fp non nulli con una sola inversione (trucco di Montgomery)
+	"""
+	acc = 1
+	prefix = []
+	for v in values:
+		prefix.append(acc)
+		acc = acc * v % FIELD_P
+	acc = invmodp(acc)
+	result = [0] * len(values)
+	for i in range(len(values) - 1, -1, -1):
+		result[i] = acc * prefix[i] % FIELD_P
+		acc = acc * values[i] % FIELD_P
+	return result
+
+
+def jacobian_normalize(points):
+	"""
+	Riporta in coordinate affini (interi) una lista di punti Jacobiani usando un'unica inversione.
+	Il punto all'infinito viene restituito come None, come in py_ecc.
+	"""
+	finite = [i for i, P in enumerate(points) if P[2]]
+	inverses = batch_invmodp([points[i][2] for i in finite])
+	result = [None] * len(points)
+	for i, zinv in zip(finite, inverses):
+		X, Y, _ = points[i]
+		zinv2 = zinv * zinv % FIELD_P
+		result[i] = (int(X * zinv2 % FIELD_P), int(Y * zinv2 * zinv % FIELD_P))
+	return result
+
+
+def from_jacobian(P):
+	affine = jacobian_normalize([P])[0]
+	return None if affine is None else (FQ(affine[0]), FQ(affine[1]))
+
+
+def jacobian_add_affine(P, Q):
+	"""
+	Somma mista: P in coordinate Jacobiane, Q affine (interi) con Z = 1
+	"""
+	X1, Y1, Z1 = P
+	if not Z1:
+		return (Q[0], Q[1], 1)
+	p = FIELD_P
+	Z1Z1 = Z1 * Z1 % p
+	U2 = Q[0] * Z1Z1 % p
+	S2 = Q[1] * Z1 * Z1Z1 % p
+	H = (U2 - X1) % p
+	R = (S2 - Y1) % p
+	if not H:
+		return jacobian_double(P) if not R else JINF
+	HH = H * H % p
+	HHH = H * HH % p
+	V = X1 * HH % p
+	X3 = (R * R - HHH - 2 * V) % p
+	Y3 = (R * (V - X3) - Y1 * HHH) % p
+	Z3 = Z1 * H % p
+	return (X3, Y3, Z3)
+
+
+# Moltiplicazione multi-scalare (Straus) con rappresentazione wNAF degli scalari.
+# Ogni termine e' una coppia (tabella, scalare) dove la tabella contiene i multipli dispari
+# P, 3P, ..., (2^(w-1)-1)P del punto; i raddoppi sono condivisi da tutti i termini.
+# Le tabelle riutilizzate piu' volte (L e T nel ciclo dell'anello) conviene normalizzarle
+# in affine per usare le somme miste.
+WNAF_WINDOW = 4
+
+
+def wnaf(k: int, window: int):
+	"""
+	Rappresentazione wNAF di k, dalla cifra meno significativa
+	"""
+	if k < 0:
+		return [-d for d in wnaf(-k, window)]
+	digits = []
+	full = 1 << window
+	half = 1 << (window - 1)
+	while k:
+		if k & 1:
+			d = k & (full - 1)
+			if d >= half:
+				d -= full
+			k -= d
+		else:
+			d = 0
+		digits.append(d)
+		k >>= 1
+	return digits
+
+
+def wnaf_table(P, window: int = WNAF_WINDOW, affine: bool = False):
+	table = [P]
+	if window > 2:
+		P2 = jacobian_double(P)
+		for _ in range((1 << (window - 2)) - 1):
+			table.append(jacobian_add(table[-1], P2))
+	if affine:
+		table = jacobian_normalize(table)
+	return table
+
+
+# Endomorfismo GLV di BN254: phi(x, y) = (beta*x, y) = lambda*(x, y), con beta e lambda
+# radici cubiche dell'unita' in Fp e in Fn. Uno scalare k si scompone in k1 + k2*lambda con
+# |k1|, |k2| < 2^128 usando una base ridotta del reticolo {(a, b) : a + b*lambda = 0 mod n},
+# cosi' k*P = k1*P + k2*phi(P) richiede meta' dei raddoppi.
+GLV_BETA = 0x30644e72e131a0295e6dd9e7e0acccb0c28f069fbb966e3de4bd44e5607cfd48
+GLV_LAMBDA = 0x30644e72e131a029048b6e193fd84104cc37a73fec2bc5e9b8ca0b2d36636f23
+GLV_BASIS = (
+	(147946756881789319000765030803803410728, -9931322734385697763),
+	(9931322734385697763, 147946756881789319010696353538189108491),
+)
+
+
+def glv_decompose(k: int):
+	(a1, b1), (a2, b2) = GLV_BASIS
+	n = curve_order
+	c1 = (b2 * k + n // 2) // n
+	c2 = (-b1 * k + n // 2) // n
+	k1 = k - c1 * a1 - c2 * a2
+	k2 = -c1 * b1 - c2 * b2
+	return k1, k2
+
+
+glv_endomorphism = lambda table: [(GLV_BETA * Q[0] % FIELD_P,) + tuple(Q[1:]) for Q in table]
+
+
+def multi_multiply_jacobian(terms, window: int = WNAF_WINDOW, glv: bool = True):
+	"""
+	Calcola sum(k_i * P_i) per terms = [(tabella di P_i, k_i), ...]
+	Con glv=True ogni termine viene diviso in due termini con scalari di meta' lunghezza.
+	"""
+	p = FIELD_P
+	expanded = []
+	for table, k in terms:
+		k = asint(k) % curve_order
+		if not k or table[0] is None:
+			continue
+		add = jacobian_add_affine if len(table[0]) == 2 else jacobian_add
+		if glv:
+			k1, k2 = glv_decompose(k)
+			expanded.append((table, wnaf(k1, window), add))
+			expanded.append((glv_endomorphism(table), wnaf(k2, window), add))
+		else:
+			expanded.append((table, wnaf(k, window), add))
+	R = JINF
+	for i in range(max([len(digits) for _, digits, _ in expanded] or [0]) - 1, -1, -1):
+		R = jacobian_double(R)
+		for table, digits, add in expanded:
+			if i < len(digits) and digits[i]:
+				d = digits[i]
+				if d > 0:
+					R = add(R, table[d >> 1])
+				else:
+					Q = table[-d >> 1]
+					R = add(R, (Q[0], p - Q[1]) + tuple(Q[2:]))
+	return R
+
+
+jacobian_multiply = lambda P, n: multi_multiply_jacobian([(wnaf_table(P), n)])
+
+
+# Tabelle a base fissa, usate per il generatore G1 e per i punti noti in anticipo.
+# Lo scalare viene scomposto in cifre con segno di w bit: per ogni finestra i
+# la tabella contiene j * 2^(w*i) * P per j = 1..2^(w-1), in coordinate affini.
+# Una moltiplicazione costa cosi' circa 254/w somme miste e nessun raddoppio.
+# La tabella occupa (254/w) * 2^(w-1) punti: con finestre piccole si risparmia memoria.
+def signed_digits(k: int, window: int, count: int):
+	"""
+	Scompone k in `count` cifre con segno in [-2^(w-1), 2^(w-1)], dalla meno significativa
+	"""
+	mask = (1 << window) - 1
+	half = 1 << (window - 1)
+	digits = []
+	for _ in range(count):
+		d = k & mask
+		k >>= window
+		if d > half:
+			d -= 1 << window
+			k += 1
+		digits.append(d)
+	assert k == 0
+	return digits
+
+
+def fixed_base_table(P, window: int):
+	count = (curve_order.bit_length() + window) // window
+	points = []
+	base = P
+	for _ in range(count):
+		Q = base
+		for _ in range(1 << (window - 1)):
+			points.append(Q)
+			Q = jacobian_add(Q, base)
+		for _ in range(window):
+			base = jacobian_double(base)
+	points = jacobian_normalize(points)
+	size = 1 << (window - 1)
+	return (window, count, [points[i * size:(i + 1) * size] for i in range(count)])
+
+
+def fixed_base_multiply_jacobian(table, s):
+	w, count, rows = table
+	R = JINF
+	for row, d in zip(rows, signed_digits(asint(s) % curve_order, w, count)):
+		if d > 0:
+			R = jacobian_add_affine(R, row[d - 1])
+		elif d < 0:
+			x, y = row[-d - 1]
+			R = jacobian_add_affine(R, (x, FIELD_P - y))
+	return R
+
+
+# La tabella del generatore viene costruita al primo utilizzo. La finestra predefinita
+# (8 bit, 4096 punti) si puo' ridurre con CHIROTONIA_SBMUL_WINDOW sui client con poca memoria.
+SBMUL_WINDOW = int(os.environ.get('CHIROTONIA_SBMUL_WINDOW', 8))
+_sbmul_table = None
+
+
+def set_sbmul_window(window: int):
+	global SBMUL_WINDOW, _sbmul_table
+	assert 1 <= window <= 16
+	SBMUL_WINDOW = window
+	_sbmul_table = None
+
+
+def sbmul_table():
+	global _sbmul_table
+	if _sbmul_table is None:
+		_sbmul_table = fixed_base_table(to_jacobian(G1), SBMUL_WINDOW)
+	return _sbmul_table
+
+
+sbmul_jacobian = lambda s: fixed_base_multiply_jacobian(sbmul_table(), s)
+sbmul = lambda s: from_jacobian(sbmul_jacobian(s))
+
+
 if __name__ == "__main__":
 	# Sanity test
 	beta, y = evalcurve(1)
@@ -55,10 +380,57 @@ if __name__ == "__main__":
 
 	# Compatibility test
 	from hashlib import sha256
-	z = bytes_to_int(sha256('hello world').digest())
+	z = bytes_to_int(sha256(b'hello world').digest())
 	x, y = hashtopoint(z)
 	assert x == 18149469767584732552991861025120904666601524803017597654373315627649680264678
 	assert y == 18593544354303197021588991433499968191850988132424885073381608163097237734820
 
 	# Compatibility with: uint256(keccak256(uint256(1), uint256(2), uint256(3))) % Curve.N();
 	assert hashsn(1, 2, 3) == 5999809398626971894156481321441750001229812699285374901473004231265197659290
+
+	# Point compression round trip
+	for k in [1, 2, randsn(), curve_order - 1]:
+		P = multiply(G1, k)
+		assert decompress_point(compress_point(P)) == P
+		assert decompress_word(compress_word(P)) == P
+	assert compress_point(G1) == b'\x02' + (1).to_bytes(32, 'big')
+
+	# Jacobian arithmetic must match py_ecc affine arithmetic
+	P = multiply(G1, randsn())
+	for k in [0, 1, 2, randsn(), curve_order - 1]:
+		assert from_jacobian(jacobian_multiply(to_jacobian(P), k)) == multiply(P, k)
+	assert from_jacobian(jacobian_add(to_jacobian(P), to_jacobian(G1))) == add(P, G1)
+	assert from_jacobian(jacobian_add(to_jacobian(P), to_jacobian(P))) == add(P, P)
+	assert from_jacobian(jacobian_add(to_jacobian(P), jacobian_neg(to_jacobian(P)))) is None
+	assert from_jacobian(jacobian_add_affine(to_jacobian(P), (G1[0].n, G1[1].n))) == add(P, G1)
+
+	# Multi-scalar multiplication against the naive sum
+	Q = multiply(G1, randsn())
+	for j, k in [(randsn(), randsn()), (0, randsn()), (1, curve_order - 1), (curve_order - 1, curve_order - 1)]:
+		expected = add(multiply(P, j), multiply(Q, k))
+		for window in [2, 4, 5]:
+			for affine in [False, True]:
+				terms = [(wnaf_table(to_jacobian(P), window, affine), j), (wnaf_table(to_jacobian(Q), window, affine), k)]
+				assert from_jacobian(multi_multiply_jacobian(terms, window, glv=False)) == expected
+				assert from_jacobian(multi_multiply_jacobian(terms, window, glv=True)) == expected
+
+	# GLV endomorphism and scalar decomposition
+	assert (G1[0].n * GLV_BETA % field_modulus, G1[1].n) == tuple(c.n for c in multiply(G1, GLV_LAMBDA))
+	for a, b in GLV_BASIS:
+		assert (a + b * GLV_LAMBDA) % curve_order == 0
+	for k in [0, 1, 2, GLV_LAMBDA, curve_order - 1] + [randsn() for _ in range(50)]:
+		k1, k2 = glv_decompose(k)
+		assert (k1 + k2 * GLV_LAMBDA - k) % curve_order == 0
+		assert abs(k1).bit_length() <= 128 and abs(k2).bit_length() <= 128
+	for k in [0, 1, 2, GLV_LAMBDA, curve_order - 1, curve_order, curve_order + 1] + [randsn() for _ in range(20)]:
+		assert from_jacobian(jacobian_multiply(to_jacobian(P), k)) == multiply(P, k % curve_order)
+		assert from_jacobian(multi_multiply_jacobian([(wnaf_table(to_jacobian(P), 5, True), k)], 5)) == multiply(P, k % curve_order)
+
+	# Fixed-base generator multiplication, for every window size
+	for window in [1, 4, 5, 8]:
+		set_sbmul_window(window)
+		for k in [0, 1, 2, randsn(), curve_order - 1]:
+			assert sbmul(k) == multiply(G1, k)
+	table = fixed_base_table(to_jacobian(P), 6)
+	for k in [0, 1, randsn(), curve_order - 1]:
+		assert from_jacobian(fixed_base_multiply_jacobian(table, k)) == multiply(P, k)
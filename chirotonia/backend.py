@@ -0,0 +1,62 @@
+import os
+
+from py_ecc.bn128.bn128_field_elements import inv
+
+"""
+Backend aritmetico per le operazioni su interi grandi usate da altbn128.
+
+Il backend viene scelto all'import tramite la variabile d'ambiente CHIROTONIA_BACKEND:
+
+ - python: interi Python, `pow` built-in e `inv` di py_ecc
+ - gmpy2: interi `mpz` di gmpy2 con `powmod`/`invert` nativi (pip install gmpy2)
+ - auto (default): gmpy2 se installato, altrimenti python
+
+"""
+
+class PythonBackend:
+    name = 'python'
+    mpz = int
+    powmod = staticmethod(pow)
+    invert = staticmethod(inv)
+
+
+class Gmpy2Backend:
+    name = 'gmpy2'
+
+    def __init__(self):
+        import gmpy2
+        self.mpz = gmpy2.mpz
+        self.powmod = gmpy2.powmod
+        self.invert = gmpy2.invert
+
+
+def load_backend(name: str):
+    if name == 'python':
+        return PythonBackend()
+    if name == 'gmpy2':
+        return Gmpy2Backend()
+    if name == 'auto':
+        try:
+            return Gmpy2Backend()
+        except ImportError:
+            return PythonBackend()
+    raise ValueError("Unknown arithmetic backend %s" % name)
+
+
+backend = load_backend(os.environ.get('CHIROTONIA_BACKEND', 'auto'))
+
+
+if __name__ == "__main__":
+    from random import randint
+    from py_ecc.bn128 import curve_order, field_modulus
+
+    backends = [PythonBackend()]
+    try:
+        backends.append(Gmpy2Backend())
+    except ImportError:
+        print("gmpy2 not installed, checking only the python backend")
+    for _ in range(20):
+        a, b = randint(1, field_modulus - 1), randint(1, field_modulus - 1)
+        for m in [curve_order, field_modulus]:
+            assert len(set(int(bk.powmod(bk.mpz(a), bk.mpz(b), bk.mpz(m))) for bk in backends)) == 1
+            assert len(set(int(bk.invert(bk.mpz(a), bk.mpz(m))) for bk in backends)) == 1
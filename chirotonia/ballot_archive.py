@@ -0,0 +1,84 @@
+import mmap
+import os
+import struct
+
+from .linkable_ring_signature import LinkableRingSignature
+
+"""
+Archivio di firme in sola aggiunta. Dopo un'intestazione fissa, il file contiene record
+(lunghezza uint32 big-endian, firma nel formato di LinkableRingSignature.to_bytes).
+La lettura mappa il file in memoria e restituisce firme che sono viste sul file stesso.
+Un ultimo record scritto solo in parte (interruzione durante append) viene rimosso all'apertura:
+altrimenti la sua lunghezza ingloberebbe i record aggiunti dopo.
+"""
+
+ARCHIVE_MAGIC = b'CHBALL\x00\x01'
+RECORD_LENGTH = struct.Struct('>I')
+
+
+class BallotArchive:
+    def __init__(self, path: str):
+        self.path = path
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as archive_file:
+                archive_file.write(ARCHIVE_MAGIC)
+        with open(path, 'rb') as archive_file:
+            if archive_file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError("%s is not a ballot archive" % path)
+        complete = self.complete_size()
+        if complete < os.path.getsize(path):
+            os.truncate(path, complete)
+
+    def complete_size(self) -> int:
+        """
+        Byte occupati dall'intestazione e dai record completi; legge solo le lunghezze
+        """
+        size = os.path.getsize(self.path)
+        offset = len(ARCHIVE_MAGIC)
+        with open(self.path, 'rb') as archive_file:
+            while offset + RECORD_LENGTH.size <= size:
+                archive_file.seek(offset)
+                length, = RECORD_LENGTH.unpack(archive_file.read(RECORD_LENGTH.size))
+                if offset + RECORD_LENGTH.size + length > size:
+                    break
+                offset += RECORD_LENGTH.size + length
+        return offset
+
+    def append(self, *signatures: LinkableRingSignature):
+        with open(self.path, 'ab') as archive_file:
+            start = archive_file.tell()
+            try:
+                for signature in signatures:
+                    record = signature.to_bytes()
+                    archive_file.write(RECORD_LENGTH.pack(len(record)) + record)
+                archive_file.flush()
+            except BaseException:
+                # Nessun record a meta': l'archivio torna com'era prima dell'aggiunta
+                archive_file.truncate(start)
+                raise
+
+    def records(self):
+        """
+        Scorre i record come memoryview sul file mappato, senza copie.
+        La mappatura resta aperta finche' esistono viste (firme) che la usano.
+        """
+        if os.path.getsize(self.path) == len(ARCHIVE_MAGIC):
+            return
+        with open(self.path, 'rb') as archive_file:
+            view = memoryview(mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ))
+        offset = len(ARCHIVE_MAGIC)
+        while offset + RECORD_LENGTH.size <= len(view):
+            length, = RECORD_LENGTH.unpack_from(view, offset)
+            offset += RECORD_LENGTH.size
+            if offset + length > len(view):
+                # Ultimo record scritto solo in parte
+                break
+            yield view[offset:offset + length]
+            offset += length
+
+    def signatures(self, pkeys=None):
+        for record in self.records():
+            yield LinkableRingSignature.from_buffer(record, pkeys)
+
+    def __iter__(self):
+        return self.signatures()
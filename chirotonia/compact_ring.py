@@ -0,0 +1,125 @@
+import mmap
+
+from .altbn128 import compress_point, decompress_point
+from .curve import asint
+
+"""
+Rappresentazione compatta di un anello di chiavi pubbliche: ogni chiave occupa 64 byte
+(x e y big-endian su 32 byte) in un unico buffer contiguo (bytes, bytearray o file mappato in memoria).
+Le chiavi sono lette su richiesta tramite viste CompactPoint, senza creare tuple di FQ.
+Un file di chiavi e' la semplice concatenazione dei record da 64 byte; la variante compressa
+usa 33 byte per chiave (prefisso 0x02/0x03 e x) e viene espansa alla lettura.
+"""
+
+KEY_SIZE = 64
+COMPRESSED_KEY_SIZE = 33
+
+
+class CompactPoint:
+    __slots__ = ('buffer', 'offset')
+
+    def __init__(self, buffer, offset):
+        self.buffer = buffer
+        self.offset = offset
+
+    def __getitem__(self, i):
+        if i not in (0, 1):
+            raise IndexError("CompactPoint index out of range")
+        start = self.offset + 32 * i
+        return int.from_bytes(self.buffer[start:start + 32], 'big')
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        yield self[0]
+        yield self[1]
+
+    def __eq__(self, other):
+        return other is not None and len(other) == 2 and \
+            (self[0], self[1]) == (asint(other[0]), asint(other[1]))
+
+    def __repr__(self):
+        return "CompactPoint(%d, %d)" % (self[0], self[1])
+
+
+class CompactRing:
+    def __init__(self, buffer):
+        assert len(buffer) % KEY_SIZE == 0
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        # Buffer su cui cercare con find (bytes, bytearray, mmap) e posizione dell'anello al suo interno:
+        # gli slice sono viste e non hanno find
+        self._base = buffer if hasattr(buffer, 'find') else None
+        self._offset = 0
+
+    @classmethod
+    def from_points(cls, pkeys):
+        buffer = bytearray(KEY_SIZE * len(pkeys))
+        for i, pk in enumerate(pkeys):
+            buffer[i * KEY_SIZE:i * KEY_SIZE + 32] = asint(pk[0]).to_bytes(32, 'big')
+            buffer[i * KEY_SIZE + 32:(i + 1) * KEY_SIZE] = asint(pk[1]).to_bytes(32, 'big')
+        return cls(buffer)
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, 'rb') as key_file:
+            return cls(mmap.mmap(key_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def to_file(self, path: str):
+        with open(path, 'wb') as key_file:
+            key_file.write(self.view)
+
+    @classmethod
+    def from_compressed(cls, buffer):
+        if len(buffer) % COMPRESSED_KEY_SIZE:
+            raise ValueError("Invalid compressed key buffer")
+        return cls.from_points([decompress_point(bytes(buffer[i:i + COMPRESSED_KEY_SIZE]))
+            for i in range(0, len(buffer), COMPRESSED_KEY_SIZE)])
+
+    @classmethod
+    def from_compressed_file(cls, path: str):
+        with open(path, 'rb') as key_file:
+            return cls.from_compressed(key_file.read())
+
+    def to_compressed_file(self, path: str):
+        with open(path, 'wb') as key_file:
+            for pk in self:
+                key_file.write(compress_point(pk))
+
+    def __len__(self):
+        return len(self.buffer) // KEY_SIZE
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("CompactRing slices must be contiguous")
+            ring = CompactRing(self.view[start * KEY_SIZE:max(start, stop) * KEY_SIZE])
+            if self._base is not None:
+                ring._base, ring._offset = self._base, self._offset + start * KEY_SIZE
+            return ring
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("CompactRing index out of range")
+        return CompactPoint(self.view, i * KEY_SIZE)
+
+    def __iter__(self):
+        for offset in range(0, len(self.buffer), KEY_SIZE):
+            yield CompactPoint(self.view, offset)
+
+    def index(self, pk) -> int:
+        needle = asint(pk[0]).to_bytes(32, 'big') + asint(pk[1]).to_bytes(32, 'big')
+        if self._base is None:
+            for i, offset in enumerate(range(0, len(self.view), KEY_SIZE)):
+                if self.view[offset:offset + KEY_SIZE] == needle:
+                    return i
+            raise ValueError("Public key is not part of the ring")
+        end = self._offset + len(self.view)
+        position = self._base.find(needle, self._offset, end)
+        while position != -1 and (position - self._offset) % KEY_SIZE:
+            position = self._base.find(needle, position + 1, end)
+        if position == -1:
+            raise ValueError("Public key is not part of the ring")
+        return (position - self._offset) // KEY_SIZE
@@ -0,0 +1,313 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from math import isqrt
+
+from .altbn128 import (JINF, FIELD_P, curve_order, randsn, hashsn, to_jacobian, jacobian_add, jacobian_add_affine,
+    jacobian_neg, jacobian_normalize, jacobian_multiply, multi_multiply_jacobian, wnaf_table, fixed_base_table,
+    fixed_base_multiply_jacobian, sbmul_jacobian, sbmul_table, compress_point, decompress_point)
+
+"""
+ElGamal esponenziale su alt_bn128 per le schede cifrate.
+
+Una scelta m (0 o 1) si cifra come (rG, mG + rH), con H = xG chiave pubblica della votazione.
+La scheda e' il vettore delle cifrature di tutte le scelte (1 su quella votata, 0 sulle altre),
+ogni punto compresso su 33 byte. Sommando le cifrature di una scelta su tutte le schede si ottiene
+la cifratura del totale, per cui lo scrutinio decifra una volta per scelta invece che per scheda.
+
+Ogni cifratura e' accompagnata da una prova disgiuntiva di Chaum-Pedersen (Cramer-Damgard-Schoenmakers)
+che m e' 0 oppure 1, senza rivelare quale; una prova uguale sulla somma delle cifrature della scheda
+garantisce che sia votata al piu' una scelta (0 = scheda bianca). Le prove seguono le cifrature nella
+scheda, (c0, c1, s0, s1) su 32 byte ciascuno, e le schede con una prova non valida vengono scartate
+dallo scrutinio. La prova e' legata alla chiave della votazione e alla cifratura che accompagna.
+
+Il totale e' noto solo come punto mG: m si ricava con baby-step giant-step su una tabella di
+sqrt(N) punti, con N il numero massimo di voti (gli aventi diritto). Le somme usano coordinate
+Jacobiane con somme miste e una sola normalizzazione per gruppo di punti.
+"""
+
+POINT_SIZE = 33
+CIPHERTEXT_SIZE = 2 * POINT_SIZE
+PROOF_SIZE = 4 * 32
+# Finestra della tabella a base fissa delle chiavi pubbliche (una per chiave, costruita al primo uso)
+KEY_WINDOW = 6
+_key_tables = {}
+
+
+def generate_keys():
+    secret_key = randsn()
+    return secret_key, public_key_of(secret_key)
+
+
+def public_key_of(secret_key: int):
+    return jacobian_normalize([sbmul_jacobian(secret_key)])[0]
+
+
+encode_key = lambda public_key: compress_point(public_key).hex()
+decode_key = lambda key: tuple(int(c) for c in decompress_point(bytes.fromhex(key[2:] if key.startswith('0x') else key)))
+
+
+def key_table(public_key):
+    if public_key not in _key_tables:
+        _key_tables[public_key] = fixed_base_table(to_jacobian(public_key), KEY_WINDOW)
+    return _key_tables[public_key]
+
+
+ballot_size = lambda choices: choices * (CIPHERTEXT_SIZE + PROOF_SIZE) + PROOF_SIZE
+
+
+def challenge(public_key, ciphertext, commitments) -> int:
+    """
+    Sfida della prova (Fiat-Shamir), legata alla chiave della votazione e alla cifratura
+    """
+    points = [public_key] + list(ciphertext) + commitments
+    return hashsn(*[c for P in points for c in (P or (0, 0))])
+
+
+def prove_bits(table, public_key, ciphertexts, randomness: [int], values: [int]) -> bytes:
+    """
+    Prove che ogni cifratura (A, B) = (rG, mG + rH) ha m = 0 oppure 1. Il ramo vero usa un impegno
+    (wG, wH); quello falso e' simulato scegliendo prima sfida e risposta. Chi cifra conosce r, per cui
+    anche gli impegni simulati sono multipli a base fissa di G e di H.
+    """
+    n = curve_order
+    commitments, secrets = [], []
+    for r, m in zip(randomness, values):
+        w, c_fake, s_fake = randsn(), randsn(), randsn()
+        t = (s_fake - c_fake * r) % n
+        real = [sbmul_jacobian(w), fixed_base_multiply_jacobian(table, w)]
+        # Ramo j = 1 - m: sG - cA = tG, sH - c(B - jG) = tH - c(2m - 1)G
+        fake = [sbmul_jacobian(t), jacobian_add(fixed_base_multiply_jacobian(table, t), sbmul_jacobian(-c_fake * (2 * m - 1)))]
+        commitments += real + fake if m == 0 else fake + real
+        secrets.append((w, c_fake, s_fake))
+    commitments = jacobian_normalize(commitments)
+    proofs = []
+    for i, (ciphertext, r, m, (w, c_fake, s_fake)) in enumerate(zip(ciphertexts, randomness, values, secrets)):
+        c = challenge(public_key, ciphertext, commitments[4 * i:4 * i + 4])
+        c_real = (c - c_fake) % n
+        s_real = (w + c_real * r) % n
+        proof = (c_real, c_fake, s_real, s_fake) if m == 0 else (c_fake, c_real, s_fake, s_real)
+        proofs.append(b''.join(v.to_bytes(32, 'big') for v in proof))
+    return b''.join(proofs)
+
+
+def verify_bits(table, public_key, ciphertexts, proofs: bytes) -> bool:
+    """
+    Verifica le prove di prove_bits: ricostruisce gli impegni a_j = s_j G - c_j A, b_j = s_j H + j c_j G - c_j B
+    e controlla che c0 + c1 sia la sfida
+    """
+    n = curve_order
+    commitments, challenges = [], []
+    for i, (A, B) in enumerate(ciphertexts):
+        c0, c1, s0, s1 = [int.from_bytes(proofs[j:j + 32], 'big') for j in range(i * PROOF_SIZE, (i + 1) * PROOF_SIZE, 32)]
+        if max(c0, c1, s0, s1) >= n:
+            return False
+        table_A, table_B = wnaf_table(to_jacobian(A)), wnaf_table(to_jacobian(B))
+        commitments += [
+            jacobian_add(sbmul_jacobian(s0), multi_multiply_jacobian([(table_A, -c0)])),
+            jacobian_add(fixed_base_multiply_jacobian(table, s0), multi_multiply_jacobian([(table_B, -c0)])),
+            jacobian_add(sbmul_jacobian(s1), multi_multiply_jacobian([(table_A, -c1)])),
+            jacobian_add(jacobian_add(fixed_base_multiply_jacobian(table, s1), sbmul_jacobian(c1)), multi_multiply_jacobian([(table_B, -c1)]))
+        ]
+        challenges.append((c0 + c1) % n)
+    commitments = jacobian_normalize(commitments)
+    return all(challenge(public_key, ciphertext, commitments[4 * i:4 * i + 4]) == c
+        for i, (ciphertext, c) in enumerate(zip(ciphertexts, challenges)))
+
+
+def encrypt_choice(choice: int, choices: int, public_key) -> bytes:
+    """
+    Scheda cifrata per la scelta `choice` tra `choices`, con le prove; una scelta fuori intervallo da' una scheda bianca
+    """
+    public_key = tuple(int(c) for c in public_key)
+    table = key_table(public_key)
+    G = jacobian_normalize([sbmul_jacobian(1)])[0]
+    randomness = [randsn() for _ in range(choices)]
+    values = [1 if j == choice else 0 for j in range(choices)]
+    points = []
+    for r, m in zip(randomness, values):
+        C2 = fixed_base_multiply_jacobian(table, r)
+        if m:
+            C2 = jacobian_add_affine(C2, G)
+        points += [sbmul_jacobian(r), C2]
+    # Cifratura della somma delle scelte, con casualita' somma delle casualita'
+    randomness.append(sum(randomness) % curve_order)
+    values.append(sum(values))
+    points += [sbmul_jacobian(randomness[-1]), jacobian_add(fixed_base_multiply_jacobian(table, randomness[-1]), sbmul_jacobian(values[-1]))]
+    affine = jacobian_normalize(points)
+    ciphertexts = list(zip(affine[0::2], affine[1::2]))
+    proofs = prove_bits(table, public_key, ciphertexts, randomness, values)
+    return b''.join(compress_point(P) for P in affine[:2 * choices]) + proofs
+
+
+def sum_points(points):
+    total = JINF
+    for P in points:
+        total = jacobian_add_affine(total, P)
+    return total
+
+
+def decode_ballot(ballot: bytes, choices: int, public_key):
+    """
+    Coppie (C1, C2) affini della scheda; ValueError se la scheda non e' valida o le sue prove non tornano
+    """
+    if len(ballot) != ballot_size(choices):
+        raise ValueError("Invalid encrypted ballot length")
+    size = choices * CIPHERTEXT_SIZE
+    points = [decompress_point(ballot[i:i + POINT_SIZE]) for i in range(0, size, POINT_SIZE)]
+    points = [(P[0].n, P[1].n) for P in points]
+    ciphertexts = list(zip(points[0::2], points[1::2]))
+    total = jacobian_normalize([
+        sum_points([A for A, _ in ciphertexts]),
+        sum_points([B for _, B in ciphertexts])
+    ])
+    public_key = tuple(int(c) for c in public_key)
+    if not verify_bits(key_table(public_key), public_key, ciphertexts + [tuple(total)], ballot[size:]):
+        raise ValueError("Invalid encrypted ballot proof")
+    return ciphertexts
+
+
+def sum_ballots(ballots, choices: int, public_key):
+    """
+    Somma omomorfica delle schede: per ogni scelta la coppia Jacobiana (sum C1, sum C2).
+    Restituisce anche il numero di schede non valide (malformate o con prove non valide), che vengono escluse.
+    """
+    sums = [[JINF, JINF] for _ in range(choices)]
+    invalid = 0
+    for ballot in ballots:
+        try:
+            ciphertexts = decode_ballot(ballot, choices, public_key)
+        except ValueError:
+            invalid += 1
+            continue
+        for total, (C1, C2) in zip(sums, ciphertexts):
+            total[0] = jacobian_add_affine(total[0], C1)
+            total[1] = jacobian_add_affine(total[1], C2)
+    return sums, invalid
+
+
+def merge_sums(a, b):
+    return [[jacobian_add(A1, B1), jacobian_add(A2, B2)] for (A1, A2), (B1, B2) in zip(a, b)]
+
+
+def sum_ballots_parallel(ballots: [bytes], choices: int, public_key, processes: int):
+    """
+    Somma (e verifica delle prove) delle schede divisa tra `processes` processi; le somme parziali vengono poi unite
+    """
+    if processes <= 1 or len(ballots) < 2 * processes:
+        return sum_ballots(ballots, choices, public_key)
+    size = (len(ballots) + processes - 1) // processes
+    chunks = [ballots[i:i + size] for i in range(0, len(ballots), size)]
+    with ProcessPoolExecutor(processes, multiprocessing.get_context('fork')) as pool:
+        partials = list(pool.map(sum_ballots, chunks, [choices] * len(chunks), [public_key] * len(chunks)))
+    sums, invalid = partials[0]
+    for partial_sums, partial_invalid in partials[1:]:
+        sums = merge_sums(sums, partial_sums)
+        invalid += partial_invalid
+    return sums, invalid
+
+
+def encode_sums(sums):
+    """
+    Somme in forma serializzabile (per i checkpoint): punti compressi in esadecimale, '' per l'infinito
+    """
+    affine = jacobian_normalize([P for pair in sums for P in pair])
+    encoded = ['' if P is None else compress_point(P).hex() for P in affine]
+    return [encoded[i:i + 2] for i in range(0, len(encoded), 2)]
+
+
+def decode_sums(encoded):
+    return [[JINF if not P else to_jacobian(decompress_point(bytes.fromhex(P))) for P in pair] for pair in encoded]
+
+
+class DiscreteLogTable:
+    """
+    Logaritmo discreto in base G per valori in [0, max_value], con baby-step giant-step.
+    La tabella associa l'ascissa di jG a j per j in [1, s], con s ~ sqrt(max_value): poiche' jG e -jG
+    hanno la stessa ascissa, la parita' di y distingue m = i*s + j da m = i*s - j.
+    """
+    def __init__(self, max_value: int):
+        self.max_value = max_value
+        self.step = isqrt(max_value) + 1
+        G = jacobian_normalize([sbmul_jacobian(1)])[0]
+        points = [to_jacobian(G)]
+        for _ in range(self.step - 1):
+            points.append(jacobian_add_affine(points[-1], G))
+        self.table = {P[0]: (j + 1) << 1 | (P[1] & 1) for j, P in enumerate(jacobian_normalize(points))}
+        giant = jacobian_normalize([fixed_base_multiply_jacobian(sbmul_table(), self.step)])[0]
+        self.giant = (giant[0], FIELD_P - giant[1])
+
+    def lookup(self, point, batch: int = 64) -> int:
+        """
+        m tale che mG = point (affine, None per l'infinito); ValueError se m non e' in [0, max_value]
+        """
+        if point is None:
+            return 0
+        current = to_jacobian(point)
+        i = 0
+        while i * self.step <= self.max_value + self.step:
+            # Passi giganti a gruppi, normalizzati con una sola inversione
+            steps = []
+            for _ in range(batch):
+                steps.append(current)
+                current = jacobian_add_affine(current, self.giant)
+            for k, P in enumerate(jacobian_normalize(steps)):
+                if P is None:
+                    m = (i + k) * self.step
+                elif P[0] in self.table:
+                    entry = self.table[P[0]]
+                    j = entry >> 1
+                    m = (i + k) * self.step + (j if (P[1] & 1) == (entry & 1) else -j)
+                else:
+                    continue
+                if 0 <= m <= self.max_value:
+                    return m
+            i += batch
+        raise ValueError("Discrete logarithm out of range")
+
+
+def decrypt_sums(sums, secret_key: int, table: DiscreteLogTable) -> [int]:
+    """
+    Totali in chiaro delle scelte: una decifratura (C2 - x*C1) e una ricerca nella tabella per scelta
+    """
+    masked = [jacobian_add(C2, jacobian_neg(jacobian_multiply(C1, secret_key))) for C1, C2 in sums]
+    return [table.lookup(M) for M in jacobian_normalize(masked)]
+
+
+if __name__ == "__main__":
+    from random import randrange
+
+    secret_key, public_key = generate_keys()
+    assert decode_key(encode_key(public_key)) == public_key
+    table = DiscreteLogTable(1000)
+    for m in [0, 1, 2, table.step - 1, table.step, table.step + 1, 999, 1000]:
+        assert table.lookup(jacobian_normalize([fixed_base_multiply_jacobian(sbmul_table(), m)])[0]) == m
+
+    choices = 3
+    votes = [randrange(choices + 1) for _ in range(40)]
+    ballots = [encrypt_choice(v, choices, public_key) for v in votes] + [b'invalid']
+    def forge(values):
+        """
+        Scheda con valori arbitrari (l'ultimo e' la somma) e prove calcolate onestamente su di essi
+        """
+        randomness = [randsn() for _ in values[:-1]]
+        randomness.append(sum(randomness) % curve_order)
+        table = key_table(public_key)
+        points = []
+        for r, m in zip(randomness, values):
+            points += [sbmul_jacobian(r), jacobian_add(fixed_base_multiply_jacobian(table, r), sbmul_jacobian(m))]
+        affine = jacobian_normalize(points)
+        return b''.join(compress_point(P) for P in affine[:-2]) + prove_bits(table, public_key, list(zip(affine[0::2], affine[1::2])), randomness, values)
+
+    assert len(decode_ballot(forge([0, 1, 0, 1]), choices, public_key)) == choices
+    # Una prova alterata, una scheda per un'altra chiave, 2 voti per una scelta, una scelta per due voti
+    ballots.append(ballots[0][:-1] + bytes([ballots[0][-1] ^ 1]))
+    ballots.append(encrypt_choice(0, choices, generate_keys()[1]))
+    ballots += [forge([2, 0, 0, 2]), forge([1, 1, 0, 2])]
+    assert all(len(ballot) == ballot_size(choices) for ballot in ballots[-4:])
+    sums, invalid = sum_ballots(ballots, choices, public_key)
+    assert invalid == 5
+    totals = decrypt_sums(decode_sums(encode_sums(sums)), secret_key, table)
+    # La scelta fuori intervallo e' una scheda bianca
+    assert totals == [votes.count(c) for c in range(choices)]
+    assert decrypt_sums(sum_ballots_parallel(ballots, choices, public_key, 2)[0], secret_key, table) == totals
+    print(totals)
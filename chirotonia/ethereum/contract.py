@@ -1,74 +1,293 @@
 from web3 import Web3
 
 from .contract_data import abi, bytecode
+from .pipeline import TransactionPipeline
+from .receipts import ReceiptTracker, fetch_receipts, fetch_transactions
+from ..curve import asint
 from ..linkable_ring_signature import LinkableRingSignature
 from ..utils import bytes_to_int
 
+# Dimensione massima del codice di un contratto (EIP-170)
+MAX_CODE_SIZE = 24576
+VOTO_ACCETTATO = "VotoAccettato(string,uint256,bytes)"
+
 class Contract:
-    def __init__(self, web3: Web3, address=''):
+    def __init__(self, web3: Web3, address='', pipeline: TransactionPipeline = None):
+        """
+        Con una pipeline le transazioni sono inviate da TransactionPipeline (nonce locale, gas in cache,
+        finestra di transazioni in volo) e i metodi restituiscono cio' che restituisce submit()
+        """
         self.__web3 = web3
+        self.__pipeline = pipeline
         if address:
             self.__contract = web3.eth.contract(address=address, abi=abi)
         else:
             self.__contract = web3.eth.contract(abi=abi, bytecode=bytecode)
 
-    def deploy(self, identity_manager):
-        tx_hash = self.__contract.constructor(identity_manager).transact({
-            "gas": 3000000,
+    def deploy(self, identity_manager, gas: int = None, gas_margin: float = 1.2):
+        """
+        Senza gas esplicito la creazione viene stimata dal nodo, con un margine e al piu' il gas del blocco.
+        La stima fallisce anche se il codice del contratto supera il limite di EIP-170 (MAX_CODE_SIZE).
+        """
+        constructor = self.__contract.constructor(identity_manager)
+        if gas is None:
+            try:
+                estimate = constructor.estimateGas()
+            except ValueError as error:
+                raise RuntimeError("Unable to estimate the deployment gas (runtime bytecode over %d bytes?): %s" % (MAX_CODE_SIZE, error))
+            gas = min(int(estimate * gas_margin), self.__web3.eth.getBlock('latest').gasLimit)
+        tx_hash = constructor.transact({
+            "gas": gas,
             "gasPrice": Web3.toWei(10, 'gwei')
         })
         receipt = self.__web3.eth.waitForTransactionReceipt(tx_hash)
+        if not receipt.status:
+            raise RuntimeError("Deployment failed using %d of %d gas" % (receipt.gasUsed, gas))
         self.__contract = self.__web3.eth.contract(address=receipt.contractAddress, abi=abi)
         self.identity_manager = identity_manager
         self.owner_address = self.__web3.eth.defaultAccount
         return receipt
 
     def create_vote(self, identifier: str, subject: str, **kwargs):
-        tx_hash = self.__contract.functions.nuovaVotazione(identifier, subject).transact()
+        tx_hash = self.transact(self.__contract.functions.nuovaVotazione(identifier, subject))
         if "sync" in kwargs and kwargs["sync"]:
-            return self.__web3.eth.waitForTransactionReceipt(tx_hash)
+            return self.wait(tx_hash)
         else:
             return tx_hash
     
     def set_choice(self, identifier: str, code: int, description: str, **kwargs):
-        tx_hash = self.__contract.functions.impostaScelta(identifier, description, code.to_bytes(1, 'big')).transact()
+        tx_hash = self.transact(self.__contract.functions.impostaScelta(identifier, description, code.to_bytes(1, 'big')))
         if "sync" in kwargs and kwargs["sync"]:
-            return self.__web3.eth.waitForTransactionReceipt(tx_hash)
+            return self.wait(tx_hash)
         else:
             return tx_hash
 
     def register_voter(self, description, pub_x, pub_y, vote_id, **kwargs):
-        tx_hash = self.__contract.functions.accreditaVotante(description, pub_x, pub_y, vote_id).transact()
+        tx_hash = self.transact(self.__contract.functions.accreditaVotante(description, pub_x, pub_y, vote_id))
+        if "sync" in kwargs and kwargs["sync"]:
+            return self.wait(tx_hash)
+        else:
+            return tx_hash
+
+    def register_voters_batch(self, descriptions: [str], public_keys, vote_id, **kwargs):
+        """
+        Accredita piu' votanti con una sola transazione, nell'ordine dato
+        """
+        keys_x = [asint(pk[0]) for pk in public_keys]
+        keys_y = [asint(pk[1]) for pk in public_keys]
+        tx_hash = self.transact(self.__contract.functions.accreditaVotanti(list(descriptions), keys_x, keys_y, vote_id))
+        if "sync" in kwargs and kwargs["sync"]:
+            return self.wait(tx_hash)
+        else:
+            return tx_hash
+
+    def register_voter_compressed(self, description, compressed_key: int, vote_id, **kwargs):
+        """
+        Accredita un votante con la chiave pubblica compressa in una parola (altbn128.compress_word)
+        """
+        tx_hash = self.transact(self.__contract.functions.accreditaVotanteCompresso(description, compressed_key, vote_id))
+        if "sync" in kwargs and kwargs["sync"]:
+            return self.wait(tx_hash)
+        else:
+            return tx_hash
+
+    def set_shard_size(self, identifier: str, shard_size: int, **kwargs):
+        tx_hash = self.transact(self.__contract.functions.impostaShard(identifier, shard_size))
         if "sync" in kwargs and kwargs["sync"]:
-            return self.__web3.eth.waitForTransactionReceipt(tx_hash)
+            return self.wait(tx_hash)
         else:
             return tx_hash
 
+    def get_shards(self, identifier: str):
+        """
+        Numero di shard e loro dimensione (0 se la votazione usa un anello unico)
+        """
+        return tuple(self.__contract.functions.ottieniShard(identifier).call())
+
     def start_vote(self, identifier: str, **kwargs):
-        tx_hash = self.__contract.functions.avviaVotazione(identifier).transact()
+        tx_hash = self.transact(self.__contract.functions.avviaVotazione(identifier))
         if "sync" in kwargs and kwargs["sync"]:
-            return self.__web3.eth.waitForTransactionReceipt(tx_hash)
+            return self.wait(tx_hash)
         else:
             return tx_hash
 
-    def vote(self, identifier: str, signature: LinkableRingSignature, **kwargs):
+    def vote(self, identifier: str, signature: LinkableRingSignature, ballot: bytes = None, **kwargs):
+        """
+        La scheda salvata dal contratto e' il messaggio firmato o, per le schede cifrate
+        (Voter.pack_encrypted_vote), la cifratura di cui il messaggio e' l'hash: il contratto
+        rifiuta le schede che non corrispondono al messaggio
+        """
         tag_array = [signature.tag[0].n, signature.tag[1].n]
         vote = bytes_to_int(signature.message)
-        tx_hash = self.__contract.functions.vota(tag_array, signature.ring, signature.seed, vote, identifier).transact()
+        ballot = bytes(signature.message) if ballot is None else ballot
+        if signature.shard is not None:
+            tx_hash = self.transact(self.__contract.functions.votaShard(tag_array, list(signature.ring), signature.seed, vote, ballot, signature.shard, identifier))
+        else:
+            tx_hash = self.transact(self.__contract.functions.vota(tag_array, list(signature.ring), signature.seed, vote, ballot, identifier))
         if "sync" in kwargs and kwargs["sync"]:
-            return self.__web3.eth.waitForTransactionReceipt(tx_hash)
+            return self.wait(tx_hash)
         else:
             return tx_hash
 
+    def vote_batch(self, identifier: str, signatures: [LinkableRingSignature], ballots: [bytes] = None, **kwargs):
+        """
+        Invia piu' schede con votaMultiplo: quelle rifiutate dal contratto sono riportate
+        dagli eventi VotoRifiutato della ricevuta (vedi batch_outcomes). ballots contiene le
+        eventuali schede cifrate, None per quelle in chiaro.
+        """
+        tags = [[asint(s.tag[0]), asint(s.tag[1])] for s in signatures]
+        tees = [list(s.ring) for s in signatures]
+        seeds = [s.seed for s in signatures]
+        vote_hashes = [bytes_to_int(s.message) for s in signatures]
+        ballots = [bytes(s.message) if b is None else b for s, b in zip(signatures, ballots or [None] * len(signatures))]
+        shards = [s.shard or 0 for s in signatures]
+        tx_hash = self.transact(self.__contract.functions.votaMultiplo(tags, tees, seeds, vote_hashes, ballots, shards, identifier))
+        if "sync" in kwargs and kwargs["sync"]:
+            return self.wait(tx_hash)
+        else:
+            return tx_hash
+
+    def tag_used(self, identifier: str, tag_x: int) -> bool:
+        return self.__contract.functions.verificaTag(identifier, tag_x).call()
+
+    def set_privacy_manager(self, address: str, **kwargs):
+        tx_hash = self.transact(self.__contract.functions.setPrivacyManager(address))
+        if "sync" in kwargs and kwargs["sync"]:
+            return self.wait(tx_hash)
+        else:
+            return tx_hash
+
+    def set_encryption_key(self, encryption_key: str, **kwargs):
+        """
+        Pubblica la chiave ElGamal delle schede (elgamal.encode_key); solo il privacy manager puo' farlo
+        """
+        tx_hash = self.transact(self.__contract.functions.setEncryptionKey(encryption_key))
+        if "sync" in kwargs and kwargs["sync"]:
+            return self.wait(tx_hash)
+        else:
+            return tx_hash
+
+    def get_encryption_key(self) -> str:
+        return self.__contract.functions.encryptionKey().call()
+
     def stop_vote(self, identifier: str, **kwargs):
-        tx_hash = self.__contract.functions.chiudiVotazione(identifier).transact()
+        tx_hash = self.transact(self.__contract.functions.chiudiVotazione(identifier))
         if "sync" in kwargs and kwargs["sync"]:
-            return self.__web3.eth.waitForTransactionReceipt(tx_hash)
+            return self.wait(tx_hash)
         else:
             return tx_hash
 
-    def get_ballots(self, identifier: str):
-        return self.__contract.functions.getVoti(identifier).call()
+    def get_ballots(self, identifier: str, start: int = 0):
+        """
+        Voti accettati a partire dalla posizione start, uno per chiamata a getVoto,
+        come stringhe esadecimali '0x...' (il formato di tally.py)
+        """
+        count = self.__contract.functions.getNumeroVotiAcquisiti(identifier).call()
+        return ['0x' + self.__contract.functions.getVoto(identifier, i).call().hex() for i in range(start, count)]
+
+    def get_accepted_ballots(self, identifier: str, from_block: int, to_block: int):
+        """
+        Voti accettati nei blocchi [from_block, to_block], dagli eventi VotoAccettato,
+        come tuple (block_number, indice, voto) in ordine di accettazione, con il voto come in get_ballots
+        """
+        event = self.__contract.events.VotoAccettato()
+        logs = self.__web3.eth.getLogs({
+            "address": self.__contract.address,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [
+                Web3.keccak(text=VOTO_ACCETTATO).hex(),
+                Web3.keccak(text=identifier).hex()
+            ]
+        })
+        entries = [event.processLog(log) for log in logs]
+        return [(entry.blockNumber, entry.args.indice, '0x' + entry.args.voto.hex()) for entry in entries]
+
+    def get_voters(self, identifier: str):
+        """
+        Chiavi pubbliche (x, y) dei votanti accreditati, nell'ordine dell'anello
+        """
+        ring = self.__contract.functions.ottieniAnello(identifier).call()
+        return list(zip(ring[0::2], ring[1::2]))
+
+    def get_cast_ballots(self, identifier: str, from_block: int, to_block: int):
+        """
+        Firme delle transazioni vota, votaShard e votaMultiplo nei blocchi [from_block, to_block] che
+        hanno fatto accettare almeno una scheda, come tuple (tx_hash, block_number, tag, tees, seed,
+        voteHash, shard), con shard None senza shard. Di un votaMultiplo sono restituite solo le schede
+        accettate (vedi batch_outcomes).
+        Le transazioni sono trovate dagli eventi VotoAccettato (una sola getLogs) e lette, con le ricevute
+        dei votaMultiplo, con richieste JSON-RPC batch (receipts.py) invece che blocco per blocco.
+        """
+        logs = self.__web3.eth.getLogs({
+            "address": self.__contract.address,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [
+                Web3.keccak(text=VOTO_ACCETTATO).hex(),
+                Web3.keccak(text=identifier).hex()
+            ]
+        })
+        # Transazioni nell'ordine dei log, cioe' di esecuzione
+        blocks = {}
+        for log in logs:
+            blocks.setdefault(bytes(log.transactionHash), log.blockNumber)
+        transactions = fetch_transactions(self.__web3, list(blocks))
+        decoded = {}
+        for tx_hash in blocks:
+            tx = transactions.get(tx_hash)
+            if tx is None or tx["to"] != self.__contract.address:
+                continue
+            function, params = self.__contract.decode_function_input(tx["input"])
+            if function.fn_name in ('vota', 'votaShard', 'votaMultiplo') and params['_identificativoVotazione'] == identifier:
+                decoded[tx_hash] = (function.fn_name, params)
+        receipts = fetch_receipts(self.__web3, [h for h, (name, _) in decoded.items() if name == 'votaMultiplo'])
+        sharded = None
+        ballots = []
+        for tx_hash, (name, params) in decoded.items():
+            number = blocks[tx_hash]
+            if name != 'votaMultiplo':
+                ballots.append(('0x' + tx_hash.hex(), number, params['tag'], params['tees'], params['seed'], params['voteHash'], params.get('shard')))
+                continue
+            if sharded is None:
+                sharded = self.get_shards(identifier)[1] > 0
+            entries = zip(params['tags'], params['tees'], params['seeds'], params['voteHashes'], params['shards'])
+            for (tag, tees, seed, vote_hash, shard), accepted in zip(entries, self.batch_outcomes(receipts[tx_hash])):
+                if accepted:
+                    ballots.append(('0x' + tx_hash.hex(), number, tag, tees, seed, vote_hash, shard if sharded else None))
+        return ballots
+
+    def batch_outcomes(self, receipt) -> [bool]:
+        """
+        Esito di ogni scheda di una transazione votaMultiplo, nell'ordine di invio: il contratto emette
+        per ogni scheda un VotoAccettato o un VotoRifiutato, per cui l'ordine dei log le abbina alle schede
+        anche quando piu' schede dello stesso gruppo hanno lo stesso tag
+        """
+        accepted = [(event.logIndex, True) for event in self.__contract.events.VotoAccettato().processReceipt(receipt)]
+        rejected = [(event.logIndex, False) for event in self.__contract.events.VotoRifiutato().processReceipt(receipt)]
+        return [outcome for _, outcome in sorted(accepted + rejected)]
+
+    def code_size(self) -> int:
+        """
+        Byte del codice del contratto distribuito
+        """
+        return len(self.__web3.eth.getCode(self.__contract.address))
+
+    def block_number(self):
+        return self.__web3.eth.blockNumber
     
+    def transact(self, call):
+        if self.__pipeline is not None:
+            return self.__pipeline.submit(call)
+        return call.transact()
+
+    def tracker(self) -> ReceiptTracker:
+        """
+        Tracker per attendere insieme le ricevute di molte transazioni inviate con questo contratto
+        """
+        return ReceiptTracker(self.__web3, self.__pipeline)
+
     def wait(self, tx_hash):
+        if self.__pipeline is not None:
+            return self.__pipeline.wait(tx_hash)
         return self.__web3.eth.waitForTransactionReceipt(tx_hash)
\ No newline at end of file
@@ -0,0 +1,293 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+
+from .receipts import fetch_receipts
+
+"""
+Invio a pipeline delle transazioni di un account.
+
+Invece di lasciare che ogni transact() chieda al nodo nonce, stima del gas e prezzo, la pipeline:
+- tiene il nonce in locale; il nonce di un invio fallito viene occupato con un trasferimento nullo
+  verso lo stesso account, altrimenti le transazioni con nonce successivi resterebbero ferme nel pool;
+- stima il gas una sola volta per funzione e forma degli argomenti, con un margine;
+- se ha la chiave privata firma le transazioni in locale e ne conosce subito l'hash,
+  altrimenti le fa firmare al nodo (account sbloccato) con tutti i campi gia' valorizzati;
+- spedisce le transazioni da un pool di thread, con al piu' `window` transazioni non ancora minate.
+
+Un thread controlla le ricevute delle transazioni in volo, con richieste batch (receipts.py).
+Una transazione che dopo `timeout` secondi non e' ne' minata ne' nel pool del nodo e' considerata
+scartata: viene rispedita uguale se il suo nonce e' ancora libero, altrimenti (nonce gia' usato da
+un'altra transazione) viene ricostruita con un nuovo nonce. wait() restituisce la ricevuta della
+transazione effettivamente minata.
+Dopo un recupero l'ordine in cui le transazioni vengono minate puo' differire da quello di invio:
+chi dipende dall'ordine (l'anello degli accreditamenti) deve rileggerlo dal contratto.
+"""
+
+logger = logging.getLogger('CHIROTONIA_PIPELINE')
+
+# Funzioni il cui gas non dipende solo dalla forma degli argomenti
+UNCACHED_FUNCTIONS = {'votaMultiplo'}
+# Posizione dell'argomento che, oltre alla forma, distingue le stime: il primo voto di uno shard
+# ne calcola e salva il punto L e costa piu' dei successivi
+KEY_ARGUMENTS = {'votaShard': 5}
+
+
+def argument_shape(argument):
+    if isinstance(argument, (str, bytes)):
+        return len(argument)
+    if isinstance(argument, (list, tuple)):
+        if argument and all(isinstance(a, (list, tuple)) for a in argument):
+            return tuple(argument_shape(a) for a in argument)
+        return len(argument)
+    return None
+
+
+class TransactionPipeline:
+    def __init__(self, web3: Web3, account: str = None, private_key=None, window: int = 128, senders: int = 8,
+            gas_margin: float = 1.25, poll_interval: float = 0.5, timeout: float = 120, retries: int = 3):
+        self.web3 = web3
+        self.account = account or web3.eth.defaultAccount
+        self.private_key = private_key
+        self.gas_margin = gas_margin
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.retries = retries
+        self.window = threading.BoundedSemaphore(window)
+        self.executor = ThreadPoolExecutor(senders)
+        self.lock = threading.Lock()
+        self.nonce = web3.eth.getTransactionCount(self.account, 'pending')
+        self.free_nonces = []
+        self.gas_price = web3.eth.gasPrice
+        self.chain_id = web3.eth.chainId
+        self.gas_estimates = {}
+        # Transazioni in volo e ricevute non ancora ritirate con wait(),
+        # indicizzate dall'hash restituito a chi le ha inviate
+        self.pending = {}
+        self.finished = {}
+        self.running = True
+        # Il thread delle ricevute parte al primo invio: finche' la pipeline non ha inviato nulla
+        # non ci sono thread, e i pool di processi (fork) possono essere creati senza rischi
+        self.poller = threading.Thread(target=self._poll, daemon=True)
+
+    def _next_nonce(self):
+        with self.lock:
+            if self.free_nonces:
+                return heapq.heappop(self.free_nonces)
+            self.nonce += 1
+            return self.nonce - 1
+
+    def _resync_nonce(self):
+        """
+        Allinea il nonce locale al nodo, scartando i nonce da riusare che sono gia' stati minati
+        """
+        pending = self.web3.eth.getTransactionCount(self.account, 'pending')
+        mined = self.web3.eth.getTransactionCount(self.account, 'latest')
+        with self.lock:
+            self.nonce = max(self.nonce, pending)
+            self.free_nonces = [n for n in self.free_nonces if n >= mined]
+            heapq.heapify(self.free_nonces)
+
+    def estimate_gas(self, call):
+        """
+        La stima in cache vale per le chiamate con la stessa forma degli argomenti: lunghezza di liste e
+        stringhe e, per le liste di liste, di ogni elemento (i tees di votaShard sono lo shard del votante).
+        Il gas di votaMultiplo dipende anche da quante schede il contratto accetta: viene stimato ogni volta.
+        Quello di votaShard e' stimato una volta per shard.
+        """
+        if call.fn_name in UNCACHED_FUNCTIONS:
+            return int(call.estimateGas({'from': self.account}) * self.gas_margin)
+        key = (call.fn_name, tuple(argument_shape(a) for a in call.args))
+        if call.fn_name in KEY_ARGUMENTS:
+            key += (call.args[KEY_ARGUMENTS[call.fn_name]],)
+        if key not in self.gas_estimates:
+            self.gas_estimates[key] = int(call.estimateGas({'from': self.account}) * self.gas_margin)
+        return self.gas_estimates[key]
+
+    def _build(self, record):
+        transaction = record['call'].buildTransaction({
+            'from': self.account,
+            'nonce': record['nonce'],
+            'gas': record['gas'],
+            'gasPrice': self.gas_price,
+            'chainId': self.chain_id
+        })
+        if self.private_key is not None:
+            signed = self.web3.eth.account.sign_transaction(transaction, self.private_key)
+            record['raw'], record['hash'] = signed.rawTransaction, signed.hash
+        else:
+            record['transaction'] = transaction
+
+    def _send(self, record):
+        """
+        Spedisce la transazione; se il nonce risulta gia' usato la ricostruisce con un nonce nuovo
+        """
+        for _ in range(self.retries):
+            try:
+                if self.private_key is not None:
+                    self.web3.eth.sendRawTransaction(record['raw'])
+                else:
+                    record['hash'] = self.web3.eth.sendTransaction(record['transaction'])
+                record['sent'] = time.time()
+                return record['hash']
+            except ValueError as error:
+                message = str(error).lower()
+                if 'already known' in message or 'known transaction' in message:
+                    record['sent'] = time.time()
+                    return record['hash']
+                if 'nonce too low' not in message and 'replacement transaction underpriced' not in message:
+                    raise
+                logger.warning("Nonce %d already used, rebuilding transaction", record['nonce'])
+                self._resync_nonce()
+                record['nonce'] = self._next_nonce()
+                self._build(record)
+        raise RuntimeError("Unable to find a free nonce for %s" % record['call'].fn_name)
+
+    def _fill_nonce(self, nonce):
+        """
+        Occupa un nonce rimasto libero con un trasferimento nullo verso lo stesso account.
+        Se anche questo non parte il nonce viene lasciato alla prossima transazione.
+        """
+        transaction = {'from': self.account, 'to': self.account, 'value': 0, 'gas': 21000,
+            'gasPrice': self.gas_price, 'nonce': nonce, 'chainId': self.chain_id}
+        for _ in range(self.retries):
+            try:
+                if self.private_key is not None:
+                    self.web3.eth.sendRawTransaction(self.web3.eth.account.sign_transaction(transaction, self.private_key).rawTransaction)
+                else:
+                    self.web3.eth.sendTransaction(transaction)
+                logger.warning("Nonce %d filled with an empty transaction", nonce)
+                return
+            except ValueError as error:
+                message = str(error).lower()
+                if any(reason in message for reason in ('nonce too low', 'already known', 'known transaction', 'replacement transaction underpriced')):
+                    # Il nonce e' gia' occupato da un'altra transazione
+                    return
+                logger.warning("Unable to fill nonce %d: %s", nonce, error)
+        with self.lock:
+            heapq.heappush(self.free_nonces, nonce)
+
+    def _sent(self, record, future: Future):
+        try:
+            future.result()
+        except Exception as error:
+            # Il nonce non e' stato consumato e puo' avere transazioni successive gia' nel pool
+            self._fill_nonce(record['nonce'])
+            self._done(record, error=error)
+
+    def submit(self, call, gas: int = None):
+        """
+        Accoda una chiamata di funzione del contratto (contract.functions.f(...)).
+        Restituisce l'hash della transazione se firmata in locale, altrimenti un Future dell'hash.
+        """
+        # La stima puo' fallire (revert): va fatta prima di occupare un posto nella finestra
+        gas = gas or self.estimate_gas(call)
+        with self.lock:
+            if not self.poller.is_alive() and self.running:
+                self.poller.start()
+        self.window.acquire()
+        record = {'call': call, 'gas': gas, 'nonce': self._next_nonce(),
+            'hash': None, 'sent': None, 'receipt': Future()}
+        try:
+            self._build(record)
+        except Exception:
+            self.executor.submit(self._fill_nonce, record['nonce'])
+            self.window.release()
+            raise
+        sending = self.executor.submit(self._send, record)
+        sending.add_done_callback(lambda future: self._sent(record, future))
+        if self.private_key is not None:
+            with self.lock:
+                self.pending[bytes(record['hash'])] = record
+            return record['hash']
+        tx_hash = Future()
+
+        def register(future):
+            if future.exception() is None:
+                with self.lock:
+                    self.pending[bytes(future.result())] = record
+                tx_hash.set_result(future.result())
+            else:
+                tx_hash.set_exception(future.exception())
+        sending.add_done_callback(register)
+        return tx_hash
+
+    def _done(self, record, receipt=None, error=None):
+        if record['receipt'].done():
+            return
+        if error is not None:
+            record['receipt'].set_exception(error)
+        else:
+            record['receipt'].set_result(receipt)
+        self.window.release()
+
+    def _recover(self, record):
+        try:
+            self.web3.eth.getTransaction(record['hash'])
+            # Ancora nel pool del nodo: si continua ad aspettare
+            record['sent'] = time.time()
+            return
+        except TransactionNotFound:
+            pass
+        if self.web3.eth.getTransactionCount(self.account, 'latest') > record['nonce']:
+            logger.warning("Transaction %s replaced, resubmitting with a new nonce", record['hash'].hex())
+            self._resync_nonce()
+            record['nonce'] = self._next_nonce()
+            self._build(record)
+        else:
+            logger.warning("Transaction %s dropped, resending", record['hash'].hex())
+        self._send(record)
+
+    def _poll(self):
+        while self.running:
+            with self.lock:
+                records = [r for r in self.pending.values() if r['sent'] is not None and not r['receipt'].done()]
+            try:
+                receipts = fetch_receipts(self.web3, [record['hash'] for record in records]) if records else {}
+            except Exception as error:
+                logger.warning("Receipt polling failed: %s", error)
+                records, receipts = [], {}
+            for record in records:
+                receipt = receipts.get(bytes(record['hash']))
+                if receipt is not None:
+                    self._done(record, receipt)
+                elif time.time() - record['sent'] > self.timeout:
+                    try:
+                        self._recover(record)
+                    except Exception as error:
+                        self._fill_nonce(record['nonce'])
+                        self._done(record, error=error)
+            with self.lock:
+                for key in [key for key, r in self.pending.items() if r['receipt'].done()]:
+                    record = self.pending.pop(key)
+                    if not record.get('collected'):
+                        self.finished[key] = record['receipt']
+            time.sleep(self.poll_interval)
+
+    def wait(self, tx_hash, timeout: float = None):
+        """
+        Ricevuta della transazione (o della sua sostituta, se e' stata rispedita)
+        """
+        if isinstance(tx_hash, Future):
+            tx_hash = tx_hash.result(timeout)
+        with self.lock:
+            receipt = self.finished.pop(bytes(tx_hash), None)
+            if receipt is None and bytes(tx_hash) in self.pending:
+                record = self.pending[bytes(tx_hash)]
+                record['collected'] = True
+                receipt = record['receipt']
+        if receipt is None:
+            return self.web3.eth.waitForTransactionReceipt(tx_hash)
+        return receipt.result(timeout)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.running = False
+        if self.poller.is_alive():
+            self.poller.join()
@@ -0,0 +1,175 @@
+import logging
+import time
+from concurrent.futures import Future
+
+import requests
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+from web3.exceptions import TransactionNotFound
+
+"""
+Raccolta delle ricevute di molte transazioni.
+
+Invece di attendere ogni hash con waitForTransactionReceipt, ReceiptTracker segue i nuovi blocchi
+e ad ogni blocco chiede le ricevute di tutte le transazioni ancora in sospeso con una sola
+richiesta JSON-RPC batch (a gruppi di batch_size). Con provider diversi da HTTP le ricevute
+sono richieste una per volta. Il tracker somma il gas usato e annota le transazioni fallite.
+"""
+
+logger = logging.getLogger('CHIROTONIA_RECEIPTS')
+
+RECEIPT_QUANTITIES = ('blockNumber', 'cumulativeGasUsed', 'gasUsed', 'status', 'transactionIndex', 'effectiveGasPrice')
+LOG_QUANTITIES = ('blockNumber', 'logIndex', 'transactionIndex')
+
+
+def format_log(log: dict) -> AttributeDict:
+    formatted = dict(log)
+    for field in LOG_QUANTITIES:
+        if formatted.get(field) is not None:
+            formatted[field] = int(formatted[field], 16)
+    for field in ('transactionHash', 'blockHash'):
+        formatted[field] = HexBytes(formatted[field])
+    formatted['topics'] = [HexBytes(topic) for topic in formatted['topics']]
+    formatted['address'] = Web3.toChecksumAddress(formatted['address'])
+    return AttributeDict(formatted)
+
+
+def format_receipt(receipt: dict) -> AttributeDict:
+    """
+    Converte una ricevuta JSON-RPC grezza nei tipi di web3, cosi' che sia utilizzabile
+    anche con contract.events.<Evento>().processReceipt
+    """
+    formatted = dict(receipt)
+    for field in RECEIPT_QUANTITIES:
+        if formatted.get(field) is not None:
+            formatted[field] = int(formatted[field], 16)
+    for field in ('transactionHash', 'blockHash'):
+        formatted[field] = HexBytes(formatted[field])
+    if formatted.get('contractAddress'):
+        formatted['contractAddress'] = Web3.toChecksumAddress(formatted['contractAddress'])
+    formatted['logs'] = [format_log(log) for log in formatted.get('logs', [])]
+    return AttributeDict(formatted)
+
+
+def batch_by_hash(web3: Web3, method: str, tx_hashes, batch_size: int = 500) -> dict:
+    """
+    Risultati grezzi di un metodo JSON-RPC con l'hash di una transazione come unico parametro,
+    con richieste batch da batch_size; indicizzati per hash (bytes), senza quelli non trovati.
+    None se il provider non e' HTTP.
+    """
+    endpoint = getattr(web3.provider, 'endpoint_uri', None)
+    if endpoint is None:
+        return None
+    results = {}
+    for start in range(0, len(tx_hashes), batch_size):
+        chunk = tx_hashes[start:start + batch_size]
+        payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": ['0x' + tx_hash.hex()]}
+            for i, tx_hash in enumerate(chunk)]
+        response = requests.post(str(endpoint), json=payload, timeout=60)
+        response.raise_for_status()
+        for item in response.json():
+            if item.get('error'):
+                logger.warning("%s request failed: %s", method, item['error'])
+            elif item.get('result'):
+                results[chunk[item['id']]] = item['result']
+    return results
+
+
+def fetch_receipts(web3: Web3, tx_hashes, batch_size: int = 500) -> dict:
+    """
+    Ricevute delle transazioni gia' minate tra tx_hashes, indicizzate per hash (bytes)
+    """
+    tx_hashes = [bytes(HexBytes(tx_hash)) for tx_hash in tx_hashes]
+    raw = batch_by_hash(web3, "eth_getTransactionReceipt", tx_hashes, batch_size)
+    if raw is None:
+        receipts = {}
+        for tx_hash in tx_hashes:
+            try:
+                receipts[tx_hash] = web3.eth.getTransactionReceipt(tx_hash)
+            except TransactionNotFound:
+                pass
+        return receipts
+    return {tx_hash: format_receipt(receipt) for tx_hash, receipt in raw.items()}
+
+
+def fetch_transactions(web3: Web3, tx_hashes, batch_size: int = 500) -> dict:
+    """
+    Input e destinatario delle transazioni tra tx_hashes, indicizzati per hash (bytes),
+    come dizionari con le chiavi 'to' e 'input'
+    """
+    tx_hashes = [bytes(HexBytes(tx_hash)) for tx_hash in tx_hashes]
+    raw = batch_by_hash(web3, "eth_getTransactionByHash", tx_hashes, batch_size)
+    if raw is None:
+        raw = {}
+        for tx_hash in tx_hashes:
+            try:
+                raw[tx_hash] = web3.eth.getTransaction(tx_hash)
+            except TransactionNotFound:
+                pass
+    return {tx_hash: {"to": Web3.toChecksumAddress(tx["to"]) if tx["to"] else None, "input": tx["input"]}
+        for tx_hash, tx in raw.items()}
+
+
+class ReceiptTracker:
+    def __init__(self, web3: Web3, pipeline=None, poll_interval: float = 0.5, batch_size: int = 500):
+        """
+        Con una TransactionPipeline le ricevute vengono chieste alla pipeline, che conosce
+        le transazioni rispedite con un hash diverso
+        """
+        self.web3 = web3
+        self.pipeline = pipeline
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.tracked = []
+        self.gas_used = 0
+        self.failures = []
+
+    def add(self, tx_hash, label=None):
+        self.tracked.append((label, tx_hash))
+        return tx_hash
+
+    def _account(self, label, tx_hash, receipt):
+        self.gas_used += receipt.gasUsed
+        if not receipt.status:
+            self.failures.append((label, HexBytes(tx_hash).hex()))
+
+    def wait(self, timeout: float = None):
+        """
+        Attende tutte le transazioni aggiunte e restituisce le coppie (etichetta, ricevuta)
+        nell'ordine di aggiunta; le transazioni attese escono dal tracker
+        """
+        tracked, self.tracked = self.tracked, []
+        if self.pipeline is not None:
+            results = []
+            for label, tx_hash in tracked:
+                receipt = self.pipeline.wait(tx_hash, timeout)
+                if isinstance(tx_hash, Future):
+                    tx_hash = tx_hash.result()
+                self._account(label, tx_hash, receipt)
+                results.append((label, receipt))
+            return results
+
+        tracked = [(label, bytes(HexBytes(tx_hash))) for label, tx_hash in tracked]
+        receipts = {}
+        waiting = set(tx_hash for _, tx_hash in tracked)
+        deadline = None if timeout is None else time.time() + timeout
+        last_block = None
+        while waiting:
+            block = self.web3.eth.blockNumber
+            if block != last_block:
+                last_block = block
+                found = fetch_receipts(self.web3, waiting, self.batch_size)
+                receipts.update(found)
+                waiting.difference_update(found)
+                if not waiting:
+                    break
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError("%d transactions still pending" % len(waiting))
+            time.sleep(self.poll_interval)
+
+        results = []
+        for label, tx_hash in tracked:
+            self._account(label, tx_hash, receipts[tx_hash])
+            results.append((label, receipts[tx_hash]))
+        return results
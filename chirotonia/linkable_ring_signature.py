@@ -1,26 +1,106 @@
 from __future__ import annotations
 
-from .uaosring import uaosring_check
+import struct
+
+from py_ecc.bn128.bn128_field_elements import FQ
+
+from .uaosring import uaosring_check, pkeys_hash_calculator, RingContext
+from .curve import asint
 from .utils import bytes_to_int, quote, quotelist
 
+"""
+Formato binario di una firma (interi big-endian su 32 byte):
+
+    hash cumulativo delle chiavi dell'anello | tag x | tag y | seed | messaggio | n (uint32) | n tees
+
+L'anello non viene ripetuto: e' identificato dal suo pkHashAccumulator.
+"""
+
+SIGNATURE_HEADER = struct.Struct('>32s32s32s32s32sI')
+
+
+class PackedScalars:
+    """
+    Vista in sola lettura su una sequenza di interi da 32 byte, decodificati all'accesso
+    """
+    __slots__ = ('view',)
+
+    def __init__(self, view: memoryview):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // 32
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("PackedScalars index out of range")
+        return int.from_bytes(self.view[32 * i:32 * i + 32], 'big')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+
 class LinkableRingSignature:
-    def __init__(self, pkeys, tag, ring, seed, message):
+    def __init__(self, pkeys, tag, ring, seed, message, ring_hash: int = None, shard: int = None):
         self.pkeys = pkeys
         self.ring = ring
         self.seed = seed
         self.tag = tag
         self.message = message
+        self.ring_hash = ring_hash
+        # Indice dello shard se pkeys e' l'anello di uno shard della votazione
+        self.shard = shard
 
-    def isValid(self) -> bool:
-        return uaosring_check(self.pkeys, self.tag, self.ring, self.seed, bytes_to_int(self.message))
+    def isValid(self, ring: RingContext = None) -> bool:
+        return uaosring_check(ring or self.pkeys, self.tag, self.ring, self.seed, bytes_to_int(self.message))
 
     def isLinked(self, signature: LinkableRingSignature) -> bool:
         return signature.tag == self.tag
 
+    def to_bytes(self) -> bytes:
+        if self.ring_hash is None:
+            self.ring_hash = self.pkeys.hash if isinstance(self.pkeys, RingContext) else pkeys_hash_calculator(self.pkeys)
+        header = SIGNATURE_HEADER.pack(
+            self.ring_hash.to_bytes(32, 'big'),
+            asint(self.tag[0]).to_bytes(32, 'big'),
+            asint(self.tag[1]).to_bytes(32, 'big'),
+            self.seed.to_bytes(32, 'big'),
+            bytes_to_int(self.message).to_bytes(32, 'big'),
+            len(self.ring))
+        return header + b''.join([t.to_bytes(32, 'big') for t in self.ring])
+
+    @classmethod
+    def from_buffer(cls, buffer, pkeys=None) -> LinkableRingSignature:
+        """
+        Legge una firma senza copiare il buffer: i tees restano una vista sul buffer
+        e il messaggio una memoryview. Le chiavi dell'anello vanno fornite dal chiamante;
+        se e' un RingContext se ne verifica l'hash.
+        """
+        view = memoryview(buffer)
+        ring_hash, tag_x, tag_y, seed, _, n = SIGNATURE_HEADER.unpack_from(view)
+        ring_hash = int.from_bytes(ring_hash, 'big')
+        if isinstance(pkeys, RingContext) and pkeys.hash != ring_hash:
+            raise ValueError("Signature was made on a different ring")
+        start = SIGNATURE_HEADER.size
+        if len(view) < start + 32 * n:
+            raise ValueError("Truncated signature")
+        tees = PackedScalars(view[start:start + 32 * n])
+        message = view[128:160]
+        return cls(pkeys, (FQ(int.from_bytes(tag_x, 'big')), FQ(int.from_bytes(tag_y, 'big'))),
+            tees, int.from_bytes(seed, 'big'), message, ring_hash)
+
     def __str__(self):
         return "Check: %s\nPKs: %s\nTag: %s\nRing: %s\nSeed: %s\nMsg: %s\n" % (
-            str(self.isValid()), quotelist([item.n for sublist in self.pkeys for item in sublist]),
+            str(self.isValid()), quotelist([asint(item) for sublist in self.pkeys for item in sublist]),
             quotelist([self.tag[0].n, self.tag[1].n]),
             quotelist(self.ring),
             quote(self.seed), 
-            quote(bytes_to_int(self.message)))
\ No newline at end of file
+            quote(bytes_to_int(self.message)))
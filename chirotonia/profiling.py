@@ -0,0 +1,181 @@
+import functools
+import sys
+import time
+from contextlib import contextmanager
+
+from . import altbn128, utils, uaosring
+
+"""
+Strumentazione opzionale del percorso critico della firma ad anello.
+
+Quando e' disattivata non costa nulla: le funzioni dei moduli restano quelle originali.
+enable() sostituisce in tutti i moduli chirotonia.* ogni riferimento alle funzioni strumentate
+con un wrapper che ne conta le chiamate (e, per quelle non elementari, ne misura il tempo);
+disable() ripristina gli originali. I tempi sono inclusivi: uaosring_sign comprende le
+moltiplicazioni e gli hash che esegue.
+
+    with profile() as stats:
+        voter.ring_sign(pkeys, message)
+    print(stats)
+
+I processi di un pool creati dopo enable() ereditano la strumentazione, ma i loro contatori
+restano nei processi figli.
+"""
+
+# Operazioni elementari: solo conteggio, misurarne il tempo costerebbe piu' dell'operazione
+COUNTED = [
+    (altbn128, 'jacobian_add'),
+    (altbn128, 'jacobian_add_affine'),
+    (altbn128, 'jacobian_double'),
+    (altbn128, 'evalcurve'),
+    (utils, 'hash_link'),
+    (utils, 'hash_chain'),
+]
+
+# Operazioni composte: conteggio e tempo cumulativo
+TIMED = [
+    (utils, 'hashs'),
+    (altbn128, 'hashtopoint'),
+    (altbn128, 'multi_multiply_jacobian'),
+    (altbn128, 'fixed_base_multiply_jacobian'),
+    (altbn128, 'jacobian_normalize'),
+    (uaosring, 'ring_link'),
+    (uaosring, 'pkeys_hash_calculator'),
+    (uaosring, 'uaosring_sign'),
+    (uaosring, 'uaosring_check'),
+    (uaosring, 'uaosring_presign'),
+    (uaosring, 'uaosring_sign_online'),
+]
+
+
+class Stats:
+    def __init__(self):
+        self.counts = {}
+        self.timings = {}
+
+    def reset(self):
+        self.counts.clear()
+        self.timings.clear()
+
+    def as_dict(self):
+        return {
+            "counts": dict(self.counts),
+            "seconds": dict(self.timings),
+            "scalar_multiplications": self.counts.get('multi_multiply_terms', 0) + self.counts.get('fixed_base_multiply_jacobian', 0),
+            "point_additions": self.counts.get('jacobian_add', 0) + self.counts.get('jacobian_add_affine', 0),
+            "hashes": self.counts.get('hashs', 0) + self.counts.get('hash_link', 0) + self.counts.get('hash_chain', 0),
+            "hashtopoint_iterations": self.counts.get('hashtopoint_iterations', 0),
+        }
+
+    def __str__(self):
+        lines = ["%-30s %12s %12s" % ("operation", "calls", "seconds")]
+        for name in sorted(self.counts, key=lambda n: -self.timings.get(n, 0)):
+            seconds = self.timings.get(name)
+            lines.append("%-30s %12d %12s" % (name, self.counts[name], "%.6f" % seconds if seconds is not None else '-'))
+        return "\n".join(lines)
+
+
+stats = Stats()
+_originals = {}
+
+
+def _counted(name, fn):
+    counts = stats.counts
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        counts[name] = counts.get(name, 0) + 1
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _timed(name, fn):
+    counts, timings = stats.counts, stats.timings
+    clock = time.perf_counter
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        counts[name] = counts.get(name, 0) + 1
+        if name == 'multi_multiply_jacobian':
+            counts['multi_multiply_terms'] = counts.get('multi_multiply_terms', 0) + len(args[0])
+        iterations = counts.get('evalcurve', 0)
+        started = clock()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings[name] = timings.get(name, 0) + clock() - started
+            if name == 'hashtopoint':
+                counts['hashtopoint_iterations'] = counts.get('hashtopoint_iterations', 0) + counts.get('evalcurve', 0) - iterations
+    return wrapper
+
+
+def _rebind(replacements):
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not module_name.startswith('chirotonia'):
+            continue
+        namespace = vars(module)
+        for attribute, value in list(namespace.items()):
+            replacement = replacements.get(id(value))
+            if replacement is not None and value is replacement[0]:
+                namespace[attribute] = replacement[1]
+
+
+enabled = lambda: bool(_originals)
+
+
+def enable():
+    if _originals:
+        return stats
+    replacements = {}
+    for wrap, functions in ((_counted, COUNTED), (_timed, TIMED)):
+        for module, name in functions:
+            original = getattr(module, name)
+            wrapper = wrap(name, original)
+            _originals[name] = (original, wrapper)
+            replacements[id(original)] = (original, wrapper)
+    _rebind(replacements)
+    return stats
+
+
+def disable():
+    _rebind({id(wrapper): (wrapper, original) for original, wrapper in _originals.values()})
+    _originals.clear()
+
+
+@contextmanager
+def profile(reset: bool = True):
+    """
+    Attiva la strumentazione per la durata del blocco e restituisce le statistiche raccolte
+    """
+    if reset:
+        stats.reset()
+    was_enabled = enabled()
+    enable()
+    try:
+        yield stats
+    finally:
+        if not was_enabled:
+            disable()
+
+
+if __name__ == "__main__":
+    keys, skeys = uaosring.uaosring_randkeys(8)
+    message = altbn128.randsn()
+
+    with profile() as collected:
+        signature = uaosring.uaosring_sign(keys, (keys[0], skeys[0]), message)
+        assert uaosring.uaosring_check(*signature, message)
+    print(collected)
+    summary = collected.as_dict()
+    assert summary["counts"]["uaosring_sign"] == summary["counts"]["uaosring_check"] == 1
+    assert summary["counts"]["ring_link"] == 16
+    assert summary["counts"]["hash_chain"] == 16
+    assert summary["hashtopoint_iterations"] >= 4
+
+    # Disattivata, le funzioni tornano quelle originali in ogni modulo
+    assert not enabled()
+    assert uaosring.hash_chain is utils.hash_chain and uaosring.jacobian_add is altbn128.jacobian_add
+    assert not hasattr(uaosring.uaosring_sign, '__wrapped__')
+    count = collected.counts["uaosring_sign"]
+    uaosring.uaosring_sign(keys, (keys[0], skeys[0]), message)
+    assert collected.counts["uaosring_sign"] == count
@@ -0,0 +1,233 @@
+import json
+import logging
+import queue
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sha3 import keccak_256
+
+from . import workers
+from .compact_ring import CompactRing
+from .curve import asint
+from .ethereum.contract import Contract
+from .linkable_ring_signature import LinkableRingSignature, SIGNATURE_HEADER
+from .tag_index import TagIndex
+from .uaosring import pkeys_hash_calculator, shard_bounds
+from .utils import bytes_to_int
+
+"""
+Relayer delle schede di una votazione.
+
+Riceve le firme nel formato binario di LinkableRingSignature.to_bytes (POST /ballots), le verifica
+fuori catena con un pool di processi (workers.verify_ballot), scarta i tag gia' visti e invia le schede
+valide a gruppi con votaMultiplo: un gruppo parte quando raggiunge batch_size schede o quando la scheda
+piu' vecchia attende da max_delay secondi. Il contratto verifica comunque ogni scheda e scarta
+singolarmente quelle non valide o collegate, che il relayer riconosce dagli eventi della ricevuta.
+Dopo la firma il corpo della richiesta puo' contenere una scheda cifrata (Voter.pack_encrypted_vote):
+il messaggio firmato deve esserne l'hash, e sul contratto viene salvata la scheda.
+
+L'anello della firma e' riconosciuto dal suo hash: quello dell'intera votazione o, con gli shard,
+quello di uno degli shard. Dalla verifica alla ricevuta il tag e' tenuto in memoria come in attesa;
+nell'indice dei tag usati entra solo quando la ricevuta conferma che il contratto ha accettato la scheda.
+Se la firma non e' valida, il gruppo non parte, va perso o viene annullato, o la scheda e' scartata
+dal contratto, il tag viene rilasciato e il votante puo' ripresentarla. Cosi' chi copia il tag di
+un'altra scheda in una firma non valida non puo' bloccarla.
+"""
+
+logger = logging.getLogger('CHIROTONIA_RELAYER')
+
+ACCEPTED, INVALID, DUPLICATE = 202, 400, 409
+
+
+class Relayer:
+    def __init__(self, contract: Contract, vote_id: str, pkeys, shard_size: int = None, processes: int = 1,
+            batch_size: int = 20, max_delay: float = 2.0, tag_index: TagIndex = None):
+        self.contract = contract
+        self.vote_id = vote_id
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.tag_index = tag_index or TagIndex()
+        if shard_size:
+            self.rings = {pkeys_hash_calculator(pkeys[start:end]): shard
+                for shard, (start, end) in enumerate(shard_bounds(len(pkeys), shard_size))}
+        else:
+            self.rings = {pkeys_hash_calculator(pkeys): None}
+        # I processi di verifica sono avviati prima dei thread del relayer (vedi workers.start_pool)
+        ring_buffer = bytes(CompactRing.from_points(pkeys).buffer)
+        self.pool = workers.start_pool(processes, ring_buffer, True, shard_size or None)
+        self.lock = threading.Lock()
+        # Tag in verifica o inviati e in attesa della ricevuta
+        self.pending = set()
+        self.stats = {"received": 0, "invalid": 0, "duplicates": 0, "queued": 0, "submitted": 0,
+            "accepted": 0, "rejected": 0, "batches": 0, "gas_used": 0}
+        self.ballots = queue.Queue()
+        self.receipts = queue.Queue()
+        self.submitter = threading.Thread(target=self._submit, daemon=True)
+        self.confirmer = threading.Thread(target=self._confirm, daemon=True)
+        self.submitter.start()
+        self.confirmer.start()
+
+    def _count(self, field, amount=1):
+        with self.lock:
+            self.stats[field] += amount
+
+    def relay(self, buffer) -> (int, str):
+        """
+        Verifica una firma e la accoda per l'invio; restituisce (codice HTTP, motivo)
+        """
+        self._count("received")
+        try:
+            signature = LinkableRingSignature.from_buffer(buffer)
+        except (ValueError, TypeError, struct.error) as error:
+            self._count("invalid")
+            return INVALID, str(error)
+        if signature.ring_hash not in self.rings:
+            self._count("invalid")
+            return INVALID, "Unknown ring"
+        signature.shard = self.rings[signature.ring_hash]
+        ballot = bytes(memoryview(buffer)[SIGNATURE_HEADER.size + 32 * len(signature.ring):]) or None
+        if ballot is not None and keccak_256(ballot).digest() != bytes(signature.message):
+            self._count("invalid")
+            return INVALID, "Ballot does not match the signed message"
+        tag_x = asint(signature.tag[0])
+
+        with self.lock:
+            duplicate = tag_x in self.pending or self.tag_index.seen(tag_x, self.vote_id)
+            if not duplicate:
+                self.pending.add(tag_x)
+        if duplicate:
+            self._count("duplicates")
+            return DUPLICATE, "Tag already used"
+        queued = False
+        try:
+            if self.contract.tag_used(self.vote_id, tag_x):
+                self._count("duplicates")
+                return DUPLICATE, "Tag already used"
+            tees = list(signature.ring)
+            valid = self.pool.submit(workers.verify_ballot, (tag_x, asint(signature.tag[1])), tees,
+                signature.seed, bytes_to_int(signature.message), signature.shard).result()
+            if not valid:
+                self._count("invalid")
+                return INVALID, "Invalid signature"
+            signature.ring = tees
+            signature.message = bytes(signature.message)
+            self.ballots.put((time.time(), signature, ballot))
+            queued = True
+        finally:
+            if not queued:
+                with self.lock:
+                    self.pending.discard(tag_x)
+        self._count("queued")
+        return ACCEPTED, "Queued"
+
+    def _release(self, batch, accepted=()):
+        """
+        Chiude l'attesa dei tag di un gruppo: quelli delle schede accettate entrano nell'indice
+        dei tag usati, gli altri tornano liberi
+        """
+        with self.lock:
+            for tag_x in accepted:
+                self.tag_index.add(tag_x, self.vote_id)
+            for signature, _ in batch:
+                self.pending.discard(asint(signature.tag[0]))
+
+    def _submit(self):
+        batch, oldest = [], None
+        while True:
+            timeout = None if oldest is None else max(0, oldest + self.max_delay - time.time())
+            try:
+                item = self.ballots.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item:
+                received, signature, ballot = item
+                oldest = received if oldest is None else oldest
+                batch.append((signature, ballot))
+            if batch and (item is None or len(batch) >= self.batch_size or time.time() >= oldest + self.max_delay):
+                try:
+                    tx_hash = self.contract.vote_batch(self.vote_id, [s for s, _ in batch], [b for _, b in batch])
+                    self.receipts.put((tx_hash, batch))
+                    self._count("submitted", len(batch))
+                    self._count("batches")
+                except Exception as error:
+                    logger.error("Unable to submit %d ballots: %s", len(batch), error)
+                    self._count("rejected", len(batch))
+                    self._release(batch)
+                batch, oldest = [], None
+            if item is None:
+                self.receipts.put(None)
+                return
+
+    def _confirm(self):
+        while True:
+            item = self.receipts.get()
+            if item is None:
+                return
+            tx_hash, batch = item
+            try:
+                receipt = self.contract.wait(tx_hash)
+            except Exception as error:
+                logger.error("Batch of %d ballots lost: %s", len(batch), error)
+                self._count("rejected", len(batch))
+                self._release(batch)
+                continue
+            self._count("gas_used", receipt.gasUsed)
+            if not receipt.status:
+                logger.error("Batch transaction %s reverted", receipt.transactionHash.hex())
+                self._count("rejected", len(batch))
+                self._release(batch)
+                continue
+            accepted = []
+            for (signature, _), outcome in zip(batch, self.contract.batch_outcomes(receipt)):
+                if outcome:
+                    accepted.append(asint(signature.tag[0]))
+                else:
+                    logger.warning("Ballot with tag %d rejected by the contract", asint(signature.tag[0]))
+            self._release(batch, accepted)
+            self._count("rejected", len(batch) - len(accepted))
+            self._count("accepted", len(accepted))
+
+    def close(self):
+        """
+        Invia le schede ancora in coda e attende le ricevute
+        """
+        self.ballots.put(None)
+        self.submitter.join()
+        self.confirmer.join()
+        self.pool.shutdown()
+
+    def server(self, host: str = 'localhost', port: int = 8600) -> ThreadingHTTPServer:
+        """
+        Server HTTP del relayer: POST /ballots con la firma binaria nel corpo, GET /stats
+        """
+        relayer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, body):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                if self.path != '/ballots':
+                    return self._reply(404, {"error": "Not found"})
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                code, reason = relayer.relay(body)
+                self._reply(code, {"status": reason})
+
+            def do_GET(self):
+                if self.path != '/stats':
+                    return self._reply(404, {"error": "Not found"})
+                with relayer.lock:
+                    stats = dict(relayer.stats)
+                self._reply(200, stats)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return ThreadingHTTPServer((host, port), Handler)
@@ -0,0 +1,202 @@
+import heapq
+import itertools
+import math
+import mmap
+import os
+from hashlib import blake2b
+
+from .curve import asint
+
+"""
+Indice dei tag di collegamento per individuare i voti doppi senza confronti a coppie.
+
+Ogni voce e' la chiave di 40 byte hash(votazione)[:8] || x del tag, per cui un solo indice
+puo' servire tutte le votazioni di una sessione, seguita da un riferimento di 32 byte
+(ad es. l'hash della transazione del voto). Reinserire lo stesso tag con lo stesso riferimento
+non e' una collisione, cosi' uno stream puo' essere ripreso da un checkpoint senza falsi positivi.
+Le voci recenti stanno in un dizionario in memoria; superata la soglia vengono scritte su disco
+come file ordinati di record a lunghezza fissa, interrogati tramite mmap e ricerca binaria.
+Un filtro di Bloom davanti evita di accedere ai file per i tag mai visti, che sono la quasi totalita'.
+"""
+
+KEY_SIZE = 40
+RECORD_SIZE = KEY_SIZE + 32
+NO_REFERENCE = bytes(32)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: bytes):
+        digest = blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: bytes):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: bytes):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class SortedRun:
+    """
+    File di record (chiave, riferimento) ordinati per chiave, mappato in memoria
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+
+    def __len__(self):
+        return len(self.buffer) // RECORD_SIZE
+
+    def __getitem__(self, i):
+        return self.buffer[i * RECORD_SIZE:(i + 1) * RECORD_SIZE]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get(self, key: bytes):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.buffer[mid * RECORD_SIZE:mid * RECORD_SIZE + KEY_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.buffer[lo * RECORD_SIZE:lo * RECORD_SIZE + KEY_SIZE] == key:
+            return self.buffer[lo * RECORD_SIZE + KEY_SIZE:(lo + 1) * RECORD_SIZE]
+        return None
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    @classmethod
+    def write(cls, path: str, records):
+        with open(path + '.tmp', 'wb') as run_file:
+            for record in records:
+                run_file.write(record)
+        os.replace(path + '.tmp', path)
+        return cls(path)
+
+
+class TagIndex:
+    def __init__(self, path: str = None, capacity: int = 1000000, memory_limit: int = 1000000, max_runs: int = 8):
+        self.path = path
+        self.memory_limit = memory_limit
+        self.max_runs = max_runs
+        self.bloom = BloomFilter(capacity)
+        self.memory = {}
+        self.runs = []
+        self.collisions = []
+        self.next_run = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.tags'):
+                    run = SortedRun(os.path.join(path, name))
+                    for record in run:
+                        self.bloom.add(record[:KEY_SIZE])
+                    self.runs.append(run)
+                    self.next_run = int(name[4:-5]) + 1
+
+    @staticmethod
+    def key(tag, vote: str = '') -> bytes:
+        """
+        Il tag puo' essere il punto (x, y) o la sola ascissa, come in verificaTag
+        """
+        x = asint(tag[0]) if isinstance(tag, (tuple, list)) else asint(tag)
+        return blake2b(vote.encode(), digest_size=8).digest() + x.to_bytes(32, 'big')
+
+    def _get(self, key: bytes):
+        if key not in self.bloom:
+            return None
+        if key in self.memory:
+            return self.memory[key]
+        for run in self.runs:
+            reference = run.get(key)
+            if reference is not None:
+                return reference
+        return None
+
+    def seen(self, tag, vote: str = '') -> bool:
+        return self._get(self.key(tag, vote)) is not None
+
+    def add(self, tag, vote: str = '', reference: bytes = None) -> bool:
+        """
+        Registra un tag; restituisce False se era gia' presente. Se il riferimento e' diverso
+        da quello registrato la coppia viene annotata in `collisions` come
+        (votazione, x del tag, riferimento precedente, nuovo riferimento).
+        """
+        key = self.key(tag, vote)
+        reference = (reference or NO_REFERENCE).rjust(32, b'\0')
+        previous = self._get(key)
+        if previous is not None:
+            if previous != reference or reference == NO_REFERENCE:
+                self.collisions.append((vote, int.from_bytes(key[8:], 'big'), previous, reference))
+            return False
+        self.bloom.add(key)
+        self.memory[key] = reference
+        if self.path and len(self.memory) >= self.memory_limit:
+            self.flush()
+        return True
+
+    def ingest(self, tags, vote: str = '', references=None):
+        """
+        Registra uno stream di tag, con riferimenti opzionali (ad es. l'hash della transazione),
+        e restituisce le collisioni trovate
+        """
+        start = len(self.collisions)
+        for tag, reference in zip(tags, references or itertools.repeat(None)):
+            self.add(tag, vote, reference)
+        return self.collisions[start:]
+
+    def _new_run(self, keys):
+        run = SortedRun.write(os.path.join(self.path, 'run-%08d.tags' % self.next_run), keys)
+        self.next_run += 1
+        return run
+
+    def flush(self):
+        if not self.path or not self.memory:
+            return
+        self.runs.append(self._new_run(key + self.memory[key] for key in sorted(self.memory)))
+        self.memory = {}
+        if len(self.runs) > self.max_runs:
+            self.compact()
+
+    def compact(self):
+        """
+        Unisce tutti i file ordinati in uno solo (merge in O(n log r))
+        """
+        if len(self.runs) < 2:
+            return
+        merged = self._new_run(heapq.merge(*self.runs))
+        for run in self.runs:
+            run.close()
+            os.remove(run.path)
+        self.runs = [merged]
+
+    def close(self):
+        self.flush()
+        for run in self.runs:
+            run.close()
+
+    def __len__(self):
+        return len(self.memory) + sum(len(run) for run in self.runs)
+
+
+def find_collisions(tags):
+    """
+    Collisioni in una collezione di tag, ordinando le ascisse in O(n log n)
+    """
+    xs = sorted(asint(tag[0]) if isinstance(tag, (tuple, list)) else asint(tag) for tag in tags)
+    return sorted(set(a for a, b in zip(xs, xs[1:]) if a == b))
@@ -0,0 +1,182 @@
+import json
+import os
+from typing import TYPE_CHECKING
+
+from . import elgamal
+
+if TYPE_CHECKING:
+    # Solo per le annotazioni: il conteggio non richiede web3 ne' il contratto compilato
+    from .ethereum.contract import Contract
+
+"""
+Scrutinio incrementale di una votazione dagli eventi VotoAccettato.
+
+I log vengono letti a intervalli di blocchi; dopo ogni intervallo il checkpoint (prossimo blocco,
+voti contati, conteggi parziali) viene salvato su file, per cui rieseguire lo scrutinio, anche
+durante la votazione, elabora solo i voti nuovi. Ogni evento porta la posizione del voto
+nell'elenco del contratto: i voti gia' contati vengono riconosciuti e saltati anche se un
+intervallo viene riletto dopo un'interruzione.
+
+La scelta e' l'ultimo byte del voto (Voter.pack_vote_in_random32). I byte delle scelte di un
+intervallo vengono raccolti in un unico bytes e contati con bytes.count, senza un ciclo Python per voto.
+Per le votazioni cifrate EncryptedTally verifica le prove delle schede e somma le cifrature (elgamal.py);
+il checkpoint contiene le somme cifrate e i totali si decifrano solo alla lettura dei risultati.
+"""
+
+
+def choice_bytes(ballots: [str]) -> bytes:
+    """
+    Ultimo byte di ogni voto (stringa esadecimale '0x...'); un voto malformato diventa 0xff, mai una scelta valida.
+    Il percorso veloce vale solo se tutti i voti sono ben formati: il risultato e' sempre quello di choice_byte.
+    """
+    if all(ballot.startswith('0x') and len(ballot) > 2 for ballot in ballots):
+        try:
+            choices = bytes.fromhex(''.join(ballot[-2:] for ballot in ballots))
+            # fromhex ignora gli spazi: un voto che termina con spazi sposterebbe le coppie
+            if len(choices) == len(ballots):
+                return choices
+        except ValueError:
+            pass
+    return bytes(choice_byte(ballot) for ballot in ballots)
+
+
+def choice_byte(ballot: str) -> int:
+    try:
+        return bytes.fromhex(ballot[-2:])[0] if ballot.startswith('0x') and len(ballot) > 2 else 0xff
+    except (ValueError, IndexError):
+        return 0xff
+
+
+class Tally:
+    def __init__(self, contract: 'Contract', vote_id: str, choices: int, checkpoint_path: str = None, start_block: int = 0):
+        self.contract = contract
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = {
+            "vote": vote_id,
+            "nextBlock": start_block,
+            "ballots": 0,
+            "counts": [0] * choices,
+            "invalid": 0
+        }
+        if checkpoint_path and os.path.isfile(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if saved["vote"] == vote_id and len(saved["counts"]) == choices:
+                self.checkpoint = saved
+
+    @property
+    def counts(self) -> [int]:
+        return self.checkpoint["counts"]
+
+    @property
+    def ballots(self) -> int:
+        return self.checkpoint["ballots"]
+
+    def count(self, ballots: [str]):
+        choices = choice_bytes(ballots)
+        counted = 0
+        for choice in range(len(self.counts)):
+            occurrences = choices.count(choice)
+            self.counts[choice] += occurrences
+            counted += occurrences
+        self.checkpoint["invalid"] += len(choices) - counted
+        self.checkpoint["ballots"] += len(choices)
+
+    def update(self, to_block: int = None, chunk: int = 1000) -> int:
+        """
+        Conta i voti accettati fino a to_block (default: ultimo blocco) e restituisce quanti erano nuovi
+        """
+        if to_block is None:
+            to_block = self.contract.block_number()
+        counted = self.ballots
+        while self.checkpoint["nextBlock"] <= to_block:
+            end = min(self.checkpoint["nextBlock"] + chunk - 1, to_block)
+            accepted = self.contract.get_accepted_ballots(self.checkpoint["vote"], self.checkpoint["nextBlock"], end)
+            self.count([ballot for _, index, ballot in accepted if index >= self.ballots])
+            self.checkpoint["nextBlock"] = end + 1
+            self.save()
+        return self.ballots - counted
+
+    def save(self):
+        if not self.checkpoint_path:
+            return
+        with open(self.checkpoint_path + '.tmp', 'w') as checkpoint_file:
+            json.dump(self.checkpoint, checkpoint_file)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def results(self, names: [str]) -> dict:
+        return dict(zip(names, self.counts))
+
+
+class EncryptedTally(Tally):
+    def __init__(self, contract: 'Contract', vote_id: str, choices: int, checkpoint_path: str = None, start_block: int = 0,
+            secret_key: int = None, electorate: int = None, processes: int = 1, public_key=None):
+        """
+        Le prove delle schede si verificano con la chiave pubblica della votazione (punto o forma compressa
+        esadecimale, come sul contratto), ricavata dalla chiave segreta se non e' indicata.
+        La tabella del logaritmo discreto e' dimensionata sugli aventi diritto (electorate):
+        nessuna scelta puo' ricevere piu' voti
+        """
+        super().__init__(contract, vote_id, choices, checkpoint_path, start_block)
+        if "sums" not in self.checkpoint:
+            self.checkpoint["sums"] = elgamal.encode_sums([[elgamal.JINF, elgamal.JINF]] * choices)
+        self.choices = choices
+        self.secret_key = secret_key
+        if isinstance(public_key, str):
+            public_key = elgamal.decode_key(public_key)
+        elif public_key is None and secret_key is not None:
+            public_key = elgamal.public_key_of(secret_key)
+        if public_key is None:
+            raise ValueError("The public key is required to verify the ballots")
+        self.public_key = public_key
+        self.electorate = electorate
+        self.processes = processes
+        self.table = None
+
+    def count(self, ballots: [str]):
+        # Come in choice_byte, un voto senza prefisso '0x' o non esadecimale e' una scheda non valida (b'')
+        encrypted = []
+        for ballot in ballots:
+            try:
+                encrypted.append(bytes.fromhex(ballot[2:]) if ballot.startswith('0x') else b'')
+            except ValueError:
+                encrypted.append(b'')
+        sums, invalid = elgamal.sum_ballots_parallel(encrypted, self.choices, self.public_key, self.processes)
+        self.checkpoint["sums"] = elgamal.encode_sums(elgamal.merge_sums(elgamal.decode_sums(self.checkpoint["sums"]), sums))
+        self.checkpoint["invalid"] += invalid
+        self.checkpoint["ballots"] += len(ballots)
+
+    @property
+    def counts(self) -> [int]:
+        if self.secret_key is None:
+            raise ValueError("The secret key is required to decrypt the tally")
+        if self.table is None:
+            self.table = elgamal.DiscreteLogTable(self.electorate or max(self.ballots, 1))
+        return elgamal.decrypt_sums(elgamal.decode_sums(self.checkpoint["sums"]), self.secret_key, self.table)
+
+
+if __name__ == "__main__":
+    from os import urandom
+
+    ballots = ['0x' + (urandom(31) + bytes([i % 3])).hex() for i in range(1000)] + ['0x' + urandom(31).hex() + 'ff', 'voto']
+    assert choice_bytes(ballots[:3]) == bytes([0, 1, 2])
+    assert choice_bytes(ballots)[-2:] == b'\xff\xff'
+    # Il conteggio di un voto non dipende dagli altri voti dell'intervallo
+    assert choice_bytes(['abcd01', '0x02']) == b'\xff\x02' and choice_bytes(['abcd01', 'zz']) == b'\xff\xff'
+    assert choice_bytes(['0x  ', '0x01']) == b'\xff\x01'
+
+    tally = Tally(None, 'test', 3)
+    tally.count(ballots)
+    assert tally.counts == [334, 333, 333]
+    assert tally.checkpoint["invalid"] == 2 and tally.ballots == 1002
+    print(tally.results(['A', 'B', 'C']))
+
+    secret_key, public_key = elgamal.generate_keys()
+    votes = [i % 4 for i in range(30)]
+    encrypted = ['0x' + elgamal.encrypt_choice(v, 3, public_key).hex() for v in votes] + ['0xzz']
+    encrypted.append(encrypted[0][2:] + '00')
+    encrypted_tally = EncryptedTally(None, 'test', 3, secret_key=secret_key, electorate=100, public_key=elgamal.encode_key(public_key))
+    encrypted_tally.count(encrypted[:10])
+    encrypted_tally.count(encrypted[10:])
+    assert encrypted_tally.counts == [8, 8, 7] and encrypted_tally.checkpoint["invalid"] == 2
+    print(encrypted_tally.results(['A', 'B', 'C']))
@@ -15,58 +15,211 @@ For more information, see:
 
 def uaosring_randkeys(n):
 	skeys = [randsn() for _ in range(0, n)]
-	pkeys = [sbmul(sk) for sk in skeys]
+	pkeys = [(FQ(x), FQ(y)) for x, y in jacobian_normalize([sbmul_jacobian(sk) for sk in skeys])]
 	return pkeys, skeys
 
+class RingContext:
+	"""
+	Stato di un anello di chiavi pubbliche calcolato una sola volta e riutilizzabile
+	per firmare e verificare molte firme sullo stesso anello: hash cumulativo delle chiavi,
+	punto L, indice chiave -> posizione e, opzionalmente, le tabelle wNAF di ogni chiave.
+	Si comporta come la sequenza delle chiavi da cui e' costruito, che puo' essere
+	anche un CompactRing: in quel caso la ricerca della chiave avviene sul buffer.
+	"""
+	def __init__(self, pkeys, precompute=False):
+		assert len(pkeys) > 0
+		self.pkeys = pkeys
+		self.hash = pkeys_hash_calculator(pkeys)
+		self.L = hashtopoint(self.hash)
+		self.Ltable = ring_table(self.L)
+		self.positions = None
+		if isinstance(pkeys, (list, tuple)):
+			self.positions = {(asint(pk[0]), asint(pk[1])): i for i, pk in enumerate(pkeys)}
+		self.tables = None
+		if precompute:
+			tables = [wnaf_table(to_jacobian(pk)) for pk in pkeys]
+			size = len(tables[0])
+			flat = jacobian_normalize([P for table in tables for P in table])
+			self.tables = [flat[i:i + size] for i in range(0, len(flat), size)]
+
+	def __len__(self):
+		return len(self.pkeys)
+
+	def __getitem__(self, i):
+		return self.pkeys[i]
+
+	def __iter__(self):
+		return iter(self.pkeys)
+
+	def index(self, pk) -> int:
+		if self.positions is None:
+			return self.pkeys.index(pk)
+		try:
+			return self.positions[(asint(pk[0]), asint(pk[1]))]
+		except KeyError:
+			raise ValueError("Public key is not part of the ring")
+
+	def table(self, i):
+		if self.tables is not None:
+			return self.tables[i]
+		return wnaf_table(to_jacobian(self.pkeys[i]))
+
+as_ring = lambda pkeys: pkeys if isinstance(pkeys, RingContext) else RingContext(pkeys)
+
+# Anelli suddivisi in shard, come in Chirotonia.sol (impostaShard): shard di shard_size chiavi
+# nell'ordine di accreditamento; un ultimo shard con meno di meta' (per eccesso) delle chiavi di uno shard
+# pieno, o con una sola chiave, e' unito al precedente.
+def shard_bounds(n, shard_size):
+	if shard_size < 2:
+		raise ValueError("Shard size must be at least 2")
+	bounds = [(i, min(i + shard_size, n)) for i in range(0, n, shard_size)]
+	if len(bounds) > 1 and bounds[-1][1] - bounds[-1][0] < max(2, (shard_size + 1) // 2):
+		bounds[-2:] = [(bounds[-2][0], n)]
+	return bounds
+
+def shard_of(pkeys, pk, shard_size):
+	"""
+	Indice dello shard che contiene pk e chiavi del suo anello
+	"""
+	pkeys = pkeys.pkeys if isinstance(pkeys, RingContext) else pkeys
+	position = pkeys.index(pk)
+	for shard, (start, end) in enumerate(shard_bounds(len(pkeys), shard_size)):
+		if start <= position < end:
+			return shard, pkeys[start:end]
+
 # Versione ottimizzata per l'uso con smart contract
 # - L'hash delle chiavi pubbliche viene calcolato accodando ogni nuova chiave pubblica all'hash delle precedenti
+# - pkeys puo' essere una lista di chiavi o un RingContext gia' calcolato
 def uaosring_sign(pkeys, mypair, message, tees=None):
-	assert len(pkeys) > 0
+	ring = as_ring(pkeys)
 	mypk, mysk = mypair
-	myidx = pkeys.index(mypk)
+	myidx = ring.index(mypk)
 
-	tees = tees or [randsn() for _ in range(0, len(pkeys))]
-	cees = [0 for _ in range(0, len(pkeys))]
+	tees = tees or [randsn() for _ in range(0, len(ring))]
 	alpha = randsn()
 
 	M = hashtopoint(message)
-	L = hashtopoint(pkeys_hash_calculator(pkeys))
-	T = multiply(L, mysk)
+	T = from_jacobian(multi_multiply_jacobian([(ring.Ltable, mysk)], RING_WINDOW))
+	Ttable = ring_table(T)
 	h = hashp(M, T)
 
-	for n, i in [(n, (myidx+n) % len(pkeys)) for n in range(0, len(pkeys))]:
-		Y = pkeys[i]
-		t = tees[i]
-		c = alpha if n == 0 else cees[i-1]
+	# La catena parte da myidx con c = alpha; serve conservare solo l'ultimo c e quello
+	# calcolato sull'ultima chiave (il seed), non l'intera lista
+	c = alpha
+	for n in range(0, len(ring)):
+		i = (myidx + n) % len(ring)
+		c = hash_chain(h, ring_link(ring.Ltable, Ttable, ring.table(i), tees[i], c))
+		if i == len(ring) - 1:
+			seed = c
 
-		a = add(sbmul(t), multiply(Y, c))
-		b = add(multiply(L, t), multiply(T, c))
-		cees[i] = hashs(h, hashp(T, a, b))
-
-	alpha_gap = submodn(alpha, cees[myidx-1])
+	alpha_gap = submodn(alpha, c)
 	tees[myidx] = addmodn(tees[myidx], mulmodn(mysk, alpha_gap))
 
-	return pkeys, T, tees, cees[-1]
+	return pkeys, T, tees, seed
 
 def uaosring_check(pkeys, tag, tees, seed, message):
-	assert len(pkeys) > 0
-	assert len(tees) == len(pkeys)
-	L = hashtopoint(pkeys_hash_calculator(pkeys))
+	ring = as_ring(pkeys)
+	assert len(tees) == len(ring)
 	M = hashtopoint(message)
 	h = hashp(M, tag)
+	Ttable = ring_table(tag)
 	c = seed
-	for i, y in enumerate(pkeys):
-		t = tees[i]
-		a = add(sbmul(t), multiply(y, c))
-		b = add(multiply(L, t), multiply(tag, c))
-		c = hashs(h, hashp(tag, a, b))
+	for i in range(len(ring)):
+		c = hash_chain(h, ring_link(ring.Ltable, Ttable, ring.table(i), tees[i], c))
 	return c == seed
 
+# L e T restano gli stessi per tutto l'anello: le loro tabelle wNAF si calcolano una volta sola
+RING_WINDOW = 5
+ring_table = lambda P: wnaf_table(to_jacobian(P), RING_WINDOW, affine=True)
+
+def ring_link(Ltable, Ttable, Ytable, t, c):
+	"""
+	Calcola hashp(T, a, b) con a = t*G + c*Y e b = t*L + c*T, come RingLink in Chirotonia.sol.
+	t*G usa la tabella a base fissa, t*L + c*T condivide i raddoppi (Straus).
+	I punti restano in coordinate Jacobiane e vengono normalizzati insieme con una sola inversione.
+	"""
+	a = jacobian_add(sbmul_jacobian(t), multi_multiply_jacobian([(Ytable, c)]))
+	b = multi_multiply_jacobian([(Ltable, t), (Ttable, c)], RING_WINDOW)
+	return link_hash(Ttable, a, b)
+
+def link_hash(Ttable, a, b):
+	(ax, ay), (bx, by) = jacobian_normalize([a, b])
+	Tx, Ty = Ttable[0]
+	return hash_link(Tx, Ty, ax, ay, bx, by)
+
+class Presignature:
+	"""
+	Parte della firma che non dipende dal messaggio, calcolabile offline:
+	tees, alpha, il tag T con la sua tabella a base fissa e i punti t*G e t*L
+	per ogni membro dell'anello (in affine).
+	Una presignature si puo' usare una sola volta: riusarla con due messaggi diversi
+	rivelerebbe la chiave privata.
+	"""
+	def __init__(self, ring, mypair, tees, alpha, T, Tfixed, tGL):
+		self.ring = ring
+		self.mypair = mypair
+		self.tees = tees
+		self.alpha = alpha
+		self.T = T
+		self.Tfixed = Tfixed
+		self.tGL = tGL
+		self.used = False
+
+# Finestra della tabella a base fissa di T costruita offline
+PRESIGN_WINDOW = 6
+
+def uaosring_presign(pkeys, mypair, tees=None):
+	ring = as_ring(pkeys)
+	mypk, mysk = mypair
+	ring.index(mypk)
+
+	tees = tees or [randsn() for _ in range(0, len(ring))]
+	alpha = randsn()
+
+	T = from_jacobian(multi_multiply_jacobian([(ring.Ltable, mysk)], RING_WINDOW))
+	Tfixed = fixed_base_table(to_jacobian(T), PRESIGN_WINDOW)
+	tGL = []
+	for t in tees:
+		tGL.append(sbmul_jacobian(t))
+		tGL.append(multi_multiply_jacobian([(ring.Ltable, t)], RING_WINDOW))
+	return Presignature(ring, mypair, tees, alpha, T, Tfixed, jacobian_normalize(tGL))
+
+def uaosring_sign_online(presignature, message):
+	"""
+	Completa una presignature: per ogni membro restano da calcolare solo c*Y e c*T.
+	Il risultato e' identico a quello di uaosring_sign con gli stessi tees e alpha.
+	"""
+	if presignature.used:
+		raise ValueError("Presignature already used")
+	presignature.used = True
+	ring, T, Tfixed, tGL = presignature.ring, presignature.T, presignature.Tfixed, presignature.tGL
+	mypk, mysk = presignature.mypair
+	myidx = ring.index(mypk)
+	tees = list(presignature.tees)
+	alpha = presignature.alpha
+
+	M = hashtopoint(message)
+	Ttable = ring_table(T)
+	h = hashp(M, T)
+
+	c = alpha
+	for n in range(0, len(ring)):
+		i = (myidx + n) % len(ring)
+		a = jacobian_add_affine(multi_multiply_jacobian([(ring.table(i), c)]), tGL[2 * i])
+		b = jacobian_add_affine(fixed_base_multiply_jacobian(Tfixed, c), tGL[2 * i + 1])
+		c = hash_chain(h, link_hash(Ttable, a, b))
+		if i == len(ring) - 1:
+			seed = c
+
+	tees[myidx] = addmodn(tees[myidx], mulmodn(mysk, submodn(alpha, c)))
+
+	return ring.pkeys, T, tees, seed
+
 def pkeys_hash_calculator(pkeys):
 	assert len(pkeys) > 0
-	hash_acc = hashs(pkeys[0][0].n)
-	for pk in pkeys[1:len(pkeys)]:
-		hash_acc = hashs(hash_acc, pk[0].n)
+	hash_acc = None
+	for pk in pkeys:
+		hash_acc = hashs(asint(pk[0])) if hash_acc is None else hashs(hash_acc, asint(pk[0]))
 	return hash_acc
 
 
@@ -74,6 +227,20 @@ if __name__ == "__main__":
 	msg = randsn()
 	keys = uaosring_randkeys(4)
 
+	assert shard_bounds(9, 4) == [(0, 4), (4, 9)]
+	assert shard_bounds(10, 4) == [(0, 4), (4, 8), (8, 10)]
+	assert shard_bounds(11, 4) == [(0, 4), (4, 8), (8, 11)]
+	assert shard_bounds(3, 4) == [(0, 3)]
+	assert shard_bounds(7, 3) == [(0, 3), (3, 7)]
+	assert shard_bounds(8, 3) == [(0, 3), (3, 6), (6, 8)]
+	assert shard_bounds(5, 2) == [(0, 2), (2, 5)]
+	assert shard_bounds(12, 5) == [(0, 5), (5, 12)]
+	assert shard_bounds(13, 5) == [(0, 5), (5, 10), (10, 13)]
+	assert all(end - start >= 2 for n in range(2, 40) for size in range(2, 9) for start, end in shard_bounds(n, size))
+	shard, shard_keys = shard_of(keys[0], keys[0][3], 2)
+	assert shard == 1 and shard_keys == keys[0][2:]
+	assert uaosring_check(*uaosring_sign(shard_keys, (keys[0][3], keys[1][3]), msg), message=msg)
+
 	print(uaosring_check(*uaosring_sign(*keys, message=msg), message=msg))
 
 	proof = uaosring_sign(*keys, message=msg)
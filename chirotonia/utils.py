@@ -1,7 +1,6 @@
 import sys
 import binascii
 import math
-from functools import reduce
 from os import urandom
 from sha3 import keccak_256
 
@@ -15,7 +14,7 @@ quotelist = lambda x: '[' + quotemany(*x) + ']'
 
 safe_ord = ord if sys.version_info.major == 2 else lambda x: x if isinstance(x, int) else ord(x)
 
-bytes_to_int = lambda x: reduce(lambda o, b: (o << 8) + safe_ord(b), [0] + list(x))
+bytes_to_int = lambda x: int.from_bytes(x, 'big')
 
 def packl(lnum):
     if lnum == 0:
@@ -31,9 +30,21 @@ zpad = lambda x, l: b'\x00' * max(0, l - len(x)) + x
 
 tobe256 = lambda v: zpad(int_to_big_endian(v), 32)
 
+# Kernel di hashing: ogni intero e' serializzato direttamente con int.to_bytes su 32 byte
+# e il digest decodificato con int.from_bytes. Concatenare i pezzi risulta piu' veloce
+# che scriverli in un buffer preallocato, per via del costo delle assegnazioni a slice.
 def hashs(*x):
-    data = b''.join(map(tobe256, x))
-    return bytes_to_int(keccak_256(data).digest())
+    return int.from_bytes(keccak_256(b''.join([int(v).to_bytes(32, 'big') for v in x])).digest(), 'big')
+
+# Layout fissi del ciclo dell'anello: hashp(T, a, b) e hashs(h, link)
+def hash_link(Tx, Ty, ax, ay, bx, by):
+    return int.from_bytes(keccak_256(
+        Tx.to_bytes(32, 'big') + Ty.to_bytes(32, 'big') +
+        ax.to_bytes(32, 'big') + ay.to_bytes(32, 'big') +
+        bx.to_bytes(32, 'big') + by.to_bytes(32, 'big')).digest(), 'big')
+
+def hash_chain(h, link):
+    return int.from_bytes(keccak_256(h.to_bytes(32, 'big') + link.to_bytes(32, 'big')).digest(), 'big')
 
 randb256 = lambda: urandom(32)
 
@@ -63,3 +74,12 @@ if __name__ == "__main__":
     assert bin(bit_clear(3, 1)) == '0b10'
     assert bin(bit_clear(3, 2)) == '0b1'
     assert bin(bit_set(0, 1)) == '0b1'
+
+    # The hashing kernel must match the generic tobe256 serialization
+    legacy = lambda *x: int(keccak_256(b''.join(map(tobe256, x))).hexdigest(), 16)
+    values = [0, 1, 2**255 + 7, 2**256 - 1, 123456789, 987654321]
+    assert hashs(*values) == legacy(*values)
+    assert hash_link(*values) == legacy(*values)
+    assert hash_chain(values[2], values[3]) == legacy(values[2], values[3])
+    assert bytes_to_int(b'\x01\x00') == 256
+    assert powmod(3, 2**200 + 1, 2**255 - 19) == pow(3, 2**200 + 1, 2**255 - 19)
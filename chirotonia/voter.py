@@ -1,7 +1,10 @@
 from os import urandom
 
+from sha3 import keccak_256
+
 from .curve import randsn, sbmul, hashs
-from .uaosring import uaosring_sign
+from .elgamal import encrypt_choice, decode_key
+from .uaosring import uaosring_sign, uaosring_presign, uaosring_sign_online, shard_of, RingContext, Presignature
 from .utils import bytes_to_int, Point
 
 from .linkable_ring_signature import LinkableRingSignature
@@ -19,14 +22,43 @@ class Voter:
             self.private_key = randsn()
             self.public_key = sbmul(self.private_key)
     
-    def ring_sign(self, pkeys: [Point], message: bytes, tees: [int] = None) -> LinkableRingSignature:
+    def ring_sign(self, pkeys: [Point] or RingContext, message: bytes, tees: [int] = None, shard_size: int = None) -> LinkableRingSignature:
+        """
+        Con shard_size, pkeys sono tutti i votanti della votazione e la firma
+        e' calcolata sul solo anello dello shard del votante
+        """
         if not self.private_key:
-            raise "Voter can't sign without a private key"
+            raise ValueError("Voter can't sign without a private key")
+        shard = None
+        if shard_size:
+            shard, pkeys = shard_of(pkeys, self.public_key, shard_size)
         signature = uaosring_sign(pkeys, (self.public_key, self.private_key), bytes_to_int(message), tees)
-        return LinkableRingSignature(pkeys, signature[1], signature[2], signature[3], message)
+        return LinkableRingSignature(pkeys, signature[1], signature[2], signature[3], message, shard=shard)
+
+    def presign(self, pkeys: [Point] or RingContext, tees: [int] = None) -> Presignature:
+        if not self.private_key:
+            raise ValueError("Voter can't sign without a private key")
+        return uaosring_presign(pkeys, (self.public_key, self.private_key), tees)
+
+    @classmethod
+    def ring_sign_online(self, presignature: Presignature, message: bytes) -> LinkableRingSignature:
+        signature = uaosring_sign_online(presignature, bytes_to_int(message))
+        return LinkableRingSignature(presignature.ring, signature[1], signature[2], signature[3], message)
 
     @classmethod
     def pack_vote_in_random32(self, vote: bytes) -> bytes:
         assert(len(vote) <= 32)
         return urandom(32 - len(vote)) + vote
 
+    @classmethod
+    def pack_encrypted_vote(self, choice: int, choices: int, encryption_key) -> (bytes, bytes):
+        """
+        Scheda cifrata con la chiave della votazione (punto o sua forma compressa esadecimale)
+        e messaggio da firmare, il keccak256 della scheda. Il contratto accetta la scheda solo se il
+        suo hash e' il messaggio firmato (schedaFirmata): la firma ad anello copre cosi' la cifratura
+        """
+        if isinstance(encryption_key, str):
+            encryption_key = decode_key(encryption_key)
+        ballot = encrypt_choice(choice, choices, encryption_key)
+        return ballot, keccak_256(ballot).digest()
+
@@ -0,0 +1,79 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from py_ecc.bn128.bn128_field_elements import FQ
+
+from .compact_ring import CompactRing
+from .linkable_ring_signature import LinkableRingSignature
+from .uaosring import RingContext, uaosring_sign, uaosring_check, shard_bounds
+
+"""
+Funzioni eseguite nei processi di un pool (concurrent.futures.ProcessPoolExecutor).
+
+L'anello viene spedito una sola volta per processo, come buffer di un CompactRing,
+tramite l'initializer del pool; ogni processo costruisce il proprio RingContext.
+Firme e voti viaggiano come tuple di interi per non serializzare l'anello ad ogni task.
+Con una dimensione di shard l'anello e' quello dell'intera votazione e ogni processo costruisce
+i RingContext degli shard alla prima firma o verifica che li usa.
+
+Gli script eth_* non sono importabili senza rieseguirli, per cui i pool usano il contesto fork;
+start_pool crea subito tutti i processi, cosi' che la fork avvenga prima che il chiamante avvii
+dei thread (pipeline, relayer, server HTTP) i cui lock verrebbero copiati nei processi figli.
+"""
+
+ring = None
+shards = None
+shard_rings = {}
+precompute_tables = False
+
+def init_ring(ring_buffer: bytes, precompute: bool = False, shard_size: int = None):
+    global ring, shards, precompute_tables
+    if shard_size:
+        ring = CompactRing(ring_buffer)
+        shards = shard_bounds(len(ring), shard_size)
+        precompute_tables = precompute
+    else:
+        ring = RingContext(CompactRing(ring_buffer), precompute)
+
+def ready():
+    return True
+
+def start_pool(processes: int, ring_buffer: bytes, precompute: bool = False, shard_size: int = None) -> ProcessPoolExecutor:
+    """
+    Pool di processi con l'anello gia' caricato; i processi sono tutti avviati quando la funzione ritorna
+    """
+    pool = ProcessPoolExecutor(processes, multiprocessing.get_context('fork'), init_ring, (ring_buffer, precompute, shard_size))
+    # Compiti inviati insieme: il pool avvia un processo per ognuno finche' non ne ha `processes`
+    wait([pool.submit(ready) for _ in range(processes)])
+    return pool
+
+def ring_of(shard: int = None) -> RingContext:
+    if shard is None:
+        return ring
+    if shard not in shard_rings:
+        start, end = shards[shard]
+        shard_rings[shard] = RingContext(ring[start:end], precompute_tables)
+    return shard_rings[shard]
+
+def sign_ballot(private_key: int, public_key: (int, int), message: bytes):
+    shard = None
+    if shards is not None:
+        position = ring.index(public_key)
+        shard = next(i for i, (start, end) in enumerate(shards) if start <= position < end)
+    _, tag, tees, seed = uaosring_sign(ring_of(shard), (public_key, private_key), int.from_bytes(message, 'big'))
+    return (tag[0].n, tag[1].n), tees, seed, message, shard
+
+def to_signature(pkeys, signed_ballot, shard_size: int = None) -> LinkableRingSignature:
+    (tag_x, tag_y), tees, seed, message, shard = signed_ballot
+    if shard is not None:
+        start, end = shard_bounds(len(pkeys), shard_size)[shard]
+        pkeys = pkeys[start:end]
+    return LinkableRingSignature(pkeys, (FQ(tag_x), FQ(tag_y)), tees, seed, message, shard=shard)
+
+def verify_ballot(tag: (int, int), tees: [int], seed: int, vote_hash: int, shard: int = None) -> bool:
+    if shard is not None and (shards is None or not 0 <= shard < len(shards)):
+        return False
+    signing_ring = ring_of(shard)
+    if len(tees) != len(signing_ring):
+        return False
+    return uaosring_check(signing_ring, (FQ(tag[0]), FQ(tag[1])), tees, seed, vote_hash)
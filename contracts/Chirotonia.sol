@@ -1,4 +1,6 @@
 pragma solidity ^0.5.0;
+// Necessario per passare string[] ad accreditaVotanti
+pragma experimental ABIEncoderV2;
 
 import "./lib/Curve.sol";
 
@@ -9,6 +11,9 @@ contract Chirotonia {
     event VotazioneScrutinata(string identificativo);
     event VotazioneArchiviata(string identificativo);
     event VotanteAccreditato(string identificativoVotazione, uint256 chiaveX);
+    event VotoRifiutato(string identificativoVotazione, uint256 tagX);
+    // L'identificativo è indicizzato (come hash) per filtrare i log di una sola votazione
+    event VotoAccettato(string indexed identificativoVotazione, uint256 indice, bytes voto);
     
     
     using Curve for Curve.G1Point;
@@ -28,8 +33,17 @@ contract Chirotonia {
         uint256[] votanti;
         mapping(uint256 => bool) votanteAccreditato;
         StatoVotazione stato;
-        string[] voti;
+        bytes[] voti;
         mapping(uint256 => bool) votiAccettati;
+        // Suddivisione in shard dell'anello (0 = anello unico)
+        uint256 dimensioneShard;
+        bytes32[] accumulatoriShard;
+        // Chiavi dei votanti come coppie (x, y) consecutive, lette in sequenza dalla verifica delle firme
+        uint256[] anello;
+        // Punti L = HashToPoint(hash cumulativo) dell'anello, calcolato all'avvio del voto,
+        // e degli shard, calcolati al primo voto dello shard ((0, 0) finche' non servono)
+        Curve.G1Point puntoL;
+        Curve.G1Point[] puntiShard;
     }
     
     mapping(string => Votazione) public votazioni;
@@ -40,7 +54,8 @@ contract Chirotonia {
     
     address public privacyManager;
 
-    string encryptionKey;
+    // Chiave pubblica ElGamal (punto compresso in esadecimale) con cui i votanti cifrano le schede
+    string public encryptionKey;
     
     modifier onlyManager {
         require(msg.sender == manager);
@@ -82,6 +97,21 @@ contract Chirotonia {
         votazione.scelte[_codice] = _scelta;
     }
     
+    /**
+        Suddivide i votanti di una votazione in shard di dimensione fissa, nell'ordine di accreditamento.
+        Ogni shard ha il proprio hash cumulativo e le firme sono calcolate sul solo anello dello shard,
+        per cui il costo di un voto dipende dalla dimensione dello shard e non dal numero di votanti.
+        Va impostata prima di accreditare il primo votante.
+     */
+    function impostaShard(string calldata _identificativoVotazione, uint256 _dimensione) external onlyIdentityManager {
+        Votazione storage votazione = votazioni[_identificativoVotazione];
+        require(votazione.stato == StatoVotazione.Registrazione, "Registrazione votanti chiusa");
+        require(votazione.votanti.length == 0, "Votanti già accreditati");
+        // Uno shard di un solo votante non offrirebbe alcun anonimato
+        require(_dimensione > 1, "Dimensione shard non valida");
+        votazione.dimensioneShard = _dimensione;
+    }
+
     /**
         Funzione di accreditamento del votante da parte dell'identity manager.
         Il votante può essere accreditato per più votazioni. I suoi dati vengono salvati solo una volta.
@@ -92,23 +122,143 @@ contract Chirotonia {
         uint256 _chiave_y,
         string calldata _identificativoVotazione
     ) external onlyIdentityManager {
+        accredita(informazioni, _chiave_x, _chiave_y, _identificativoVotazione);
+    }
+
+    /**
+        Accreditamento con chiave pubblica compressa: ascissa con la parità dell'ordinata nel bit 255.
+        L'ordinata viene ricavata una sola volta e salvata per la verifica delle firme.
+     */
+    function accreditaVotanteCompresso(
+        string calldata informazioni,
+        uint256 _chiave_compressa,
+        string calldata _identificativoVotazione
+    ) external onlyIdentityManager {
+        (uint256 chiaveX, uint256 chiaveY) = decomprimiChiave(_chiave_compressa);
+        accredita(informazioni, chiaveX, chiaveY, _identificativoVotazione);
+    }
+
+    /**
+        Ricava la chiave pubblica (x, y) dalla sua forma compressa
+     */
+    function decomprimiChiave(uint256 _chiave_compressa) public view returns (uint256, uint256) {
+        uint256 chiaveX = _chiave_compressa & ((1 << 255) - 1);
+        require(chiaveX < Curve.P(), "Chiave compressa non valida");
+        (uint256 beta, uint256 chiaveY) = Curve.FindYforX(chiaveX);
+        require(beta == mulmod(chiaveY, chiaveY, Curve.P()), "Chiave compressa non valida");
+        if ((chiaveY & 1) != (_chiave_compressa >> 255)) {
+            chiaveY = Curve.P() - chiaveY;
+        }
+        return (chiaveX, chiaveY);
+    }
+
+    function accredita(
+        string memory informazioni,
+        uint256 _chiave_x,
+        uint256 _chiave_y,
+        string memory _identificativoVotazione
+    ) internal {
         Votazione storage votazione = votazioni[_identificativoVotazione];
         // Verifica che la votazione sia in fase di registrazione
         require(votazione.stato == StatoVotazione.Registrazione, "Registrazione votanti chiusa");
-        // Verifica che il votante non si sia già registrato per la votazione specificata
-        require(!votazione.votanteAccreditato[_chiave_x], "Votante già accreditato");
-        // Se il votante si accredita per la prima volta ne salva le informazioni
-        if (votanti[_chiave_x].chiaveX != _chiave_x) {
-            votanti[_chiave_x] = Votante(informazioni, _chiave_x, _chiave_y);
-        }
         // Calcola l'hash cumulativo delle chiavi pubbliche
         if (votazione.votanti.length == 0) {
             votazione.pkHashAccumulator = keccak256(abi.encodePacked(_chiave_x));
         } else {
             votazione.pkHashAccumulator = keccak256(abi.encodePacked(votazione.pkHashAccumulator, _chiave_x));
         }
+        // Con gli shard, calcola anche l'hash cumulativo dello shard corrente
+        if (votazione.dimensioneShard > 0) {
+            if (votazione.votanti.length % votazione.dimensioneShard == 0) {
+                votazione.accumulatoriShard.push(keccak256(abi.encodePacked(_chiave_x)));
+            } else {
+                uint256 ultimo = votazione.accumulatoriShard.length - 1;
+                votazione.accumulatoriShard[ultimo] = keccak256(abi.encodePacked(votazione.accumulatoriShard[ultimo], _chiave_x));
+            }
+        }
+        aggiungiVotante(votazione, informazioni, _chiave_x, _chiave_y, _identificativoVotazione);
+    }
+
+    /**
+        Accreditamento di un gruppo di votanti in una sola transazione. Gli hash cumulativi
+        (della votazione e degli shard) sono calcolati in memoria e scritti una volta per gruppo;
+        il risultato è identico a quello di accreditamenti singoli nello stesso ordine.
+     */
+    function accreditaVotanti(
+        string[] memory informazioni,
+        uint256[] memory _chiavi_x,
+        uint256[] memory _chiavi_y,
+        string memory _identificativoVotazione
+    ) public onlyIdentityManager {
+        require(_chiavi_x.length > 0, "Nessun votante da accreditare");
+        require(informazioni.length == _chiavi_x.length && _chiavi_y.length == _chiavi_x.length, "Dati dei votanti incompleti");
+        Votazione storage votazione = votazioni[_identificativoVotazione];
+        // Verifica che la votazione sia in fase di registrazione
+        require(votazione.stato == StatoVotazione.Registrazione, "Registrazione votanti chiusa");
+        // Gli hash cumulativi dipendono dal numero di votanti già accreditati: vanno calcolati prima di aggiungerli
+        if (votazione.votanti.length == 0) {
+            votazione.pkHashAccumulator = accumulaChiavi(keccak256(abi.encodePacked(_chiavi_x[0])), _chiavi_x, 1, _chiavi_x.length);
+        } else {
+            votazione.pkHashAccumulator = accumulaChiavi(votazione.pkHashAccumulator, _chiavi_x, 0, _chiavi_x.length);
+        }
+        if (votazione.dimensioneShard > 0) {
+            accumulaShard(votazione, _chiavi_x);
+        }
+        for (uint256 i = 0; i < _chiavi_x.length; i++) {
+            aggiungiVotante(votazione, informazioni[i], _chiavi_x[i], _chiavi_y[i], _identificativoVotazione);
+        }
+    }
+
+    /**
+        Prosegue un hash cumulativo con le chiavi [da, a)
+     */
+    function accumulaChiavi(bytes32 accumulatore, uint256[] memory chiavi, uint256 da, uint256 a) internal pure returns (bytes32) {
+        for (uint256 i = da; i < a; i++) {
+            accumulatore = keccak256(abi.encodePacked(accumulatore, chiavi[i]));
+        }
+        return accumulatore;
+    }
+
+    /**
+        Aggiorna gli hash cumulativi degli shard toccati da un gruppo di chiavi, con una scrittura per shard
+     */
+    function accumulaShard(Votazione storage votazione, uint256[] memory chiavi) internal {
+        uint256 dimensione = votazione.dimensioneShard;
+        uint256 posizione = votazione.votanti.length;
+        uint256 i = 0;
+        while (i < chiavi.length) {
+            // Le chiavi da i a fine cadono nello stesso shard
+            uint256 fine = i + dimensione - (posizione + i) % dimensione;
+            if (fine > chiavi.length) {
+                fine = chiavi.length;
+            }
+            if ((posizione + i) % dimensione == 0) {
+                votazione.accumulatoriShard.push(accumulaChiavi(keccak256(abi.encodePacked(chiavi[i])), chiavi, i + 1, fine));
+            } else {
+                uint256 ultimo = votazione.accumulatoriShard.length - 1;
+                votazione.accumulatoriShard[ultimo] = accumulaChiavi(votazione.accumulatoriShard[ultimo], chiavi, i, fine);
+            }
+            i = fine;
+        }
+    }
+
+    function aggiungiVotante(
+        Votazione storage votazione,
+        string memory informazioni,
+        uint256 _chiave_x,
+        uint256 _chiave_y,
+        string memory _identificativoVotazione
+    ) internal {
+        // Verifica che il votante non si sia già registrato per la votazione specificata
+        require(!votazione.votanteAccreditato[_chiave_x], "Votante già accreditato");
+        // Se il votante si accredita per la prima volta ne salva le informazioni
+        if (votanti[_chiave_x].chiaveX != _chiave_x) {
+            votanti[_chiave_x] = Votante(informazioni, _chiave_x, _chiave_y);
+        }
         // Aggiunge il votante alla votazione specificata
         votazione.votanti.push(_chiave_x);
+        votazione.anello.push(_chiave_x);
+        votazione.anello.push(_chiave_y);
         // Segna il votante come accreditato
         votazione.votanteAccreditato[_chiave_x] = true;
         emit VotanteAccreditato(_identificativoVotazione, _chiave_x);
@@ -131,6 +281,45 @@ contract Chirotonia {
         return votazioni[_identificativoVotazione].votanti;
     }
     
+    /**
+        Recupera le chiavi pubbliche dei votanti come coppie (x, y) consecutive, nell'ordine dell'anello
+     */
+    function ottieniAnello(string calldata _identificativoVotazione) external view returns (uint256[] memory) {
+        return votazioni[_identificativoVotazione].anello;
+    }
+
+    /**
+        Numero di shard e loro dimensione (0 se la votazione non è suddivisa)
+     */
+    function ottieniShard(string calldata _identificativoVotazione) external view returns (uint256, uint256) {
+        Votazione storage votazione = votazioni[_identificativoVotazione];
+        return (votazione.accumulatoriShard.length, votazione.dimensioneShard);
+    }
+
+    /**
+        Posizioni [inizio, fine) dei votanti dello shard e suo hash cumulativo
+     */
+    function ottieniLimitiShard(
+        string calldata _identificativoVotazione,
+        uint256 _shard
+    ) external view returns (uint256, uint256, bytes32) {
+        Votazione storage votazione = votazioni[_identificativoVotazione];
+        (uint256 inizio, uint256 fine) = limitiShard(votazione, _shard);
+        return (inizio, fine, votazione.accumulatoriShard[_shard]);
+    }
+
+    /**
+        L'ultimo shard comprende tutti i votanti rimasti, anche se più di dimensioneShard
+     */
+    function limitiShard(Votazione storage votazione, uint256 _shard) internal view returns (uint256 inizio, uint256 fine) {
+        inizio = _shard * votazione.dimensioneShard;
+        if (_shard == votazione.accumulatoriShard.length - 1) {
+            fine = votazione.votanti.length;
+        } else {
+            fine = inizio + votazione.dimensioneShard;
+        }
+    }
+
     /**
         Avvia una votazione ponendola in stato di Voto
      */
@@ -140,6 +329,28 @@ contract Chirotonia {
         require(votazione.stato == StatoVotazione.Registrazione, "Votazione già avviata");
         // Verifica che la votazione abbia almento un votante
         require(votazione.votanti.length > 0, "Nessun votante accreditato per la votazione selezionata");
+        // Un ultimo shard con meno di metà (per eccesso) dei votanti di uno shard pieno, o con un solo votante,
+        // offrirebbe poco anonimato: viene unito al precedente proseguendone l'hash cumulativo
+        uint256 numeroShard = votazione.accumulatoriShard.length;
+        if (numeroShard > 1) {
+            uint256 resto = votazione.votanti.length % votazione.dimensioneShard;
+            if (resto > 0 && (resto < 2 || resto < (votazione.dimensioneShard + 1) / 2)) {
+                bytes32 accumulatore = votazione.accumulatoriShard[numeroShard - 2];
+                for (uint256 i = votazione.votanti.length - resto; i < votazione.votanti.length; i++) {
+                    accumulatore = keccak256(abi.encodePacked(accumulatore, votazione.votanti[i]));
+                }
+                votazione.accumulatoriShard[numeroShard - 2] = accumulatore;
+                votazione.accumulatoriShard.pop();
+            }
+        }
+        // Da qui gli anelli non cambiano piu': il punto L dell'anello viene calcolato una volta sola.
+        // Quelli degli shard sono calcolati al primo voto di ciascuno (puntoShard): con migliaia di shard
+        // calcolarli tutti qui supererebbe il limite di gas del blocco
+        if (votazione.dimensioneShard == 0) {
+            votazione.puntoL = Curve.HashToPoint(uint256(votazione.pkHashAccumulator));
+        } else {
+            votazione.puntiShard.length = votazione.accumulatoriShard.length;
+        }
         // Effettua il cambio di stato
         votazione.stato = StatoVotazione.Voto;
         emit VotazioneAvviata(_identificativoVotazione);
@@ -153,24 +364,145 @@ contract Chirotonia {
         uint256[] calldata tees,
         uint256 seed,
         uint256 voteHash,
-        string calldata voto,
+        bytes calldata voto,
         string calldata _identificativoVotazione
     ) external {
         Votazione storage votazione = votazioni[_identificativoVotazione];
         // La votazione deve essere in stato di Voto
         require(votazione.stato == StatoVotazione.Voto, "Il voto non è aperto");
+        // Con gli shard la firma sull'anello completo darebbe al votante un secondo tag
+        require(votazione.dimensioneShard == 0, "Votazione suddivisa in shard");
         // La firma ad anello, per essere valida, deve essere lunga quanto i votanti
         require(tees.length == votazione.votanti.length, "L'elenco dei firmatari non corrisponde");
         // Verifica che il voto non sia stato già espresso
         require(!votazione.votiAccettati[tag[0]], "Voto già espresso");
+        require(schedaFirmata(voto, voteHash), "La scheda non corrisponde al messaggio firmato");
         // Verifica la correttezza della firma ad anello
         require(verifyRingSignature(voteHash, tag, tees, seed, _identificativoVotazione), "Firma non valida");
-        // Aggiunge il voto a quelli accettati
-        votazione.voti.push(voto);
-        // Segna il votante come già votato
-        votazione.votiAccettati[tag[0]] = true;
+        registraVoto(votazione, tag[0], voto, _identificativoVotazione);
     }
     
+    /**
+        Funzione di voto per le votazioni suddivise in shard: la firma è sull'anello del solo shard.
+        Ogni votante appartiene a un solo shard, per cui il suo tag è unico nella votazione
+        e i tag di tutti gli shard sono controllati insieme in votiAccettati.
+     */
+    function votaShard(
+        uint256[2] calldata tag,
+        uint256[] calldata tees,
+        uint256 seed,
+        uint256 voteHash,
+        bytes calldata voto,
+        uint256 shard,
+        string calldata _identificativoVotazione
+    ) external {
+        Votazione storage votazione = votazioni[_identificativoVotazione];
+        // La votazione deve essere in stato di Voto
+        require(votazione.stato == StatoVotazione.Voto, "Il voto non è aperto");
+        require(shard < votazione.accumulatoriShard.length, "Shard inesistente");
+        // Verifica che il voto non sia stato già espresso
+        require(!votazione.votiAccettati[tag[0]], "Voto già espresso");
+        require(schedaFirmata(voto, voteHash), "La scheda non corrisponde al messaggio firmato");
+        // Verifica la correttezza della firma ad anello, compresa la sua lunghezza
+        require(verificaAnelloShard(voteHash, tag, tees, seed, shard, votazione, puntoShard(votazione, shard)), "Firma non valida");
+        registraVoto(votazione, tag[0], voto, _identificativoVotazione);
+    }
+
+    /**
+        Voto multiplo, per i relayer: ogni scheda è verificata separatamente e quelle non valide
+        o già espresse (anche all'interno dello stesso gruppo) vengono scartate con l'evento
+        VotoRifiutato, senza annullare le altre. Per le votazioni senza shard il campo shard è ignorato.
+     */
+    function votaMultiplo(
+        uint256[2][] memory tags,
+        uint256[][] memory tees,
+        uint256[] memory seeds,
+        uint256[] memory voteHashes,
+        bytes[] memory voti,
+        uint256[] memory shards,
+        string memory _identificativoVotazione
+    ) public {
+        Votazione storage votazione = votazioni[_identificativoVotazione];
+        // La votazione deve essere in stato di Voto
+        require(votazione.stato == StatoVotazione.Voto, "Il voto non è aperto");
+        require(tees.length == tags.length && seeds.length == tags.length && voteHashes.length == tags.length &&
+            voti.length == tags.length && shards.length == tags.length, "Dati delle schede incompleti");
+        for (uint256 i = 0; i < tags.length; i++) {
+            if (schedaFirmata(voti[i], voteHashes[i]) &&
+                votoValido(votazione, tags[i], tees[i], seeds[i], voteHashes[i], shards[i], _identificativoVotazione)) {
+                registraVoto(votazione, tags[i][0], voti[i], _identificativoVotazione);
+            } else {
+                emit VotoRifiutato(_identificativoVotazione, tags[i][0]);
+            }
+        }
+    }
+
+    /**
+        Aggiunge il voto a quelli accettati e segna il tag del votante come già usato.
+        L'evento VotoAccettato permette di scrutinare i voti leggendo i log a blocchi, anche durante la votazione.
+     */
+    function registraVoto(
+        Votazione storage votazione,
+        uint256 tagX,
+        bytes memory voto,
+        string memory _identificativoVotazione
+    ) internal {
+        votazione.voti.push(voto);
+        votazione.votiAccettati[tagX] = true;
+        emit VotoAccettato(_identificativoVotazione, votazione.voti.length - 1, voto);
+    }
+
+    /**
+        Lega la scheda salvata al messaggio firmato, perche' nessuno (ad esempio un relayer) possa sostituirla.
+        Una scheda in chiaro e' il messaggio stesso (Voter.pack_vote_in_random32, 32 byte); una scheda
+        cifrata (Voter.pack_encrypted_vote, sempre piu' lunga di 32 byte) ha come messaggio il suo keccak256.
+     */
+    function schedaFirmata(bytes memory voto, uint256 voteHash) internal pure returns (bool) {
+        if (voto.length == 32) {
+            uint256 messaggio;
+            assembly {
+                messaggio := mload(add(voto, 0x20))
+            }
+            return messaggio == voteHash;
+        }
+        return uint256(keccak256(voto)) == voteHash;
+    }
+
+    function votoValido(
+        Votazione storage votazione,
+        uint256[2] memory tag,
+        uint256[] memory tees,
+        uint256 seed,
+        uint256 voteHash,
+        uint256 shard,
+        string memory _identificativoVotazione
+    ) internal returns (bool) {
+        if (votazione.votiAccettati[tag[0]]) {
+            return false;
+        }
+        if (votazione.dimensioneShard == 0) {
+            return verifyRingSignature(voteHash, tag, tees, seed, _identificativoVotazione);
+        }
+        if (shard >= votazione.puntiShard.length) {
+            return false;
+        }
+        return verificaAnelloShard(voteHash, tag, tees, seed, shard, votazione, puntoShard(votazione, shard));
+    }
+
+    /**
+        Punto L dello shard, calcolato e salvato al primo voto dello shard
+     */
+    function puntoShard(Votazione storage votazione, uint256 shard) internal returns (Curve.G1Point memory) {
+        Curve.G1Point storage L = votazione.puntiShard[shard];
+        if (L.X == 0 && L.Y == 0) {
+            Curve.G1Point memory punto = Curve.HashToPoint(uint256(votazione.accumulatoriShard[shard]));
+            L.X = punto.X;
+            L.Y = punto.Y;
+            return punto;
+        }
+        return L;
+    }
+
     function verificaTag(
         string calldata _identificativoVotazione,
         uint256 _xTag
@@ -190,7 +522,7 @@ contract Chirotonia {
     /**
         Recupera l'i-esimo voto per una data votazione
      */
-    function getVoto(string calldata _identificativoVotazione, uint256 index) external view returns (string memory) {
+    function getVoto(string calldata _identificativoVotazione, uint256 index) external view returns (bytes memory) {
         return votazioni[_identificativoVotazione].voti[index];
     }
 
@@ -226,23 +558,99 @@ contract Chirotonia {
 	    string memory _identificativoVotazione
 	) public view returns (bool) {
 	    Votazione storage votazione = votazioni[_identificativoVotazione];
-		Curve.G1Point memory L = Curve.HashToPoint(uint256(votazione.pkHashAccumulator));
-		Curve.G1Point memory M = Curve.HashToPoint(voteData);
+		// Il punto L dell'anello esiste solo dall'avvio del voto, e solo per le votazioni senza shard
+		if (uint256(votazione.stato) < uint256(StatoVotazione.Voto) || votazione.dimensioneShard > 0 ||
+			tees.length != votazione.votanti.length) {
+			return false;
+		}
+		return verificaAnello(slotAnello(votazione, 0), votazione.puntoL, voteData, tag, tees, seed);
+	}
+
+    /**
+        Verifica di una firma sull'anello di uno shard. Se lo shard non ha ancora ricevuto voti
+        il suo punto L viene calcolato senza salvarlo
+     */
+	function verificaFirmaShard(
+	    uint256 voteData,
+	    uint256[2] memory tag,
+	    uint256[] memory tees,
+	    uint256 seed,
+	    uint256 shard,
+	    string memory _identificativoVotazione
+	) public view returns (bool) {
+	    Votazione storage votazione = votazioni[_identificativoVotazione];
+		if (shard >= votazione.puntiShard.length) {
+			return false;
+		}
+		Curve.G1Point memory L = votazione.puntiShard[shard];
+		if (L.X == 0 && L.Y == 0) {
+			L = Curve.HashToPoint(uint256(votazione.accumulatoriShard[shard]));
+		}
+		return verificaAnelloShard(voteData, tag, tees, seed, shard, votazione, L);
+	}
+
+    /**
+        Gli argomenti letti da calldata vengono per primi: da votaShard sono i piu' profondi nello stack
+     */
+	function verificaAnelloShard(
+	    uint256 voteData,
+	    uint256[2] memory tag,
+	    uint256[] memory tees,
+	    uint256 seed,
+	    uint256 shard,
+	    Votazione storage votazione,
+	    Curve.G1Point memory L
+	) internal view returns (bool) {
+		(uint256 inizio, uint256 fine) = limitiShard(votazione, shard);
+		if (tees.length != fine - inizio) {
+			return false;
+		}
+		return verificaAnello(slotAnello(votazione, inizio), L, voteData, tag, tees, seed);
+	}
+
+    /**
+        Slot di storage della chiave del votante in posizione `inizio` dell'anello
+     */
+	function slotAnello(Votazione storage votazione, uint256 inizio) internal view returns (uint256 slot) {
+		uint256[] storage anello = votazione.anello;
+		assembly {
+			mstore(0, anello_slot)
+			slot := add(keccak256(0, 0x20), mul(inizio, 2))
+		}
+	}
+
+    /**
+        Verifica la firma sulle tees.length chiavi dell'anello a partire dallo slot dato, con il punto L
+        del loro anello. I limiti sono controllati dal chiamante, per cui le chiavi sono lette direttamente
+        dagli slot, senza il controllo della lunghezza dell'array ad ogni accesso.
+     */
+	function verificaAnello(
+	    uint256 slot,
+	    Curve.G1Point memory L,
+	    uint256 voteData,
+	    uint256[2] memory tag,
+	    uint256[] memory tees,
+	    uint256 seed
+	) internal view returns (bool) {
 		Curve.G1Point memory T = Curve.G1Point(tag[0], tag[1]);
-		uint256 h = uint256(keccak256(abi.encodePacked(M.X, M.Y, T.X, T.Y)));
+		uint256 h;
+		{
+			Curve.G1Point memory M = Curve.HashToPoint(voteData);
+			h = uint256(keccak256(abi.encodePacked(M.X, M.Y, T.X, T.Y)));
+		}
 
+		Curve.G1Point memory Y = Curve.G1Point(0, 0);
 		uint256 c = seed;
-		for( uint256 i = 0; i < votazione.votanti.length; i++ )
+		for( uint256 i = 0; i < tees.length; i++ )
 		{
-			c = uint256(keccak256(abi.encodePacked(
-					h,
-					RingLink(
-						Curve.G1Point(votazione.votanti[i], votanti[votazione.votanti[i]].chiaveY),
-						L,
-						T,
-						tees[i],
-						c
-					))));
+			assembly {
+				mstore(Y, sload(slot))
+				mstore(add(Y, 0x20), sload(add(slot, 1)))
+				slot := add(slot, 2)
+			}
+			// Il collegamento e' calcolato fuori da encodePacked, che terrebbe h nello stack durante la chiamata
+			c = RingLink(Y, L, T, tees[i], c);
+			c = uint256(keccak256(abi.encodePacked(h, c)));
 		}
 		return c == seed;
 	}
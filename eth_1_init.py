@@ -7,7 +7,8 @@ import sys
 from web3 import Web3, HTTPProvider
 from web3.middleware import geth_poa_middleware # only for PoA and dev networks
 
-from chirotonia.ethereum.contract import Contract
+from chirotonia import elgamal
+from chirotonia.ethereum.contract import Contract, MAX_CODE_SIZE
 
 logger = logging.getLogger('ETH_1_INIT')
 logging.basicConfig(level=logging.INFO)
@@ -65,16 +66,33 @@ if not args.no_sign:
 
 chirotonia = Contract(w3)
 logger.info("Deploying Chirotonia contract")
+# Il gas della creazione e' stimato dal nodo: il contratto e' cresciuto oltre i 3M di gas di un tempo
 tx_receipt = chirotonia.deploy(chirotonia_conf["identityManager"])
 chirotonia_conf["mainContract"] = tx_receipt.contractAddress
+chirotonia_conf["mainContractBlock"] = tx_receipt.blockNumber
 logger.info("Deployed contract at %s", tx_receipt.contractAddress)
-logger.info("Gas spent %d", tx_receipt.gasUsed)
+logger.info("Gas spent %d, runtime bytecode %d bytes (limit %d)", tx_receipt.gasUsed, chirotonia.code_size(), MAX_CODE_SIZE)
+
+if any(vote.get("encrypted") for vote in chirotonia_conf.get("votes", [])):
+    # Nel proof of concept il manager fa anche da privacy manager: genera la coppia di chiavi
+    # ElGamal delle schede e ne pubblica la parte pubblica. La segreta serve solo allo scrutinio:
+    # e' scritta in un file a parte, leggibile dal solo proprietario, e non nella configurazione
+    secret_key, public_key = elgamal.generate_keys()
+    chirotonia.set_privacy_manager(chirotonia_conf['manager'], sync=True)
+    chirotonia.set_encryption_key(elgamal.encode_key(public_key), sync=True)
+    chirotonia_conf["encryptionKey"] = elgamal.encode_key(public_key)
+    secret_key_path = "./runs/%s_elgamal.key" % session_name
+    with os.fdopen(os.open(secret_key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as key_file:
+        key_file.write("%x\n" % secret_key)
+    logger.info("Ballot encryption key published, secret key written at %s", secret_key_path)
 
 if "votes" not in chirotonia_conf:
     logger.warning("No votations have been found. Add manually one to register voters")
     exit(0)
 
 logger.info("Creating votes")
+# Le scelte di tutte le votazioni vengono attese insieme alla fine
+tracker = chirotonia.tracker()
 for vote in chirotonia_conf["votes"]:
     try:
         if "name" not in vote:
@@ -86,16 +104,16 @@ for vote in chirotonia_conf["votes"]:
         tx_rcpt = chirotonia.create_vote(vote["name"], vote["subject"], sync=True)
         logger.info("Gas spent %d", tx_rcpt.gasUsed)
         logger.info("Created vote %s, adding choices...", vote["name"])
-        txs = []
         for i, choice in enumerate(vote["choices"]):
-            txs.append(chirotonia.set_choice(vote["name"], i+1, choice))
-        for tx in txs:
-            tx_rcpt = chirotonia.wait(tx)
-            logger.info("Gas spent %d", tx_rcpt.gasUsed)
-        logger.info("Choices added")
+            tracker.add(chirotonia.set_choice(vote["name"], i+1, choice), "%s/%s" % (vote["name"], choice))
     except Exception as error:
         logger.error(error)
 
+tracker.wait()
+logger.info("Choices added, gas spent %d", tracker.gas_used)
+for label, tx in tracker.failures:
+    logger.error("Transaction %s failed setting choice %s", tx, label)
+
 with open("./runs/%s.json" % session_name, "w") as session_file:
     json.dump(chirotonia_conf, session_file, indent=4)
     logger.info("Session configuration written at ./runs/%s.json", session_name)  
\ No newline at end of file
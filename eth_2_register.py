@@ -5,7 +5,10 @@ import logging
 from web3 import Web3, HTTPProvider
 from web3.middleware import geth_poa_middleware # only for PoA and dev networks
 
+from chirotonia.altbn128 import compress_point, compress_word
 from chirotonia.ethereum.contract import Contract
+from chirotonia.ethereum.pipeline import TransactionPipeline
+from chirotonia.uaosring import shard_bounds
 from chirotonia.voter import Voter
 
 logger = logging.getLogger('ETH_2_REGISTER')
@@ -15,6 +18,9 @@ parser = argparse.ArgumentParser(description='Simulate registration phase for a
 parser.add_argument("session", type=str, help="Session name to use")
 parser.add_argument("-e", "--endpoint", type=str, help="Custom rpc endpoint at port 8545", default='localhost')
 parser.add_argument("--no_sign", action="store_true")
+parser.add_argument("-p", "--pipeline", type=int, help="Submit transactions through a pipeline with at most N of them in flight (default: 0, disabled)", default=0)
+parser.add_argument("-b", "--batch", type=int, help="Register voters in batches of N per transaction (default: 1, one transaction per voter)", default=1)
+parser.add_argument("--compressed", action="store_true", help="Send public keys compressed in one word: less calldata, but the contract recovers y with a modexp (more gas)")
 args = parser.parse_args()
 
 session_name = args.session
@@ -49,7 +55,11 @@ if not args.no_sign:
     w3.geth.personal.unlockAccount(w3.eth.defaultAccount, session_conf['identityManagerPassword'])
     logger.info('Successfully unlocked identity manager account.')
 
-chirotonia = Contract(w3, session_conf['mainContract'])
+pipeline = None
+if args.pipeline > 0:
+    # Con la chiave privata in configuration (field: identityManagerPrivateKey) le transazioni sono firmate in locale
+    pipeline = TransactionPipeline(w3, private_key=session_conf.get('identityManagerPrivateKey'), window=args.pipeline)
+chirotonia = Contract(w3, session_conf['mainContract'], pipeline)
 
 voters = []
 for i, vote in enumerate(session_conf['votes']):
@@ -59,31 +69,47 @@ for i, vote in enumerate(session_conf['votes']):
     if len(voters) < vote['voters']:
         for i in range(vote['voters'] - len(voters)):
             voters.append(Voter(description='Votante%d' % len(voters)))
-    registration_txs = []
+    tracker = chirotonia.tracker()
+    if vote.get('shardSize'):
+        # Gli shard seguono l'ordine di accreditamento sulla catena, che con la pipeline puo' differire
+        # da quello di questo ciclo: chi firma legge l'anello dal contratto (Contract.get_voters)
+        chirotonia.set_shard_size(vote['name'], vote['shardSize'], sync=True)
+        vote['shards'] = shard_bounds(vote['voters'], vote['shardSize'])
+        logger.info("Vote %s split in %d shards of %d voters", vote['name'], len(vote['shards']), vote['shardSize'])
     logger.info("Registering voters for vote %s", vote['name'])
-    for i in range(vote['voters']):
-        logger.info("Registering voter %s for vote %s", voters[i].description, vote['name'])
-        tx_hash = chirotonia.register_voter(voters[i].description, voters[i].public_key[0].n, voters[i].public_key[1].n, vote['name'], sync=False)
-        registration_txs.append(tx_hash)
+    if args.batch > 1:
+        # Le chiavi viaggiano non compresse: decomprimerle costerebbe piu' della calldata risparmiata
+        for start in range(0, vote['voters'], args.batch):
+            group = voters[start:min(start + args.batch, vote['voters'])]
+            logger.info("Registering voters %d-%d for vote %s", start, start + len(group) - 1, vote['name'])
+            tx_hash = chirotonia.register_voters_batch([v.description for v in group], [v.public_key for v in group], vote['name'], sync=False)
+            tracker.add(tx_hash, "voters %d-%d" % (start, start + len(group) - 1))
+    else:
+        for i in range(vote['voters']):
+            logger.info("Registering voter %s for vote %s", voters[i].description, vote['name'])
+            if args.compressed:
+                tx_hash = chirotonia.register_voter_compressed(voters[i].description, compress_word(voters[i].public_key), vote['name'], sync=False)
+            else:
+                tx_hash = chirotonia.register_voter(voters[i].description, voters[i].public_key[0].n, voters[i].public_key[1].n, vote['name'], sync=False)
+            tracker.add(tx_hash, voters[i].description)
     logger.info("Waiting registration txs for vote %s", vote['name'])
-    gasSpent = 0
-    for tx in registration_txs:
-        tx_rcpt = chirotonia.wait(tx)
-        gasSpent += tx_rcpt.gasUsed
-    logger.info("Gas spent %d", gasSpent)
+    tracker.wait()
+    logger.info("Gas spent %d", tracker.gas_used)
+    for label, tx in tracker.failures:
+        logger.error("Registration of %s failed in transaction %s", label, tx)
     logger.info("Registrations for vote %s completed", vote['name'])
     
 
 session_conf['voters'] = []
 for voter in voters:
-    voter.public_key = {
-        "x": voter.public_key[0].n,
-        "y": voter.public_key[1].n
-    }
+    voter.public_key = compress_point(voter.public_key).hex()
     session_conf['voters'].append(voter.__dict__)
 
 
 with open("./runs/%s.json" % session_name, "w") as session_file:
     json.dump(session_conf, session_file, indent=4)
 
-logger.info("Configuration updated at ./runs/%s.json", session_name)
\ No newline at end of file
+logger.info("Configuration updated at ./runs/%s.json", session_name)
+
+if pipeline is not None:
+    pipeline.close()
\ No newline at end of file
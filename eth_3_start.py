@@ -50,23 +50,23 @@ if not args.no_sign:
 chirotonia = Contract(w3, session_conf['mainContract'])
 
 if args.all:
-    txs = {}
+    tracker = chirotonia.tracker()
     for vote in session_conf['votes']:
         logger.info("Starting vote %s", vote['name'])
         try:
-            txs[vote["name"]] = chirotonia.start_vote(vote["name"])
+            tracker.add(chirotonia.start_vote(vote["name"]), vote)
         except:
             logger.error('Error starting vote %s', vote['name'])
-    for name, tx in txs.items():
-        try:
-            tx_rcpt = chirotonia.wait(tx)
-            logger.info("Gas spent %d", tx_rcpt.gasUsed)
-            logger.info("Vote %s successfully started", name)
-            for vote in session_conf['votes']:
-                if vote['name'] == name:
-                    vote['status'] = 'started'
-        except:
-            logger.error('Error on transaction for vote %s', vote['name'])
+    try:
+        for vote, tx_rcpt in tracker.wait():
+            if tx_rcpt.status:
+                logger.info("Vote %s successfully started", vote['name'])
+                vote['status'] = 'started'
+            else:
+                logger.error('Transaction for vote %s failed', vote['name'])
+        logger.info("Gas spent %d", tracker.gas_used)
+    except Exception as error:
+        logger.error('Error waiting transactions: %s', error)
 elif args.vote:
     found = False
     for vote in session_conf['votes']:
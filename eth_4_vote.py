@@ -1,11 +1,19 @@
 import argparse
 import json
 import logging
+from concurrent.futures import as_completed
 
+import requests
+
+from py_ecc.bn128.bn128_field_elements import FQ
 from web3 import Web3, HTTPProvider
 from web3.middleware import geth_poa_middleware # only for PoA and dev networks
 
+from chirotonia import profiling, workers
+from chirotonia.compact_ring import CompactRing
 from chirotonia.ethereum.contract import Contract
+from chirotonia.ethereum.pipeline import TransactionPipeline
+from chirotonia.uaosring import RingContext
 from chirotonia.voter import Voter
 
 logger = logging.getLogger('ETH_4_VOTE')
@@ -15,6 +23,10 @@ parser = argparse.ArgumentParser(description='Simulate registration phase for a
 parser.add_argument("session", type=str, help="Session name to use")
 parser.add_argument("-e", "--endpoint", type=str, help="Custom rpc endpoint at port 8545", default='localhost')
 parser.add_argument("--no_sign", action="store_true")
+parser.add_argument("-p", "--pipeline", type=int, help="Submit transactions through a pipeline with at most N of them in flight (default: 0, disabled)", default=0)
+parser.add_argument("-r", "--relayer", type=str, help="Send ballots to the relayer at this URL (e.g. http://localhost:8600) instead of the blockchain")
+parser.add_argument("--profile", action="store_true", help="Log operation counters and timings of the signatures made by this process")
+parser.add_argument("-w", "--workers", type=int, help="Sign ballots in parallel with N processes (default: 1, no pool)", default=1)
 vote_flag_group = parser.add_mutually_exclusive_group(required=True)
 vote_flag_group.add_argument("-v", "--vote", type=str, help="Name of vote to start")
 vote_flag_group.add_argument("-a", "--all", const=True, help="Start all votes specified in configuration", nargs='?')
@@ -48,8 +60,32 @@ if not args.no_sign:
     w3.geth.personal.unlockAccount(w3.eth.defaultAccount, session_conf['votersAddressPassword'])
     logger.info('Voters account successfully unlocked')
 
+# Letture dal contratto; le schede sono inviate con il Contract della votazione (vote_contract)
 chirotonia = Contract(w3, session_conf['mainContract'])
 
+def open_pipeline():
+    """
+    Pipeline e contratto per le schede di una votazione. La pipeline e' creata dopo il pool di firma
+    e chiusa a fine votazione: i processi del pool non nascono mai mentre i suoi thread sono attivi.
+    """
+    if args.pipeline <= 0:
+        return None, chirotonia
+    # Con la chiave privata in configuration (field: votersPrivateKey) le transazioni sono firmate in locale
+    pipeline = TransactionPipeline(w3, private_key=session_conf.get('votersPrivateKey'), window=args.pipeline)
+    return pipeline, Contract(w3, session_conf['mainContract'], pipeline)
+
+def cast(vote_contract, vote_name, signature, ballot=None):
+    """
+    Invia la scheda al contratto o, con --relayer, al relayer (che la inoltra in un voto multiplo).
+    ballot e' la scheda cifrata, se la votazione e' cifrata.
+    """
+    if not args.relayer:
+        return vote_contract.vote(vote_name, signature, ballot)
+    response = requests.post(args.relayer.rstrip('/') + '/ballots', data=signature.to_bytes() + (ballot or b''), timeout=60)
+    if response.status_code != 202:
+        logger.error("Ballot refused by the relayer: %s", response.json()['status'])
+    return None
+
 voters = []
 for voter in session_conf['voters']:
     voters.append(Voter(private_key=voter['private_key'], description=voter['description']))
@@ -60,17 +96,65 @@ for vote in session_conf['votes']:
     if vote['status'] != 'started':
         logger.warning('Skipping vote %s because not in status started (found %s)', vote['name'], vote['status'])
         continue
+    # L'anello e' letto dal contratto: l'ordine di accreditamento sulla catena puo' differire da quello
+    # della configurazione (accreditamenti rispediti dalla pipeline) e va rispettato per firmare
+    chain_keys = chirotonia.get_voters(vote['name'])
+    registered = set(chain_keys)
+    missing = [v.description for v in voters[:vote['voters']] if (v.public_key[0].n, v.public_key[1].n) not in registered]
+    if missing:
+        logger.error("Skipping vote %s: voters not registered on the contract: %s", vote['name'], ', '.join(missing))
+        continue
+    pkeys = [(FQ(x), FQ(y)) for x, y in chain_keys]
     txs = []
-    pkeys = [v.public_key for v in voters[:vote['voters']]]
+    if args.profile:
+        profiling.stats.reset()
+        profiling.enable()
     logger.info('Inserting ballots for vote %s', vote['name'])
-    for i, ballot in enumerate(vote['ballots']):
-        voted_ballot = voters[i].ring_sign(pkeys, Voter.pack_vote_in_random32(bytes([ballot])))
-        txs.append(chirotonia.vote(vote['name'], voted_ballot))
-    gasSpent = 0
+    if vote.get('encrypted'):
+        # Schede cifrate con la chiave pubblicata sul contratto dal privacy manager; si firma l'hash della scheda
+        encryption_key = chirotonia.get_encryption_key()
+        packed = [Voter.pack_encrypted_vote(ballot, len(vote['choices']), encryption_key) for ballot in vote['ballots']]
+    else:
+        packed = [(None, Voter.pack_vote_in_random32(bytes([ballot]))) for ballot in vote['ballots']]
+    if args.workers > 1:
+        # L'anello viene spedito una volta per processo; le firme vengono inviate
+        # alla blockchain man mano che sono pronte, in parallelo alla firma delle successive.
+        # I processi sono avviati prima della pipeline della votazione (vedi workers.start_pool).
+        ring_buffer = bytes(CompactRing.from_points(pkeys).buffer)
+        pool = workers.start_pool(args.workers, ring_buffer, False, vote.get('shardSize'))
+        pipeline, vote_contract = open_pipeline()
+        with pool:
+            futures = {}
+            for i, (ballot, message) in enumerate(packed):
+                public_key = (voters[i].public_key[0].n, voters[i].public_key[1].n)
+                futures[pool.submit(workers.sign_ballot, voters[i].private_key, public_key, message)] = ballot
+            for future in as_completed(futures):
+                txs.append(cast(vote_contract, vote['name'], workers.to_signature(pkeys, future.result(), vote.get('shardSize')), futures[future]))
+    elif vote.get('shardSize'):
+        # Ogni voto costa quanto lo shard del votante, non quanto l'intera votazione
+        pipeline, vote_contract = open_pipeline()
+        for i, (ballot, message) in enumerate(packed):
+            voted_ballot = voters[i].ring_sign(pkeys, message, shard_size=vote['shardSize'])
+            txs.append(cast(vote_contract, vote['name'], voted_ballot, ballot))
+    else:
+        pipeline, vote_contract = open_pipeline()
+        ring = RingContext(pkeys)
+        for i, (ballot, message) in enumerate(packed):
+            voted_ballot = voters[i].ring_sign(ring, message)
+            txs.append(cast(vote_contract, vote['name'], voted_ballot, ballot))
+    if args.profile:
+        profiling.disable()
+        logger.info("Signing profile for vote %s:\n%s", vote['name'], profiling.stats)
+    tracker = vote_contract.tracker()
     for tx in txs:
-        tx_rcpt = chirotonia.wait(tx)
-        gasSpent += tx_rcpt.gasUsed
-    logger.info("Gas spent %d", gasSpent)
+        if tx is not None:
+            tracker.add(tx)
+    tracker.wait()
+    if pipeline is not None:
+        pipeline.close()
+    logger.info("Gas spent %d", tracker.gas_used)
+    if tracker.failures:
+        logger.error("%d ballots rejected: %s", len(tracker.failures), ', '.join(tx for _, tx in tracker.failures))
     logger.info('Ballots for vote %s successfully inserted', vote['name'])
     vote['status'] = 'voted'
 
@@ -1,12 +1,15 @@
 import argparse
 import json
 import logging
+import os
+import time
 
 from web3 import Web3, HTTPProvider
 from web3.middleware import geth_poa_middleware # only for PoA and dev networks
 
+from chirotonia import elgamal
 from chirotonia.ethereum.contract import Contract
-from chirotonia.utils import int_to_big_endian
+from chirotonia.tally import Tally, EncryptedTally
 
 logger = logging.getLogger('ETH_6_TALLY')
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +18,11 @@ parser = argparse.ArgumentParser(description='Count ballot submitted to vote usi
 parser.add_argument("session", type=str, help="Session name to use")
 parser.add_argument("-e", "--endpoint", type=str, help="Custom rpc endpoint at port 8545", default='localhost')
 parser.add_argument("--no_sign", action="store_true")
+parser.add_argument("-b", "--blocks", type=int, help="Blocks of logs read between two checkpoints", default=1000)
+parser.add_argument("-f", "--follow", type=float, help="Keep counting new ballots every N seconds (live turnout)")
+parser.add_argument("-w", "--workers", type=int, help="Processes summing encrypted ballots (default: 1)", default=1)
+parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints and count from the deployment block")
+parser.add_argument("-k", "--secret-key", type=str, help="File with the ballot decryption key of encrypted votes (default: ./runs/<session>_elgamal.key)")
 vote_flag_group = parser.add_mutually_exclusive_group(required=True)
 vote_flag_group.add_argument("-v", "--vote", type=str, help="Select single vote")
 vote_flag_group.add_argument("-a", "--all", const=True, help="Count ballots for all votes", nargs='?')
@@ -47,36 +55,60 @@ if not args.no_sign:
 
 chirotonia = Contract(w3, session_conf['mainContract'])
 
-def tally(vote):
-    ballots = chirotonia.get_ballots(vote['name'])
-    results = {}
-    for b in ballots:
-        choice = int_to_big_endian(b)[-1]
-        if choice >= len(vote['choices']):
-            logger.warning('Vote %d skipped because it is not a valid choice', choice)
-            continue
-        if vote['choices'][choice] in results:
-            results[vote['choices'][choice]] += 1
-        else:
-            results[vote['choices'][choice]] = 1
-    print(results)
+def read_secret_key():
+    path = args.secret_key or "./runs/%s_elgamal.key" % session_name
+    if not os.path.isfile(path):
+        logger.error("Encrypted votes need the decryption key: %s not found (option --secret-key)", path)
+        exit(1)
+    with open(path) as key_file:
+        return int(key_file.read().strip(), 16)
+
+def tally_of(vote):
+    """
+    Scrutinio della votazione, ripreso dal suo checkpoint se esiste
+    """
+    checkpoint_path = "./runs/%s_%s_tally.json" % (session_name, vote['name'])
+    if args.restart and os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+    if vote.get('encrypted'):
+        # Somma omomorfica delle schede, scartando quelle le cui prove (ogni scelta e la loro somma
+        # valgono 0 o 1) non tornano con la chiave pubblicata sul contratto; i totali sono decifrati
+        # una volta per scelta, con una tabella del logaritmo discreto dimensionata sugli aventi diritto
+        secret_key = read_secret_key()
+        encryption_key = chirotonia.get_encryption_key()
+        if elgamal.decode_key(encryption_key) != elgamal.public_key_of(secret_key):
+            logger.error("The decryption key does not match the encryption key published on the contract")
+            exit(1)
+        return EncryptedTally(chirotonia, vote['name'], len(vote['choices']), checkpoint_path, session_conf.get('mainContractBlock', 0),
+            secret_key, vote['voters'], args.workers, encryption_key)
+    return Tally(chirotonia, vote['name'], len(vote['choices']), checkpoint_path, session_conf.get('mainContractBlock', 0))
+
+def tally(vote, vote_tally):
+    new_ballots = vote_tally.update(chunk=args.blocks)
+    if vote_tally.checkpoint['invalid']:
+        logger.warning('%d ballots skipped because they are not a valid choice', vote_tally.checkpoint['invalid'])
+    logger.info("Vote %s: %d ballots (%d new) up to block %d", vote['name'], vote_tally.ballots, new_ballots, vote_tally.checkpoint['nextBlock'] - 1)
+    print(json.dumps({"vote": vote['name'], "ballots": vote_tally.ballots, "results": vote_tally.results(vote['choices'])}))
 
 if args.all:
-    for vote in session_conf['votes']:
-        tally(vote)
+    votes = session_conf['votes']
 elif args.vote:
-    found = False
-    for vote in session_conf['votes']:
-        if args.vote == vote['name']:
-            tally(vote)
-            found = True
-    if not found:
+    votes = [vote for vote in session_conf['votes'] if args.vote == vote['name']]
+    if not votes:
         logger.error("Specified vote not found in configuration")
         exit(1)
 else:
     logger.error("No vote has been specified")
     exit(1)
 
+tallies = [(vote, tally_of(vote)) for vote in votes]
+while True:
+    for vote, vote_tally in tallies:
+        tally(vote, vote_tally)
+    if not args.follow:
+        break
+    time.sleep(args.follow)
+
 # with open("./runs/%s.json" % session_name, "w") as session_file:
 #     json.dump(session_conf, session_file, indent=4)
 
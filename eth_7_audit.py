@@ -0,0 +1,125 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from web3 import Web3, HTTPProvider
+from web3.middleware import geth_poa_middleware # only for PoA and dev networks
+
+from chirotonia import workers
+from chirotonia.compact_ring import CompactRing
+from chirotonia.ethereum.contract import Contract
+from chirotonia.tag_index import TagIndex
+
+logger = logging.getLogger('ETH_7_AUDIT')
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser(description='Re-verify off-chain every ballot accepted for a vote')
+parser.add_argument("session", type=str, help="Session name to use")
+parser.add_argument("-e", "--endpoint", type=str, help="Custom rpc endpoint at port 8545", default='localhost')
+parser.add_argument("-w", "--workers", type=int, help="Number of verification processes (default: cpu count)", default=os.cpu_count() or 1)
+parser.add_argument("-b", "--blocks", type=int, help="Blocks fetched and verified between two checkpoints", default=1000)
+parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints and audit from the deployment block")
+vote_flag_group = parser.add_mutually_exclusive_group(required=True)
+vote_flag_group.add_argument("-v", "--vote", type=str, help="Select single vote")
+vote_flag_group.add_argument("-a", "--all", const=True, help="Audit all votes", nargs='?')
+args = parser.parse_args()
+
+session_name = args.session
+
+w3 = Web3(HTTPProvider('http://' + args.endpoint))
+w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+
+with open("./runs/%s.json" % session_name) as session_file:
+    session_conf = json.load(session_file)
+
+if 'mainContract' not in session_conf:
+    logger.error('mainContract address must be set in configuration')
+    exit(1)
+
+chirotonia = Contract(w3, session_conf['mainContract'])
+
+# Indice dei tag condiviso da tutte le votazioni della sessione. I tag sono registrati con
+# l'hash della transazione, quindi rielaborare dei blocchi dopo un'interruzione non produce
+# falsi duplicati.
+tag_index = TagIndex("./runs/%s_tags" % session_name)
+
+def audit(vote):
+    checkpoint_path = "./runs/%s_%s_audit.json" % (session_name, vote['name'])
+    checkpoint = {
+        "vote": vote['name'],
+        "nextBlock": session_conf.get('mainContractBlock', 0),
+        "verified": 0,
+        "failures": [],
+        "duplicates": []
+    }
+    if os.path.isfile(checkpoint_path) and not args.restart:
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        logger.info("Resuming audit of vote %s from block %d", vote['name'], checkpoint['nextBlock'])
+
+    pkeys = chirotonia.get_voters(vote['name'])
+    _, shard_size = chirotonia.get_shards(vote['name'])
+    logger.info("Auditing vote %s with %d voters using %d processes", vote['name'], len(pkeys), args.workers)
+    ring_buffer = bytes(CompactRing.from_points(pkeys).buffer)
+    last_block = chirotonia.block_number()
+    started = time.time()
+    verified = 0
+    # Il contesto fork evita che i processi rieseguano questo script
+    with ProcessPoolExecutor(args.workers, multiprocessing.get_context('fork'), workers.init_ring, (ring_buffer, True, shard_size)) as pool:
+        while checkpoint['nextBlock'] <= last_block:
+            to_block = min(checkpoint['nextBlock'] + args.blocks - 1, last_block)
+            ballots = chirotonia.get_cast_ballots(vote['name'], checkpoint['nextBlock'], to_block)
+            results = pool.map(workers.verify_ballot,
+                [b[2] for b in ballots], [b[3] for b in ballots], [b[4] for b in ballots], [b[5] for b in ballots], [b[6] for b in ballots],
+                chunksize=max(1, len(ballots) // (4 * args.workers)))
+            for (tx_hash, _, _, _, _, _, _), valid in zip(ballots, results):
+                if not valid:
+                    logger.warning("Invalid signature in transaction %s", tx_hash)
+                    checkpoint['failures'].append(tx_hash)
+            collisions = tag_index.ingest([b[2] for b in ballots], vote['name'], [bytes.fromhex(b[0][2:]) for b in ballots])
+            for _, _, previous, reference in collisions:
+                logger.warning("Duplicate tag in transaction 0x%s (first seen in 0x%s)", reference.hex(), previous.hex())
+                checkpoint['duplicates'].append('0x' + reference.hex())
+            verified += len(ballots)
+            checkpoint['verified'] += len(ballots)
+            checkpoint['nextBlock'] = to_block + 1
+            tag_index.flush()
+            with open(checkpoint_path, "w") as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file)
+            elapsed = time.time() - started
+            logger.info("Vote %s: %d ballots verified up to block %d (%.1f ballots/s)",
+                vote['name'], checkpoint['verified'], to_block, verified / elapsed if elapsed else 0)
+
+    report = {
+        "vote": vote['name'],
+        "ballots": checkpoint['verified'],
+        "failures": checkpoint['failures'],
+        "duplicates": checkpoint['duplicates'],
+        "throughput": verified / max(time.time() - started, 1e-9)
+    }
+    print(json.dumps(report, indent=4))
+    return not checkpoint['failures'] and not checkpoint['duplicates']
+
+success = True
+if args.all:
+    for vote in session_conf['votes']:
+        success = audit(vote) and success
+elif args.vote:
+    found = False
+    for vote in session_conf['votes']:
+        if args.vote == vote['name']:
+            success = audit(vote)
+            found = True
+    if not found:
+        logger.error("Specified vote not found in configuration")
+        exit(1)
+else:
+    logger.error("No vote has been specified")
+    exit(1)
+
+tag_index.close()
+exit(0 if success else 2)
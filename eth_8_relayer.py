@@ -0,0 +1,79 @@
+import argparse
+import json
+import logging
+import os
+
+from web3 import Web3, HTTPProvider
+from web3.middleware import geth_poa_middleware # only for PoA and dev networks
+
+from chirotonia.ethereum.contract import Contract
+from chirotonia.ethereum.pipeline import TransactionPipeline
+from chirotonia.relayer import Relayer
+from chirotonia.tag_index import TagIndex
+
+logger = logging.getLogger('ETH_8_RELAYER')
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser(description='Relay ballots of a started vote to the blockchain in batches')
+parser.add_argument("session", type=str, help="Session name to use")
+parser.add_argument("-v", "--vote", type=str, help="Name of vote to relay ballots for", required=True)
+parser.add_argument("-e", "--endpoint", type=str, help="Custom rpc endpoint at port 8545", default='localhost')
+parser.add_argument("--no_sign", action="store_true")
+parser.add_argument("--host", type=str, help="Address the relayer listens on", default='localhost')
+parser.add_argument("--port", type=int, help="Port the relayer listens on", default=8600)
+parser.add_argument("-w", "--workers", type=int, help="Number of verification processes (default: cpu count)", default=os.cpu_count() or 1)
+parser.add_argument("-b", "--batch", type=int, help="Ballots submitted with a single transaction", default=20)
+parser.add_argument("-d", "--max-delay", type=float, help="Seconds a ballot may wait for its batch to fill", default=2.0)
+parser.add_argument("-p", "--pipeline", type=int, help="Submit transactions through a pipeline with at most N of them in flight (default: 0, disabled)", default=0)
+args = parser.parse_args()
+
+session_name = args.session
+
+w3 = Web3(HTTPProvider('http://' + args.endpoint))
+w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+
+with open("./runs/%s.json" % session_name) as session_file:
+    session_conf = json.load(session_file)
+
+if 'mainContract' not in session_conf:
+    logger.error('mainContract address must be set in configuration')
+    exit(1)
+
+if 'votersAddress' not in session_conf:
+    logger.error("Voters address is required to be set in configuration. (field: votersAddress)")
+    exit(1)
+
+if "votersAddressPassword" not in session_conf:
+    logger.error("Voters account password is required in configuration (field: votersAddressPassword)")
+    exit(1)
+
+w3.eth.defaultAccount = session_conf['votersAddress']
+if not args.no_sign:
+    w3.geth.personal.unlockAccount(w3.eth.defaultAccount, session_conf['votersAddressPassword'])
+    logger.info('Voters account successfully unlocked')
+
+# La pipeline non avvia thread finche' non invia: il Relayer crea i suoi processi di verifica prima
+pipeline = None
+if args.pipeline > 0:
+    pipeline = TransactionPipeline(w3, private_key=session_conf.get('votersPrivateKey'), window=args.pipeline)
+chirotonia = Contract(w3, session_conf['mainContract'], pipeline)
+
+pkeys = chirotonia.get_voters(args.vote)
+_, shard_size = chirotonia.get_shards(args.vote)
+# Indice su disco: i tag gia' inoltrati restano noti anche dopo un riavvio del relayer
+tag_index = TagIndex("./runs/%s_relayer_tags" % session_name)
+relayer = Relayer(chirotonia, args.vote, pkeys, shard_size, args.workers, args.batch, args.max_delay, tag_index)
+server = relayer.server(args.host, args.port)
+logger.info("Relaying ballots for vote %s (%d voters) on http://%s:%d/ballots", args.vote, len(pkeys), args.host, args.port)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+server.server_close()
+logger.info("Submitting queued ballots")
+relayer.close()
+tag_index.close()
+logger.info("Relayer stopped: %s", json.dumps(relayer.stats))
+
+if pipeline is not None:
+    pipeline.close()